@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+Measure the memory used per model object (Task, Job) when large numbers are held in memory, as happens when listing
+tasks.  Each class is compared with an equivalent class that stores its attributes in a per-instance __dict__, which
+is how the model classes were represented before they were given __slots__.
+
+Usage: PYTHONPATH=src python benchmarks/bench_model_memory.py [--count N]
+"""
+
+import argparse
+import datetime
+import gc
+import tracemalloc
+
+from eocis_data_manager.task import Task
+from eocis_data_manager.job import Job
+
+
+def unslotted(cls):
+    """Return a copy of a slotted class whose instances use a __dict__ instead"""
+    members = {k: v for (k, v) in cls.__dict__.items() if k not in ("__slots__", "__dict__", "__weakref__")
+               and k not in cls.__slots__}
+    return type("Unslotted" + cls.__name__, (), members)
+
+
+def measure(factory, count:int) -> float:
+    """Return the number of bytes allocated per object when creating count objects with factory"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [factory(i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return (after - before) / count
+
+
+def make_task(cls, i:int):
+    task = cls("3a0f1a4c-3b63-4bb4-9b5c-4ad0f4e3f1d2", "subset", "task%d" % i, None)
+    task.submission_date_time = datetime.datetime(2023, 1, 1, 12, 0, 0)
+    return task
+
+
+def make_job(cls, i:int):
+    return cls("job%d" % i, "submitter", None)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=200000, help="number of objects to create")
+    args = parser.parse_args()
+
+    print("%-8s %16s %16s" % ("class", "__dict__ bytes", "__slots__ bytes"))
+    for (cls, make) in [(Task, make_task), (Job, make_job)]:
+        legacy_cls = unslotted(cls)
+        before = measure(lambda i: make(legacy_cls, i), args.count)
+        after = measure(lambda i: make(cls, i), args.count)
+        print("%-8s %16.1f %16.1f" % (cls.__name__, before, after))
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+Measure the time taken to encode and decode a typical task spec with each installed JSON backend.
+
+Usage: PYTHONPATH=src python benchmarks/bench_spec_codec.py [--count N]
+"""
+
+import argparse
+import timeit
+
+from eocis_data_manager.spec_codec import SpecCodec
+
+# a spec of the kind created by JobManager.create_tasks for a subset task
+TASK_SPEC = {
+    "SUBMITTER_ID": "user@example.com",
+    "BUNDLE_ID": "ocean",
+    "VARIABLES": ["analysed_sst", "analysed_sst_uncertainty", "sea_ice_fraction"],
+    "AGGREGATION_METHODS": ["mean", "", "mean"],
+    "START_YEAR": "2015", "START_MONTH": "1", "START_DAY": "1",
+    "END_YEAR": "2015", "END_MONTH": "12", "END_DAY": "31",
+    "LAT_MIN": -10.5, "LAT_MAX": 25.25, "LON_MIN": -60.0, "LON_MAX": 15.75,
+    "X_STRIDE": 1, "Y_STRIDE": 1, "T_RESOLUTION": "monthly",
+    "OUTPUT_FORMAT": "netcdf4",
+    "IN_PATH": "/data/esacci_sst/public/CDR3.0_release/Analysis/L4/v3.0.1/2015/*/*/*.nc",
+    "OUT_PATH": "/data/data_service/joboutput/3a0f1a4c-3b63-4bb4-9b5c-4ad0f4e3f1d2/2015",
+    "OUTPUT_NAME_PATTERN": "{Y}{m}{d}{H}{M}{S}-EOCIS-L4-SST-v3.0-fv01.0"
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=100000, help="number of encode/decode operations to time")
+    args = parser.parse_args()
+
+    default_backend = SpecCodec.backend
+    print("%-8s %14s %14s" % ("backend", "encode us/op", "decode us/op"))
+    for backend in SpecCodec.BACKENDS:
+        SpecCodec.use_backend(backend)
+        text = SpecCodec.encode(TASK_SPEC)
+        encode_secs = timeit.timeit(lambda: SpecCodec.encode(TASK_SPEC), number=args.count)
+        decode_secs = timeit.timeit(lambda: SpecCodec.decode(text), number=args.count)
+        print("%-8s %14.2f %14.2f" % (backend, 1e6 * encode_secs / args.count, 1e6 * decode_secs / args.count))
+    print(f"default backend: {default_backend}")
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from psycopg.types.json import Jsonb
+
+from eocis_data_manager.store import Store
+from eocis_data_manager.async_transaction import AsyncTransaction
+from eocis_data_manager.job_operations import JobOperations
+from eocis_data_manager.spec_codec import SpecCodec
+from eocis_data_manager.task import Task
+
+
+class AsyncJobOperations(AsyncTransaction):
+    """
+    asyncio counterpart of JobOperations, providing the operations needed by request handlers running on an event loop.
+    Rows are converted to Job and Task objects by the same code used by JobOperations.
+    """
+
+    def __init__(self, store):
+        super().__init__(store)
+
+    async def create_job(self, job):
+        """
+        creates a job job
+
+        :param job: the job object
+        """
+        await self.execute(
+            "INSERT INTO jobs(job_id, submission_date, submitter_id, spec, state, completion_date) values (%s,%s,%s,%s,%s,%s)",
+            (
+                job.get_job_id(),
+                Store.encode_datetime(job.get_submission_datetime()),
+                job.get_submitter_id(),
+                Jsonb(job.get_spec(), dumps=SpecCodec.encode),
+                job.get_state(),
+                Store.encode_datetime(job.get_completion_datetime())
+            ))
+        return self
+
+    async def update_job(self, job):
+        """
+        updates an existing job
+
+        :param job: the job object
+        """
+        await self.execute(
+            "UPDATE jobs SET submission_date=%s,completion_date=%s,state=%s WHERE job_id=%s",
+            (Store.encode_datetime(job.get_submission_datetime()),
+             Store.encode_datetime(job.get_completion_datetime()),
+             job.get_state(),
+             job.get_job_id()))
+        return self
+
+    async def get_job(self, job_id):
+        """
+        retrieve and return a job given its ID.  Return None if no matching job found
+        """
+        results = await self.fetch_results("SELECT " + JobOperations.job_columns() + " FROM jobs J WHERE job_id = %s", (job_id,))
+        if len(results) == 0:
+            return None
+        else:
+            return JobOperations.make_job(results[0])
+
+    async def job_exists(self, job_id):
+        """
+        check if a job exists
+
+        :param job_id: the id of the job
+        """
+        results = await self.fetch_results("SELECT job_id FROM jobs WHERE job_id=%s", (job_id,))
+        return len(results) > 0
+
+    async def list_jobs(self, states=None, with_spec=True):
+        """
+        list all stored jobs
+
+        :param states: only list jobs in one of these states, if provided
+        :param with_spec: if False, do not fetch the job specs (the returned jobs have a spec of None)
+        """
+        query = "SELECT " + JobOperations.job_columns(with_spec) + " FROM jobs J"
+        if states:
+            results = await self.fetch_results(query + " WHERE state IN (%s)" % (Store.render_value_list(states)))
+        else:
+            results = await self.fetch_results(query)
+        return [JobOperations.make_job(row) for row in results]
+
+    async def list_jobs_by_submitter_id(self, submitter_id, with_spec=True):
+        """
+        list all stored jobs submitted by a particular submitter, ordered by submission date
+
+        :param submitter_id: the id of the submitter
+        :param with_spec: if False, do not fetch the job specs (the returned jobs have a spec of None)
+        """
+        results = await self.fetch_results("SELECT " + JobOperations.job_columns(with_spec) + " FROM jobs J WHERE submitter_id = %s ORDER BY submission_date",
+                                           (submitter_id,))
+        return [JobOperations.make_job(row) for row in results]
+
+    async def remove_job(self, job_id):
+        """
+        delete a job and all its tasks
+
+        :param job_id: the id of the job
+        """
+        await self.execute("DELETE FROM jobs WHERE job_id=%s", (job_id,))
+
+    async def get_task(self, job_id, task_name):
+        """
+        retrieve and return a task given its job ID and task name.  Return None if no matching job found
+        """
+        results = await self.fetch_results("SELECT " + JobOperations.task_columns() + " FROM tasks T WHERE parent_job_id = %s and task_name = %s",
+                                           (job_id, task_name))
+        if len(results) == 0:
+            return None
+        else:
+            return JobOperations.make_task(results[0])
+
+    async def list_job_tasks(self, job_id, with_spec=True):
+        """
+        list all tasks associated with a job
+
+        :param job_id: the id of the job
+        :param with_spec: if False, do not fetch the task specs (the returned tasks have a spec of None)
+        """
+        results = await self.fetch_results("SELECT " + JobOperations.task_columns(with_spec) + " FROM tasks T WHERE parent_job_id = %s",
+                                           (job_id,))
+        return [JobOperations.make_task(row) for row in results]
+
+    async def queue_task(self, job_id, task_name):
+        """
+        add a task to the queue.  Consumers waiting in Store.wait_for_task are notified when the transaction commits.
+        """
+        await self.execute("INSERT INTO task_queue(job_id, task_name) VALUES (%s, %s);", (job_id, task_name))
+        await self.execute("SELECT pg_notify(%s, '');", (Store.TASK_QUEUE_CHANNEL,))
+
+    async def count_jobs_by_state(self, states):
+        """
+        Arguments:
+        :param states: list of the states of interest from ("NEW","RUNNING","COMPLETED","FAILED")
+
+        :return: the number of jobs with the given state
+        """
+        return await self.fetch_value("SELECT COALESCE(SUM(count),0) FROM state_counts WHERE kind = 'JOB' AND job_id = '' AND state IN (%s)" % (
+            Store.render_value_list(states)))
+
+    async def count_tasks_by_state(self, states, job_id=None):
+        """
+        Arguments:
+        :param states: list of the states of interest from ("NEW","RUNNING","COMPLETED","FAILED")
+
+        Keyword Arguments:
+        :param job_id: only count tasks associated with this job id, if provided
+
+        :return: the number of tasks with the given state(s)
+        """
+        states_string = Store.render_value_list(states)
+        return await self.fetch_value("SELECT COALESCE(SUM(count),0) FROM state_counts WHERE kind = 'TASK' AND job_id = %s AND state IN (" + states_string + ")",
+                                      (job_id or "",))
+
+    async def get_task_counts(self, job_id=None):
+        """
+        Arguments:
+        :param job_id: only count tasks associated with this job id, if provided
+
+        :return: a dictionary mapping each task state ("NEW","RUNNING","COMPLETED","FAILED") to the number of tasks in that state
+        """
+        results = await self.fetch_results("SELECT state, SUM(count)::bigint AS count FROM state_counts WHERE kind = 'TASK' AND job_id = %s GROUP BY state", (job_id or "",))
+        counts = {state: 0 for state in Task.getAllStates()}
+        for row in results:
+            counts[row["state"]] = row["count"]
+        return counts
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from eocis_data_manager.async_transaction import AsyncTransaction
+from eocis_data_manager.schema_operations import SchemaOperations
+
+
+class AsyncSchemaOperations(AsyncTransaction):
+    """
+    asyncio counterpart of SchemaOperations, providing read access to the bundles, datasets and variables.
+    Rows are converted to Bundle, DataSet and Variable objects by the same code used by SchemaOperations.
+    """
+
+    def __init__(self, store):
+        super().__init__(store)
+
+    async def list_bundles(self):
+        """
+        list all stored bundles
+        """
+        results = await self.fetch_results(SchemaOperations.BUNDLES_QUERY.format(where=""))
+        return [SchemaOperations.make_bundle(row, row["dataset_ids"]) for row in results]
+
+    async def get_bundle(self, bundle_id):
+        results = await self.fetch_results(SchemaOperations.BUNDLES_QUERY.format(where="WHERE B.bundle_id=%s"), (bundle_id,))
+        if len(results) != 1:
+            return None
+        return SchemaOperations.make_bundle(results[0], results[0]["dataset_ids"])
+
+    async def list_datasets(self):
+        """
+        list all stored datasets/variables
+        """
+        results = await self.fetch_results(SchemaOperations.DATASETS_QUERY.format(where=""))
+        return [self.make_dataset(row) for row in results]
+
+    async def get_dataset(self, dataset_id):
+        results = await self.fetch_results(SchemaOperations.DATASETS_QUERY.format(where="WHERE D.dataset_id=%s"), (dataset_id,))
+        if len(results) != 1:
+            return None
+        return self.make_dataset(results[0])
+
+    def make_dataset(self, row):
+        return SchemaOperations.make_dataset(row, [SchemaOperations.make_variable(r) for r in row["variables"]])
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+The async_store module provides an asyncio counterpart to the store module, for use by services running on an event
+loop (such as the web front end).  It uses the psycopg (version 3) driver and its own connection pool, and works
+against a database created by Store.initialise()
+"""
+
+import logging
+
+from psycopg.types.json import set_json_loads
+from psycopg_pool import AsyncConnectionPool
+
+from eocis_data_manager.store import Store
+from eocis_data_manager.async_transaction import AsyncTransaction
+from eocis_data_manager.spec_codec import SpecCodec
+
+
+class AsyncStore:
+
+    def __init__(self, connection_string="dbname=eocis user=eocis", pool_min_size=1, pool_max_size=10,
+                 pool_idle_timeout=300, pool_checkout_timeout=30):
+        """
+        Implement an asyncio interface to the persistent store based on a PostgreSQL database
+
+        :param connection_string: string containing details of the database to connect to
+        :param pool_min_size: the number of connections to keep open in the connection pool
+        :param pool_max_size: the maximum number of connections that the store will open at any one time
+        :param pool_idle_timeout: close idle connections (above pool_min_size) after this many seconds
+        :param pool_checkout_timeout: wait at most this many seconds for a connection when the pool is exhausted
+
+        The pool is opened by calling open() (or on first use).
+        """
+        self.logger = logging.getLogger("AsyncStore")
+        self.connection_string = connection_string
+        self.pool = AsyncConnectionPool(connection_string, min_size=pool_min_size, max_size=pool_max_size,
+                                        max_idle=pool_idle_timeout, timeout=pool_checkout_timeout,
+                                        check=AsyncConnectionPool.check_connection,
+                                        configure=AsyncStore.configure_connection, open=False)
+        self.opened = False
+
+    @staticmethod
+    async def configure_connection(conn):
+        """Called for each new pooled connection, to decode json and jsonb values using SpecCodec"""
+        set_json_loads(SpecCodec.decode, conn)
+
+    async def open(self):
+        """Open the connection pool"""
+        if not self.opened:
+            await self.pool.open()
+            self.opened = True
+
+    async def close(self):
+        """Close the connection pool"""
+        if self.opened:
+            await self.pool.close()
+            self.opened = False
+
+    async def open_connection(self):
+        """Borrow a connection from the store's connection pool.  Return it by calling release_connection."""
+        await self.open()
+        conn = await self.pool.getconn()
+        if self.connection_string not in Store.verified_schemas:
+            try:
+                await self.check_metadata(conn)
+                await conn.rollback()
+                Store.verified_schemas.add(self.connection_string)
+            except:
+                await self.pool.putconn(conn)
+                raise
+        return conn
+
+    async def release_connection(self, conn):
+        """Return a connection obtained from open_connection to the pool, rolling back any uncommitted work"""
+        await self.pool.putconn(conn)
+
+    async def check_metadata(self, conn):
+        curs = conn.cursor()
+        await curs.execute("SELECT schema, creation_date FROM metadata")
+        results = await curs.fetchall()
+        if len(results) != 1:
+            raise Exception("Database metadata is corrupted")
+
+        (schema, creation_date) = tuple(results[0])
+
+        # check that the database schema matches the schema expected by the software
+        if schema != Store.SCHEMA:
+            raise Exception("Unable to open database.  Database schema %s is different to current version %s." % (
+                schema, Store.SCHEMA))
+
+    def get_pool_stats(self):
+        """
+        :return: a dictionary containing connection pool statistics, as reported by psycopg_pool
+        """
+        return self.pool.get_stats()
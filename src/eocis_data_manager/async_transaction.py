@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from psycopg.rows import dict_row
+
+
+class AsyncTransaction:
+    """
+    asyncio counterpart of Transaction.  Use as an async context manager, which borrows a connection from the store
+    on entry, and commits (or on error rolls back) and returns the connection on exit:
+
+    async with AsyncJobOperations(store) as jo:
+        job = await jo.get_job(job_id)
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.conn = None
+
+    async def __aenter__(self):
+        self.conn = await self.store.open_connection()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        try:
+            if exc_type is None:
+                await self.commit()
+                return True
+            else:
+                await self.rollback()
+                return False
+        finally:
+            await self.close()
+
+    async def commit(self):
+        await self.conn.commit()
+
+    async def rollback(self):
+        await self.conn.rollback()
+
+    async def close(self):
+        """Return this transaction's connection to the store's pool.  Any uncommitted work is rolled back."""
+        if self.conn is not None:
+            await self.store.release_connection(self.conn)
+            self.conn = None
+
+    async def fetch_results(self, sql, parameters=None):
+        """Execute a query and return a list of dictionaries, one per result row"""
+        curs = self.conn.cursor(row_factory=dict_row)
+        await curs.execute(sql, parameters)
+        return await curs.fetchall()
+
+    async def fetch_value(self, sql, parameters=None):
+        """Execute a query and return the first column of the first result row"""
+        curs = self.conn.cursor()
+        await curs.execute(sql, parameters)
+        return (await curs.fetchone())[0]
+
+    async def execute(self, sql, parameters=None):
+        """Execute a statement that does not return results"""
+        curs = self.conn.cursor()
+        await curs.execute(sql, parameters)
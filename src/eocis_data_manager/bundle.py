@@ -17,8 +17,8 @@
 #    along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import os
-import yaml
-from yaml import Loader
+
+from .yaml_cache import YamlCache
 
 """
 The bundle module deals with the representation of a logical bundle of data, consisting of one or more datasets.
@@ -27,6 +27,8 @@ The bundle module deals with the representation of a logical bundle of data, con
 
 class Bundle:
 
+    __slots__ = ("bundle_id", "bundle_name", "spec", "dataset_ids", "enabled")
+
     def __init__(self, bundle_id:str, bundle_name:str, spec:dict, dataset_ids:list[str], enabled=True):
         self.bundle_id = bundle_id
         self.bundle_name = bundle_name
@@ -38,14 +40,13 @@ class Bundle:
     def load_bundle_from_file(path:str) -> "Bundle":
         filename = os.path.split(path)[1]
         bundle_id = os.path.splitext(filename)[0]
-        with open(path) as f:
-            bundle_obj = yaml.load(f.read(),Loader=Loader)
-            enabled = bundle_obj.get("enabled",True)
-            bundle_name = bundle_obj["name"]
-            bundle_spec = bundle_obj.get("spec",{})
-            dataset_ids = bundle_obj.get("datasets",[])
-            return Bundle(bundle_id, bundle_name=bundle_name, spec=bundle_spec,
-                          dataset_ids=dataset_ids, enabled=enabled)
+        bundle_obj = YamlCache.get_default().load(path)
+        enabled = bundle_obj.get("enabled",True)
+        bundle_name = bundle_obj["name"]
+        bundle_spec = bundle_obj.get("spec",{})
+        dataset_ids = bundle_obj.get("datasets",[])
+        return Bundle(bundle_id, bundle_name=bundle_name, spec=bundle_spec,
+                      dataset_ids=dataset_ids, enabled=enabled)
 
     @staticmethod
     def load_bundles(folder:str) -> list["Bundle"]:
@@ -54,6 +55,7 @@ class Bundle:
             if filename.endswith(".yaml"):
                 path = os.path.join(folder,filename)
                 bundles.append(Bundle.load_bundle_from_file(path))
+        YamlCache.get_default().flush()
         return bundles
 
     def __repr__(self) -> str:
@@ -32,10 +32,26 @@ class Config:
     # monitor
     TASK_QUOTA=1                        # the number of regridding tasks that can run in parallel
     JOB_QUOTA=2                         # the number of regridding jobs that can run in parallel
+    JOB_TASK_QUOTA=None                 # the number of tasks from any one job that can run in parallel, None for no limit
+    SUBMITTER_TASK_QUOTA=None           # the number of tasks from any one submitter that can run in parallel, None for no limit
     CLEANUP_AFTER_SECS=100000           # the interval after which a job is cleaned up and its files are deleted
     MAX_TASK_RETRIES = 1                # how many times a failed task can be retried
 
+    # task queue
+    QUEUE_POLICY = "fair_share"         # order in which queued tasks are run: "fifo", "sjf" or "fair_share"
+    QUEUE_AGE_BOOST_SECS = 3600         # raise a queued task's priority by one step each time it waits this long, None to disable
+    TASK_LEASE_SECS = 300               # claimed tasks are requeued unless the worker sends a heartbeat within this time
+
+    # task planning
+    TASK_TARGET_SECS = 1800             # aim to split jobs into tasks estimated to take about this long
+    TASK_OVERHEAD_SECS = 30             # estimated fixed cost of running a task (startup, opening files, writing output)
+    TASK_SECS_PER_MCELL = 0.5           # estimated time to process one million grid cells of one variable at one time step
+    TASK_MAX_TILES = 16                 # split tasks estimated to exceed the target into at most this many spatial tiles
+    TILED_OUTPUT_FORMATS = ["netcdf4"]  # output formats whose tiles can be stitched together by a merge task
+
     # output file location
     OUTPUT_PATH = "/data/data_service/joboutput"  # the path to the location to store job output files
     OUTPUT_FILENAME_PATTERN = "{Y}{m}{d}{H}{M}{S}-EOCIS-{LEVEL}-{PRODUCT}-v{VERSION}-fv01.0"
 
+    # catalog loading
+    CATALOG_CACHE_PATH = None           # file caching parsed bundle/dataset YAML between runs, None to cache only in memory
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+The connection_pool module provides a bounded, thread-safe pool of reusable database connections.
+
+Connections are created lazily (so constructing a pool is free) up to a maximum size.  Callers borrow a connection
+with checkout() and hand it back with checkin().  Connections left idle for longer than the idle timeout are closed,
+down to the minimum pool size, and a connection that has been idle for a while is checked for health before it is
+handed out again.
+"""
+
+import logging
+import threading
+import time
+
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+
+class ConnectionPool:
+
+    def __init__(self, factory, min_size:int=1, max_size:int=10, idle_timeout:float=300, checkout_timeout:float=30,
+                 health_check_after:float=30):
+        """
+        Create a connection pool
+
+        :param factory: a function with no arguments that opens and returns a new connection
+        :param min_size: the number of idle connections to keep open even when they exceed the idle timeout
+        :param max_size: the maximum number of connections (idle and in use) that the pool will open
+        :param idle_timeout: close idle connections (above min_size) that have not been used for this many seconds
+        :param checkout_timeout: raise an exception if no connection becomes available within this many seconds
+        :param health_check_after: run a test query on connections that have been idle for more than this many seconds
+        """
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid connection pool size min={min_size} max={max_size}")
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.health_check_after = health_check_after
+        self.logger = logging.getLogger("ConnectionPool")
+
+        self.lock = threading.Condition()
+        self.idle = []          # list of (connection, time returned to the pool), most recently returned last
+        self.in_use = set()     # ids of connections currently checked out
+        self.retired = set()    # ids of checked out connections to be closed when returned (see close_all)
+        self.opening = 0        # number of connections currently being opened
+
+        # statistics
+        self.checkouts = 0
+        self.waits = 0
+        self.created = 0
+        self.closed = 0
+        self.failed_health_checks = 0
+
+    def checkout(self):
+        """
+        Borrow a connection from the pool, opening a new one if none are idle and the pool is not full.
+
+        :return: an open connection
+        """
+        deadline = time.monotonic() + self.checkout_timeout
+        waited = False
+        with self.lock:
+            self.checkouts += 1
+        while True:
+            conn = None
+            with self.lock:
+                while True:
+                    self.__close_expired()
+                    while self.idle:
+                        (conn, returned_at) = self.idle.pop()
+                        if not conn.closed:
+                            break
+                        self.__close(conn)
+                        conn = None
+                    if conn is not None:
+                        # reserve the connection before releasing the lock to check its health
+                        self.in_use.add(id(conn))
+                        break
+                    if len(self.in_use) + self.opening < self.max_size:
+                        # reserve the slot before releasing the lock to open the connection
+                        self.opening += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise Exception(f"Timed out waiting for a database connection (pool size {self.max_size})")
+                    if not waited:
+                        self.waits += 1
+                        waited = True
+                    self.lock.wait(remaining)
+
+            if conn is None:
+                break
+            # the health check makes a round trip to the server, so is run without holding the lock
+            if time.monotonic() - returned_at <= self.health_check_after or self.__is_healthy(conn):
+                return conn
+            with self.lock:
+                self.in_use.discard(id(conn))
+                self.failed_health_checks += 1
+                self.__close(conn)
+                self.lock.notify()
+
+        try:
+            conn = self.factory()
+        except:
+            with self.lock:
+                self.opening -= 1
+                self.lock.notify()
+            raise
+
+        with self.lock:
+            self.opening -= 1
+            self.in_use.add(id(conn))
+            self.created += 1
+        return conn
+
+    def checkin(self, conn):
+        """
+        Return a connection previously obtained from checkout() to the pool.  Any transaction still open on the
+        connection is rolled back.  Closed or broken connections are discarded.
+
+        :param conn: the connection to return
+        """
+        reusable = not conn.closed
+        if reusable and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except Exception:
+                reusable = False
+
+        with self.lock:
+            self.in_use.discard(id(conn))
+            if id(conn) in self.retired:
+                self.retired.discard(id(conn))
+                reusable = False
+            if reusable:
+                self.idle.append((conn, time.monotonic()))
+            else:
+                self.__close(conn)
+            self.lock.notify()
+
+    def close_all(self):
+        """Close all idle connections.  Connections that are checked out are closed when they are returned."""
+        with self.lock:
+            while self.idle:
+                (conn, _) = self.idle.pop()
+                self.__close(conn)
+            self.retired.update(self.in_use)
+
+    def get_stats(self) -> dict[str,int]:
+        """
+        :return: a dictionary containing pool statistics
+        """
+        with self.lock:
+            return {
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "created": self.created,
+                "closed": self.closed,
+                "failed_health_checks": self.failed_health_checks,
+                "in_use": len(self.in_use),
+                "idle": len(self.idle)
+            }
+
+    def __is_healthy(self, conn) -> bool:
+        # called without the lock held, for a connection reserved by checkout
+        try:
+            curs = conn.cursor()
+            curs.execute("SELECT 1")
+            curs.fetchall()
+            conn.rollback()
+            return True
+        except Exception as ex:
+            self.logger.warning(f"Discarding unhealthy database connection: {ex}")
+            return False
+
+    def __close_expired(self):
+        # called with the lock held.  idle connections are ordered oldest first
+        now = time.monotonic()
+        while len(self.idle) + len(self.in_use) + self.opening > self.min_size and self.idle \
+                and now - self.idle[0][1] > self.idle_timeout:
+            (conn, _) = self.idle.pop(0)
+            self.__close(conn)
+
+    def __close(self, conn):
+        self.closed += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
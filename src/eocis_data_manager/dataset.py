@@ -18,11 +18,10 @@
 
 import os
 import json
-import yaml
 import datetime
-from yaml import Loader
 
 from .time_steps import TimeSteps
+from .yaml_cache import YamlCache
 
 # date format for parsing data values from the YAML file
 DATE_FORMAT = "%d-%m-%Y"
@@ -36,6 +35,8 @@ The dataset module deals with the representation of a dataset, consisting of one
 
 class Variable:
 
+    __slots__ = ("variable_id", "variable_name", "spec")
+
     def __init__(self,variable_id:str,variable_name:str,spec:dict):
         self.variable_id = variable_id
         self.variable_name = variable_name
@@ -56,6 +57,9 @@ class DataSet:
     VALID_TEMPORAL_RESOLUTIONS = [TimeSteps.DAILY.value, TimeSteps.MONTHLY.value]
     VALID_SPATIAL_RESOLUTIONS = ["0.05","0.1","0.25","0.5","1"]
 
+    __slots__ = ("dataset_id", "dataset_name", "temporal_resolution", "spatial_resolution", "start_date", "end_date",
+                 "location", "spec", "_variables", "variables_by_id", "enabled")
+
     def __init__(self, dataset_id:str, dataset_name:str, temporal_resolution:str, spatial_resolution:str, start_date:datetime.date, end_date:datetime.date, location:str, spec:dict, variables:list[Variable], enabled:bool=True):
         self.dataset_id = dataset_id
         self.dataset_name = dataset_name
@@ -76,31 +80,30 @@ class DataSet:
     def load_dataset_from_file(path) -> "DataSet":
         filename = os.path.split(path)[1]
         dataset_id = os.path.splitext(filename)[0]
-        with open(path) as f:
-            dataset_obj = yaml.load(f.read(),Loader=Loader)
-            enabled = dataset_obj.get("enabled",True)
-            dataset_name = dataset_obj["name"]
-            temporal_resolution = dataset_obj["temporal_resolution"]
-            spatial_resolution = dataset_obj["spatial_resolution"]
-            start_date = parse_date(dataset_obj["start_date"])
-            location = dataset_obj["location"]
-            dataset_spec = dataset_obj.get("spec",{})
-            variable_list = dataset_obj.get("variables",{})
-            variables = []
-            for (id,variable) in variable_list.items():
-                name = variable["name"]
-                variable_spec = variable.get("spec",{})
-                variables.append(Variable(id,name,variable_spec))
-
-            return DataSet(dataset_id, dataset_name=dataset_name,
-                           temporal_resolution=temporal_resolution,
-                           spatial_resolution=spatial_resolution,
-                           start_date=start_date,
-                           end_date=None,
-                           location=location,
-                           spec=dataset_spec,
-                           variables=variables,
-                           enabled=enabled)
+        dataset_obj = YamlCache.get_default().load(path)
+        enabled = dataset_obj.get("enabled",True)
+        dataset_name = dataset_obj["name"]
+        temporal_resolution = dataset_obj["temporal_resolution"]
+        spatial_resolution = dataset_obj["spatial_resolution"]
+        start_date = parse_date(dataset_obj["start_date"])
+        location = dataset_obj["location"]
+        dataset_spec = dataset_obj.get("spec",{})
+        variable_list = dataset_obj.get("variables",{})
+        variables = []
+        for (id,variable) in variable_list.items():
+            name = variable["name"]
+            variable_spec = variable.get("spec",{})
+            variables.append(Variable(id,name,variable_spec))
+
+        return DataSet(dataset_id, dataset_name=dataset_name,
+                       temporal_resolution=temporal_resolution,
+                       spatial_resolution=spatial_resolution,
+                       start_date=start_date,
+                       end_date=None,
+                       location=location,
+                       spec=dataset_spec,
+                       variables=variables,
+                       enabled=enabled)
 
     @staticmethod
     def load_datasets(folder) -> list["DataSet"]:
@@ -110,13 +113,21 @@ class DataSet:
                 path = os.path.join(folder, filename)
                 dataset = DataSet.load_dataset_from_file(path)
                 datasets.append(dataset)
+        YamlCache.get_default().flush()
         return datasets
 
+    @property
+    def variables(self) -> list[Variable]:
+        return self._variables
+
+    @variables.setter
+    def variables(self, variables:list[Variable]):
+        # keep an index of the variables by id for get_variable, replace (rather than modify) the list to update it
+        self._variables = variables
+        self.variables_by_id = {v.variable_id: v for v in variables}
+
     def get_variable(self, variable_id):
-        for v in self.variables:
-            if v.variable_id == variable_id:
-                return v
-        return None
+        return self.variables_by_id.get(variable_id, None)
 
     def get_temporal_resolution(self):
         return self.temporal_resolution
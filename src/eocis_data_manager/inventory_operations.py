@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import datetime
+
+from psycopg2.extras import execute_values
+
+from eocis_data_manager.transaction import Transaction
+
+
+class InventoryOperations(Transaction):
+    """
+    Record and query the dates for which each dataset has files on disk.  Each (dataset, year) row of the inventory
+    table holds a bitmap with one bit per day of the year, populated by InventoryScanner.
+    """
+
+    # days (bits) in each year's bitmap, enough for leap years
+    BITMAP_DAYS = 366
+
+    def __init__(self, store):
+        super().__init__(store)
+
+    def get_signatures(self, dataset_id:str) -> dict[int,int]:
+        """
+        :param dataset_id: the id of the dataset
+        :return: a dictionary mapping each year recorded for the dataset to the signature recorded when it was scanned
+        """
+        curs = self.conn.cursor()
+        curs.execute("SELECT year, signature FROM inventory WHERE dataset_id = %s", (dataset_id,))
+        return {year: signature for (year, signature) in curs.fetchall()}
+
+    def update_years(self, dataset_id:str, years:list[tuple[int,int,list[datetime.date],int]]):
+        """
+        Record the dates available for one or more years of a dataset, replacing any existing records for those years
+
+        :param dataset_id: the id of the dataset
+        :param years: a list of (year, signature, dates, file_count) tuples, where dates lists the dates in the year
+                      that have files and file_count is the number of files found, including any that could not be dated
+        """
+        curs = self.conn.cursor()
+        execute_values(curs,
+            """INSERT INTO inventory(dataset_id, year, signature, dates, file_count) VALUES %s
+                ON CONFLICT (dataset_id, year) DO UPDATE SET signature = EXCLUDED.signature, dates = EXCLUDED.dates,
+                                                             file_count = EXCLUDED.file_count;""",
+            [(dataset_id, year, signature, InventoryOperations.encode_bitmap(year, dates), file_count)
+             for (year, signature, dates, file_count) in years])
+
+    def remove_years(self, dataset_id:str, years:list[int]):
+        """
+        Remove the records for years of a dataset that no longer have any files
+
+        :param dataset_id: the id of the dataset
+        :param years: the years to remove
+        """
+        curs = self.conn.cursor()
+        curs.execute("DELETE FROM inventory WHERE dataset_id = %s AND year = ANY(%s)", (dataset_id, list(years)))
+
+    def get_available_dates(self, dataset_id:str, start_date:datetime.date, end_date:datetime.date) -> list[datetime.date]:
+        """
+        :param dataset_id: the id of the dataset
+        :param start_date: the first date of interest
+        :param end_date: the last date of interest (inclusive)
+        :return: a sorted list of the dates in the range for which the dataset has files
+        """
+        curs = self.conn.cursor()
+        curs.execute("SELECT year, dates FROM inventory WHERE dataset_id = %s AND year BETWEEN %s AND %s ORDER BY year",
+                     (dataset_id, start_date.year, end_date.year))
+        return [dt for (year, bitmap) in curs.fetchall()
+                for dt in InventoryOperations.decode_bitmap(year, bytes(bitmap)) if start_date <= dt <= end_date]
+
+    def get_available_years(self, dataset_id:str) -> list[int]:
+        """
+        :param dataset_id: the id of the dataset
+        :return: a sorted list of the years for which the dataset has any files
+        """
+        curs = self.conn.cursor()
+        curs.execute("SELECT year, dates FROM inventory WHERE dataset_id = %s ORDER BY year", (dataset_id,))
+        return [year for (year, bitmap) in curs.fetchall() if any(bytes(bitmap))]
+
+    def get_empty_years(self, dataset_id:str) -> list[int]:
+        """
+        :param dataset_id: the id of the dataset
+        :return: a sorted list of the years whose directories were scanned and found to contain no files
+        """
+        curs = self.conn.cursor()
+        curs.execute("SELECT year FROM inventory WHERE dataset_id = %s AND file_count = 0 ORDER BY year", (dataset_id,))
+        return [year for (year,) in curs.fetchall()]
+
+    def get_end_date(self, dataset_id:str) -> datetime.date:
+        """
+        :param dataset_id: the id of the dataset
+        :return: the latest date for which the dataset has files, or None if no files have been recorded
+        """
+        curs = self.conn.cursor()
+        curs.execute("SELECT year, dates FROM inventory WHERE dataset_id = %s ORDER BY year DESC", (dataset_id,))
+        for (year, bitmap) in curs.fetchall():
+            dates = InventoryOperations.decode_bitmap(year, bytes(bitmap))
+            if dates:
+                return dates[-1]
+        return None
+
+    @staticmethod
+    def encode_bitmap(year:int, dates:list[datetime.date]) -> bytes:
+        """
+        :param year: the year described by the bitmap
+        :param dates: the dates to set in the bitmap, dates outside the year are ignored
+        :return: the bitmap, with bit N of byte N//8 set for day N+1 of the year
+        """
+        bitmap = bytearray((InventoryOperations.BITMAP_DAYS + 7) // 8)
+        for dt in dates:
+            if dt.year == year:
+                day = dt.timetuple().tm_yday - 1
+                bitmap[day // 8] |= 1 << (day % 8)
+        return bytes(bitmap)
+
+    @staticmethod
+    def decode_bitmap(year:int, bitmap:bytes) -> list[datetime.date]:
+        """
+        :param year: the year described by the bitmap
+        :param bitmap: a bitmap created by encode_bitmap
+        :return: a sorted list of the dates set in the bitmap
+        """
+        jan1 = datetime.date(year, 1, 1)
+        return [jan1 + datetime.timedelta(days=idx * 8 + bit)
+                for (idx, byte) in enumerate(bitmap) if byte
+                for bit in range(8) if byte & (1 << bit)]
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+The inventory_scanner module records which dates each dataset has files for, by matching files against the dataset's
+location pattern.  Each year is only rescanned if the modification time of its directory, or of any directory
+below it, has changed since it was last scanned.
+"""
+
+import datetime
+import glob
+import logging
+import os
+import re
+
+from eocis_data_manager.inventory_operations import InventoryOperations
+from eocis_data_manager.dataset import DataSet
+
+
+class InventoryScanner:
+
+    def __init__(self, store):
+        """
+        Create a scanner which updates the inventory table
+
+        :param store: the Store holding the inventory
+        """
+        self.store = store
+        self.logger = logging.getLogger("InventoryScanner")
+
+    def scan(self, dataset:DataSet, rescan_all:bool=False) -> dict[str,int]:
+        """
+        Update the inventory for a dataset, rescanning only years whose directories have changed
+
+        :param dataset: the dataset to scan
+        :param rescan_all: rescan every year, even if its directories have not changed
+        :return: a dictionary with the number of years "scanned", "unchanged" and "removed" and the number of
+                 "unparsed" files for which no date could be determined
+        """
+        summary = {"scanned": 0, "unchanged": 0, "removed": 0, "unparsed": 0}
+        with InventoryOperations(self.store) as ops:
+            signatures = ops.get_signatures(dataset.dataset_id)
+
+        updates = []
+        removed = [year for year in signatures
+                   if year < dataset.start_date.year or year > datetime.date.today().year]
+        for year in range(dataset.start_date.year, datetime.date.today().year + 1):
+            year_dirs = glob.glob(InventoryScanner.year_directory_pattern(dataset.location, year))
+            if not year_dirs:
+                if year in signatures:
+                    removed.append(year)
+                continue
+            signature = max(InventoryScanner.latest_mtime(path) for path in year_dirs)
+            if not rescan_all and signatures.get(year, None) == signature:
+                summary["unchanged"] += 1
+                continue
+            dates = set()
+            paths = glob.glob(InventoryScanner.year_pattern(dataset.location, year))
+            for path in paths:
+                dt = InventoryScanner.parse_date(dataset.location, path, year)
+                if dt is None:
+                    summary["unparsed"] += 1
+                else:
+                    dates.add(dt)
+            updates.append((year, signature, sorted(dates), len(paths)))
+            summary["scanned"] += 1
+
+        with InventoryOperations(self.store) as ops:
+            if updates:
+                ops.update_years(dataset.dataset_id, updates)
+            if removed:
+                ops.remove_years(dataset.dataset_id, removed)
+        summary["removed"] = len(removed)
+        if summary["unparsed"]:
+            self.logger.warning(f"Unable to determine the date of {summary['unparsed']} files in dataset {dataset.dataset_id}")
+        return summary
+
+    @staticmethod
+    def year_pattern(location:str, year:int) -> str:
+        """
+        :param location: a dataset location pattern, which may include {YEAR}, {MONTH} and {DAY}
+        :param year: the year
+        :return: a glob pattern matching the dataset's files for the year
+        """
+        return location.replace("{YEAR}", str(year)).replace("{MONTH}", "*").replace("{DAY}", "*")
+
+    @staticmethod
+    def year_directory_pattern(location:str, year:int) -> str:
+        """
+        :param location: a dataset location pattern
+        :param year: the year
+        :return: a glob pattern matching the directories holding the dataset's files for the year.  This is the
+                 first directory whose name includes {YEAR}, or the directory containing the files if only the
+                 file names include the year
+        """
+        components = location.split("/")
+        depth = len(components) - 1
+        for (idx, component) in enumerate(components[:-1]):
+            if "{YEAR}" in component:
+                depth = idx + 1
+                break
+        return InventoryScanner.year_pattern("/".join(components[:depth]) or "/", year)
+
+    @staticmethod
+    def latest_mtime(path:str) -> int:
+        """
+        :param path: a directory
+        :return: the latest modification time, in ns, of the directory and all directories below it
+        """
+        latest = os.stat(path).st_mtime_ns
+        for (dirpath, dirnames, _) in os.walk(path):
+            for dirname in dirnames:
+                latest = max(latest, os.stat(os.path.join(dirpath, dirname)).st_mtime_ns)
+        return latest
+
+    @staticmethod
+    def parse_date(location:str, path:str, year:int) -> datetime.date:
+        """
+        Work out the date of a file, from the {MONTH} and {DAY} parts of the location pattern if present, otherwise
+        from a YYYYMMDD or YYYYMM date in the file name.  Monthly files without a day are dated on the 1st.
+
+        :param location: the dataset location pattern
+        :param path: the path of a file matching the location pattern
+        :param year: the year of the file
+        :return: the date of the file, or None if it could not be determined
+        """
+        month = day = None
+        match = re.fullmatch(InventoryScanner.location_regex(location), path)
+        if match:
+            month = match.groupdict().get("month", None)
+            day = match.groupdict().get("day", None)
+        if month is None:
+            match = re.search(r"%d(\d\d)(\d\d)?" % year, os.path.basename(path))
+            if match:
+                (month, day) = match.groups()
+        if month is None:
+            return None
+        for dt_day in ([int(day)] if day is not None else []) + [1]:
+            try:
+                return datetime.date(year, int(month), dt_day)
+            except ValueError:
+                pass
+        return None
+
+    @staticmethod
+    def location_regex(location:str) -> str:
+        """
+        :param location: a dataset location pattern
+        :return: a regular expression matching paths that match the pattern, capturing the year, month and day
+        """
+        regex = re.escape(location).replace(r"\*", "[^/]*").replace(r"\?", "[^/]")
+        for (placeholder, group, digits) in [("YEAR", "year", 4), ("MONTH", "month", 2), ("DAY", "day", 2)]:
+            escaped = re.escape("{" + placeholder + "}")
+            regex = regex.replace(escaped, r"(?P<%s>\d{%d})" % (group, digits), 1)
+            regex = regex.replace(escaped, "(?P=%s)" % group)
+        return regex
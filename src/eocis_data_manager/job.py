@@ -29,10 +29,10 @@ A job object also stores the email-address of the user requesting the job
 import uuid
 import datetime
 import math
-import json
 from typing import Any
 
 from .config import Config
+from .spec_codec import SpecCodec
 from .task import Task
 
 class Job:
@@ -42,6 +42,8 @@ class Job:
     Jobs have a state, submission and completion times.
     """
 
+    __slots__ = ("job_id", "submitter_id", "_spec", "spec_text", "state", "submission_date_time", "completion_date_time", "error")
+
     @staticmethod
     def create(spec:dict[str,Any], job_id:str="") -> "Job":
         """factory method to create and return a new job
@@ -55,17 +57,19 @@ class Job:
         job.set_submission_datetime(datetime.datetime.now(datetime.timezone.utc))
         return job
 
-    def __init__(self, job_id:str, submitter_id:str, spec:dict[str,Any]):
+    def __init__(self, job_id:str, submitter_id:str, spec:dict[str,Any], spec_text:str=None):
         """
         Construct a job
 
         :param job_id: the job id (should be unique)
         :param submitter_id: the id of the client submitting the job
         :param spec: a dictionary providing the job's specification
+        :param spec_text: the job's specification as JSON text, decoded only when the spec is first accessed
         """
         self.job_id = job_id
         self.submitter_id = submitter_id
-        self.spec = spec
+        self._spec = spec
+        self.spec_text = spec_text
         self.state = Job.STATE_NEW
         self.submission_date_time = None
         self.completion_date_time = None
@@ -92,6 +96,18 @@ class Job:
     def get_submitter_id(self) -> str:
         return self.submitter_id
 
+    @property
+    def spec(self) -> dict[str,Any]:
+        if self.spec_text is not None:
+            self._spec = SpecCodec.decode(self.spec_text)
+            self.spec_text = None
+        return self._spec
+
+    @spec.setter
+    def spec(self, spec:dict[str,Any]):
+        self._spec = spec
+        self.spec_text = None
+
     def get_spec(self) -> dict[str,Any]:
         return self.spec
 
@@ -153,7 +169,7 @@ class Job:
         attrs = {
             "id":           self.get_job_id(),
             "submitter":    self.submitter_id,
-            "spec":         json.dumps(self.get_spec()),
+            "spec":         SpecCodec.encode(self.get_spec()),
             "state":        self.get_state(),
             "submitted":    str(self.get_submission_datetime()),
             "completed":    str(self.get_completion_datetime()),
@@ -185,9 +201,10 @@ class Job:
         data["submission_date"] = str(self.get_submission_datetime())
         data["completion_date"] = str(self.get_completion_datetime()) if self.state == Job.STATE_COMPLETED else ""
         data["duration"] = self.get_duration_hours()
-        data["new_tasks"] = transaction.count_tasks_by_state([Task.STATE_NEW], self.get_job_id())
-        data["running_tasks"] = transaction.count_tasks_by_state([Task.STATE_RUNNING], self.get_job_id())
-        data["completed_tasks"] = transaction.count_tasks_by_state([Task.STATE_COMPLETED], self.get_job_id())
-        data["failed_tasks"] = transaction.count_tasks_by_state([Task.STATE_FAILED], self.get_job_id())
+        task_counts = transaction.get_task_counts(self.get_job_id())
+        data["new_tasks"] = task_counts[Task.STATE_NEW]
+        data["running_tasks"] = task_counts[Task.STATE_RUNNING]
+        data["completed_tasks"] = task_counts[Task.STATE_COMPLETED]
+        data["failed_tasks"] = task_counts[Task.STATE_FAILED]
         data["expiry_date"] = str(self.get_expiry_date()) if self.state in [Job.STATE_COMPLETED, Job.STATE_FAILED] else ""
         return data
@@ -19,11 +19,13 @@
 import copy
 import os
 import logging
+import shutil
 import zipfile
 
 from .store import Store
 from .job_operations import JobOperations
-from .schema_operations import SchemaOperations
+from .schema_cache import SchemaCache
+from .task_planner import TaskPlanner
 from .task import Task
 from .config import Config
 
@@ -37,23 +39,27 @@ class JobManager:
         :param store: the persistent store
         """
         self.store = store
+        self.schema_cache = SchemaCache(store)
+        self.planner = TaskPlanner(store)
         self.logger = logging.getLogger("JobManager")
 
     def create_tasks(self, job_id:str):
         """
         Create one or more tasks that need to be executed for a given job
 
+        The spec of each subset task lists the input files to read in IN_FILES.  A task may cover several years, so
+        workers should read IN_FILES.  IN_PATH (the dataset location with the year filled in) is only included for
+        tasks covering a single year.
+
         :param job_id: the id of the job in the persistent store
         """
         self.logger.info(f"Creating tasks for job {job_id}")
         with JobOperations(self.store) as jo:
             job = jo.get_job(job_id)
             job_spec = job.get_spec()
-            start_year = int(job_spec["START_YEAR"])
-            end_year = int(job_spec["END_YEAR"])
+            (job_start_date, job_end_date) = TaskPlanner.get_job_dates(job_spec)
             bundle_id = job_spec["BUNDLE_ID"]
-            with SchemaOperations(Store()) as so:
-                bundle = so.get_bundle(bundle_id)
+            bundle = self.schema_cache.get_bundle(bundle_id)
 
             # get a list of (dataset_id, variable_id) tuples
             variables = list(map(lambda v: tuple(v.split(":")), job_spec["VARIABLES"]))
@@ -64,19 +70,30 @@ class JobManager:
             for (dataset_id, variable_id) in variables:
                 dataset_ids.add(dataset_id)
 
+            # the bounding box to process, defaulting to the bundle's bounds
+            bundle_bounds = bundle.spec.get("bounds",{})
+            bounds = (float(job_spec.get("LON_MIN", bundle_bounds.get("minx",-180))),
+                      float(job_spec.get("LON_MAX", bundle_bounds.get("maxx",180))),
+                      float(job_spec.get("LAT_MIN", bundle_bounds.get("miny",-90))),
+                      float(job_spec.get("LAT_MAX", bundle_bounds.get("maxy",90))))
+
+            # tile outputs can only be stitched together for some output formats
+            allow_tiling = job_spec["OUTPUT_FORMAT"] in Config.TILED_OUTPUT_FORMATS
+
+            tasks = []
+
             for task_dataset_id in dataset_ids:
                 task_variables = []
                 aggregation_methods = []
 
-                with SchemaOperations(Store()) as so:
-                    for (dataset_id, variable_id) in variables:
-                        if dataset_id == task_dataset_id:
-                            dataset = so.get_dataset(dataset_id)
-                            dataset_inpath = dataset.location
-                            task_variables.append(variable_id)
-                            variable = dataset.get_variable(variable_id)
-                            aggregation_method = variable.spec.get("aggregation_method","mean")
-                            aggregation_methods.append(aggregation_method)
+                dataset = self.schema_cache.get_dataset(task_dataset_id)
+                dataset_inpath = dataset.location
+                for (dataset_id, variable_id) in variables:
+                    if dataset_id == task_dataset_id:
+                        task_variables.append(variable_id)
+                        variable = dataset.get_variable(variable_id)
+                        aggregation_method = variable.spec.get("aggregation_method","mean")
+                        aggregation_methods.append(aggregation_method)
 
                 dataset_metadata = dataset.spec.get("metadata",{})
                 level = dataset_metadata.get("level","LEVEL")
@@ -87,52 +104,82 @@ class JobManager:
                 output_name_pattern = Config.OUTPUT_FILENAME_PATTERN \
                     .replace("{LEVEL}",level).replace("{PRODUCT}",product).replace("{VERSION}",version)
 
-                # create a task to compute the results for each year that the job includes
-                for year in range(start_year, end_year+1):
+                # create tasks to compute the results for the period that the job includes, limited to the dates
+                # covered by the dataset.  the planner chooses the period covered by each task (a month, quarter,
+                # year or several years) and skips periods with no input files
+                for planned_task in self.planner.plan(dataset, job_start_date, job_end_date, bounds, len(task_variables),
+                                                      allow_tiling):
                     # build a specification for this task
                     task_spec = copy.deepcopy(job_spec)
-                    # if not the first year in the job, include data from January 1st
-                    if year > start_year:
-                        task_spec["START_MONTH"] = "1"
-                        task_spec["START_DAY"] = "1"
-                    # if not the last year in the job, include data up to December 31st
-                    if year < end_year:
-                        task_spec["END_MONTH"] = "12"
-                        task_spec["END_DAY"] = "31"
+                    task_spec["START_YEAR"] = str(planned_task.start_date.year)
+                    task_spec["START_MONTH"] = str(planned_task.start_date.month)
+                    task_spec["START_DAY"] = str(planned_task.start_date.day)
+                    task_spec["END_YEAR"] = str(planned_task.end_date.year)
+                    task_spec["END_MONTH"] = str(planned_task.end_date.month)
+                    task_spec["END_DAY"] = str(planned_task.end_date.day)
                     task_spec["VARIABLES"] = task_variables
-                    task_spec["IN_PATH"] = dataset_inpath.replace("{YEAR}", str(year))
-                    task_spec["OUT_PATH"] = os.path.join(output_path, str(year))
-                    task_spec["START_YEAR"] = task_spec["END_YEAR"] = str(year)
+                    if planned_task.start_date.year == planned_task.end_date.year:
+                        task_spec["IN_PATH"] = dataset_inpath.replace("{YEAR}", str(planned_task.start_date.year))
+                    task_spec["IN_FILES"] = planned_task.in_files
+                    task_spec["CHUNK"] = planned_task.label
+                    task_spec["ESTIMATED_SECS"] = planned_task.estimated_secs
+                    task_spec["OUT_PATH"] = os.path.join(output_path, planned_task.label)
                     task_spec["OUTPUT_NAME_PATTERN"] = output_name_pattern
                     task_spec["OUTPUT_FORMAT"] = job_spec["OUTPUT_FORMAT"]
                     task_spec["AGGREGATION_METHODS"] = aggregation_methods
-                    if "LON_MIN" not in task_spec:
-                        task_spec["LON_MIN"] = bundle.spec.get("bounds",{}).get("minx",-180)
-                    if "LON_MAX" not in task_spec:
-                        task_spec["LON_MAX"] = bundle.spec.get("bounds",{}).get("maxx",180)
-                    if "LAT_MIN" not in task_spec:
-                        task_spec["LAT_MIN"] = bundle.spec.get("bounds",{}).get("miny",-90)
-                    if "LAT_MAX" not in task_spec:
-                        task_spec["LAT_MAX"] = bundle.spec.get("bounds",{}).get("maxy",90)
-
-                    # create a new task
-                    task = Task.create(task_spec,job_id,task_type="subset")
-                    # persist it
-                    jo.create_task(task)
-                    # queue for execution
-                    jo.queue_task(job_id, task.get_task_name())
-                    self.logger.info(f"Created task {task.get_task_name()} for job {job_id}")
+                    (task_spec["LON_MIN"], task_spec["LON_MAX"], task_spec["LAT_MIN"], task_spec["LAT_MAX"]) = bounds
+
+                    if not planned_task.tiles:
+                        # create a new task
+                        tasks.append(Task.create(task_spec,job_id,task_type="subset"))
+                        continue
+
+                    # create a subset task for each tile, writing to its own folder, and a merge task to stitch the
+                    # tile outputs together once they have all completed (see update_job).  the folders are named
+                    # after the (unique) merge task, as other datasets in the job may have periods with the same label
+                    merge_task = Task.create({},job_id,task_type="merge")
+                    merge_task_name = merge_task.get_task_name()
+                    tile_paths = [os.path.join(output_path, "tiles", merge_task_name, str(idx))
+                                  for idx in range(len(planned_task.tiles))]
+                    merge_spec = copy.deepcopy(task_spec)
+                    merge_spec["TILE_PATHS"] = tile_paths
+                    merge_spec["OUT_PATH"] = os.path.join(output_path, "merged", merge_task_name)
+                    merge_task.spec = merge_spec
+                    for (idx, (tile_bounds, tile_estimated_secs)) in enumerate(planned_task.tiles):
+                        tile_spec = copy.deepcopy(task_spec)
+                        (tile_spec["LON_MIN"], tile_spec["LON_MAX"], tile_spec["LAT_MIN"], tile_spec["LAT_MAX"]) = tile_bounds
+                        tile_spec["ESTIMATED_SECS"] = tile_estimated_secs
+                        tile_spec["TILE"] = idx
+                        tile_spec["MERGE_TASK"] = merge_task.get_task_name()
+                        tile_spec["OUT_PATH"] = tile_paths[idx]
+                        tasks.append(Task.create(tile_spec,job_id,task_type="subset"))
+                    tasks.append(merge_task)
+
+            if not tasks:
+                # none of the datasets have any data in the requested period
+                jo.update_job(job.set_failed("No data is available for the requested dates"))
+                self.logger.info(f"Job {job_id} failed, no data is available for the requested dates")
+                return
+
+            # persist the tasks and queue them for execution, merge tasks are queued when their tiles are complete
+            jo.create_tasks_bulk(tasks)
+            jo.queue_tasks_bulk([(job_id, task.get_task_name()) for task in tasks if task.get_task_type() != "merge"])
+            self.logger.info(f"Created {len(tasks)} tasks for job {job_id}")
 
     def zip_results(self, task:Task) -> str:
         """
-        When a task is complete, zip up the output files
+        When a task is complete, zip up the output files.  The output of tile tasks is not zipped, it is collected
+        by the merge task for the tiles.
 
         :param task: the completed task
-        :return: the path of the created zip file
+        :return: the path of the created zip file, or None for a tile task
         """
+        if "MERGE_TASK" in task.spec:
+            return None
         output_path = os.path.join(Config.OUTPUT_PATH, task.get_job_id())
-        year = task.spec["END_YEAR"]
-        zip_path = os.path.join(output_path,year+".zip")
+        # tasks are named by the period they cover (tasks created before periods were introduced cover one year)
+        label = task.spec.get("CHUNK", task.spec["END_YEAR"])
+        zip_path = os.path.join(output_path,label+".zip")
         task_out_path = task.spec["OUT_PATH"]
         output_files = os.listdir(task_out_path)
         if len(output_files):
@@ -143,6 +190,38 @@ class JobManager:
                     os.remove(file_path)
         return zip_path
 
+    def merge_tiles(self, task:Task) -> list[str]:
+        """
+        Execute a merge task, stitching together the netcdf4 files output by each of its tile tasks into files in the
+        merge task's OUT_PATH.  The tile outputs are removed.
+
+        Merge tasks (task type "merge") are queued by update_job once all of their tile tasks have completed.  The
+        worker that claims a merge task should call this method instead of running a subset operation, and then
+        handle the task's completion in the same way as for other tasks, calling zip_results and update_job.
+
+        :param task: the merge task
+        :return: the names of the merged files
+        """
+        import xarray as xr
+
+        out_path = task.spec["OUT_PATH"]
+        os.makedirs(out_path, exist_ok=True)
+        tile_paths = [path for path in task.spec["TILE_PATHS"] if os.path.exists(path)]
+        file_names = sorted(set(file_name for path in tile_paths for file_name in os.listdir(path)))
+        for file_name in file_names:
+            if not file_name.endswith(".nc"):
+                raise Exception(f"Unable to merge tile output file {file_name}, only netcdf4 files can be merged")
+            paths = [os.path.join(path, file_name) for path in tile_paths if os.path.exists(os.path.join(path, file_name))]
+            with xr.open_mfdataset(paths, combine="by_coords") as ds:
+                ds.to_netcdf(os.path.join(out_path, file_name))
+        for path in tile_paths:
+            shutil.rmtree(path)
+        # remove the merge task's (now empty) folder of tiles
+        tiles_folder = os.path.dirname(task.spec["TILE_PATHS"][0])
+        if os.path.isdir(tiles_folder) and not os.listdir(tiles_folder):
+            os.rmdir(tiles_folder)
+        return file_names
+
     def update_job(self, job_id:str):
         """
         When a task has been completed or failed, update the job's status if there are no remaining tasks
@@ -151,11 +230,17 @@ class JobManager:
         TODO need some logic to unqueue all remaining queued tasks if even one task has failed
         """
         with JobOperations(self.store) as jo:
-            new_running_count = jo.count_tasks_by_state([Task.STATE_NEW, Task.STATE_RUNNING], job_id=job_id)
+            jo.lock_job(job_id)
+            # start any merge tasks whose tiles have all completed, and fail those that can never run
+            jo.fail_blocked_merge_tasks(job_id)
+            if jo.queue_ready_merge_tasks(job_id):
+                self.logger.info(f"Queued merge tasks for job {job_id}")
+            task_counts = jo.get_task_counts(job_id)
+            new_running_count = task_counts[Task.STATE_NEW] + task_counts[Task.STATE_RUNNING]
             self.logger.info(f"Job {job_id} has {new_running_count} active tasks")
             job = jo.get_job(job_id)
             if new_running_count == 0:
-                failed_count = jo.count_tasks_by_state([Task.STATE_FAILED], job_id=job_id)
+                failed_count = task_counts[Task.STATE_FAILED]
                 if failed_count == 0:
                     job.set_completed()
                     self.logger.info(f"Job {job_id} completed")
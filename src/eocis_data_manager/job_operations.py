@@ -16,26 +16,48 @@
 #    You should have received a copy of the GNU Affero General Public License
 #    along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import json
+import datetime
+
+from psycopg2.extras import execute_values
 
 from eocis_data_manager.store import Store
 from eocis_data_manager.transaction import Transaction
+from eocis_data_manager.config import Config
 
 from eocis_data_manager.task import Task
 from eocis_data_manager.job import Job
 
+
+class LeaseLostException(Exception):
+    """Raised by JobOperations.update_task when a task is no longer leased to the claim that the caller holds"""
+    pass
+
+
 class JobOperations(Transaction):
 
+    # maximum number of rows sent in each statement by the bulk insert methods
+    BULK_PAGE_SIZE = 1000
+
+    # columns selected from the jobs (J) and tasks (T) tables.  specs are fetched as JSON text and only decoded when
+    # first accessed, and are not fetched at all (spec is NULL) by listings called with with_spec=False
+    JOB_COLUMNS = "J.job_id, J.submission_date, J.submitter_id, {spec} AS spec, J.state, J.completion_date, J.error"
+    TASK_COLUMNS = "T.parent_job_id, T.task_type, T.task_name, T.submission_date, T.remote_task_id, {spec} AS spec, " \
+                   "T.state, T.completion_date, T.error, T.retry_count, T.lease_expiry, T.lease_id::text AS lease_id"
+
+    # the dequeue policies that can be selected with Config.QUEUE_POLICY
+    QUEUE_POLICIES = ["fifo", "sjf", "fair_share"]
+
     def __init__(self, store):
         super().__init__(store)
 
     def compute_summary(self):
-
+        """
+        :return: a list of {"TYPE": "JOB" or "TASK", "STATE": state, "COUNT": count} dictionaries, for each non-zero count
+        """
         curs = self.conn.cursor()
 
-        curs.execute("SELECT 'JOB' AS 'TYPE', state AS STATE, COUNT(*) AS COUNT FROM jobs GROUP BY state" +
-                     " UNION " +
-                     "SELECT 'TASK' AS 'TYPE', state AS STATE, COUNT(*) AS COUNT FROM tasks GROUP BY state")
+        curs.execute("""SELECT kind AS "TYPE", state AS "STATE", SUM(count)::bigint AS "COUNT" FROM state_counts
+                            WHERE job_id = '' GROUP BY kind, state HAVING SUM(count) > 0 ORDER BY kind, state""")
         return self.collect_results(curs)
 
     def create_job(self, job):
@@ -51,7 +73,7 @@ class JobOperations(Transaction):
                 job.get_job_id(),
                 Store.encode_datetime(job.get_submission_datetime()),
                 job.get_submitter_id(),
-                json.dumps(job.get_spec()),
+                Store.encode_spec(job.get_spec()),
                 job.get_state(),
                 Store.encode_datetime(job.get_completion_datetime())
             ))
@@ -86,19 +108,42 @@ class JobOperations(Transaction):
                 task.get_task_type(),
                 task.get_task_name(),
                 Store.encode_datetime(task.get_submission_datetime()),
-                json.dumps(task.get_spec()),
+                Store.encode_spec(task.get_spec()),
                 task.get_state(),
                 Store.encode_datetime(task.get_completion_datetime()),
                 task.get_error(),
                 task.get_retry_count()))
         return self
 
+    def create_tasks_bulk(self, tasks):
+        """
+        stores a list of new tasks using a single multi-row insert
+
+        :param tasks: a list of task objects
+        """
+        curs = self.conn.cursor()
+        execute_values(curs,
+            "INSERT INTO tasks(parent_job_id, task_type, task_name, submission_date, spec, state, completion_date, error, retry_count) VALUES %s;",
+            [(
+                task.get_job_id(),
+                task.get_task_type(),
+                task.get_task_name(),
+                Store.encode_datetime(task.get_submission_datetime()),
+                Store.encode_spec(task.get_spec()),
+                task.get_state(),
+                Store.encode_datetime(task.get_completion_datetime()),
+                task.get_error(),
+                task.get_retry_count()) for task in tasks],
+            page_size=JobOperations.BULK_PAGE_SIZE)
+        return self
+
     def get_task(self, job_id, task_name):
         """
         retrieve and return a task given its job ID and task name.  Return None if no matching job found
         """
         curs = self.conn.cursor()
-        curs.execute("SELECT * FROM tasks WHERE parent_job_id = %s and task_name = %s", (job_id,task_name))
+        curs.execute("SELECT " + JobOperations.task_columns() + " FROM tasks T WHERE parent_job_id = %s and task_name = %s",
+                     (job_id,task_name))
 
         tasks = self.collect_tasks(self.collect_results(curs))
         if len(tasks) == 0:
@@ -107,11 +152,32 @@ class JobOperations(Transaction):
             return tasks[0]
 
     def queue_task(self, job_id, task_name):
+        """
+        add a task to the queue.  Consumers waiting in Store.wait_for_task are notified when the transaction commits.
+        """
         curs = self.conn.cursor()
         curs.execute(
             """INSERT INTO task_queue(job_id, task_name) VALUES (%s, %s);""",
             (job_id, task_name)
         )
+        self.notify_task_queued(curs)
+
+    def notify_task_queued(self, curs):
+        curs.execute("SELECT pg_notify(%s, '');", (Store.TASK_QUEUE_CHANNEL,))
+
+    def queue_tasks_bulk(self, task_ids):
+        """
+        add a list of tasks to the queue using a single multi-row insert.  Tasks are queued in list order.
+        Consumers waiting in Store.wait_for_task are notified when the transaction commits.
+
+        :param task_ids: a list of (job_id, task_name) tuples
+        """
+        curs = self.conn.cursor()
+        execute_values(curs,
+            "INSERT INTO task_queue(job_id, task_name) VALUES %s;",
+            task_ids, page_size=JobOperations.BULK_PAGE_SIZE)
+        if task_ids:
+            self.notify_task_queued(curs)
 
     def clear_task_queue(self):
         curs = self.conn.cursor()
@@ -125,18 +191,21 @@ class JobOperations(Transaction):
         return list(map(lambda row: (row["job_id"],row["task_name"]), self.collect_results(curs)))
 
     def get_next_task(self):
+        """
+        remove the next task from the queue (according to Config.QUEUE_POLICY) and return it, without changing its
+        state.  Task quotas are not applied and the task is not leased, so it is lost if the caller fails before
+        running it.  Use claim_tasks to start tasks within the quotas, leased to the worker.
+
+        :return: the task, or None if the queue is empty
+        """
+        (select_sql, parameters) = JobOperations.select_queued(Config.QUEUE_POLICY, Config.QUEUE_AGE_BOOST_SECS)
         curs = self.conn.cursor()
         curs.execute(
-            """DELETE FROM task_queue 
-                WHERE id = (
-                  SELECT id
-                  FROM task_queue
-                  ORDER BY queue_time ASC 
-                  FOR UPDATE SKIP LOCKED
-                  LIMIT 1
-                )
-                RETURNING *;"""
-        )
+            """WITH picked AS (""" + select_sql + """)
+                DELETE FROM task_queue Q USING picked
+                  WHERE Q.id = picked.id
+                  RETURNING Q.job_id, Q.task_name;""",
+            parameters + [1])
         results = self.collect_results(curs)
         if len(results) == 0:
             return None
@@ -145,31 +214,344 @@ class JobOperations(Transaction):
             job_id = results[0]["job_id"]
             return self.get_task(job_id, task_name)
 
+    @staticmethod
+    def select_queued(policy:str, age_boost_secs:float=None, task_quota:int=None, job_quota:int=None,
+                      job_task_quota:int=None, submitter_task_quota:int=None):
+        """
+        build a query that selects and locks the queued tasks that should run next, skipping tasks locked by other
+        transactions.  The query returns the queue id and priority of each task, lower priorities running first:
+
+        fifo - every task has priority 0 and tasks run in the order they were queued
+        sjf - shortest (estimated) job first, the priority is the estimated run time of the job's queued tasks
+              in units of Config.TASK_TARGET_SECS
+        fair_share - the priority is the number of running tasks belonging to the task's submitter, plus the number of
+                     the submitter's tasks queued ahead of it, divided by the submitter's weight (see submitter_weights)
+
+        Under the sjf and fair_share policies the priority of a task is reduced by one for every age_boost_secs
+        that it has been queued, so that big jobs and busy submitters are not starved.  Ties run in queue order.
+
+        Tasks that would take the number of RUNNING tasks over any of the quotas are not selected.  Queued tasks are
+        considered in priority order, so a task held back by a quota does not block lower priority tasks that fit.
+
+        :param policy: the dequeue policy, one of JobOperations.QUEUE_POLICIES
+        :param age_boost_secs: boost priority by one step for each period of this many seconds spent queued, or None
+        :param task_quota: the maximum number of running tasks, or None for no limit
+        :param job_quota: the maximum number of jobs with running tasks, or None for no limit
+        :param job_task_quota: the maximum number of running tasks belonging to any one job, or None for no limit
+        :param submitter_task_quota: the maximum number of running tasks belonging to any one submitter, or None
+        :return: a (sql, parameters) tuple.  The sql ends with a LIMIT %s placeholder whose value should be appended
+                 to the parameters list.
+        """
+        parameters = []
+        if policy == "fifo":
+            priority = "0"
+            joins = ""
+        elif policy == "sjf":
+            priority = "S.job_secs / %s"
+            parameters.append(float(Config.TASK_TARGET_SECS))
+            joins = """JOIN (SELECT job_id, SUM(estimated_secs) AS job_secs FROM task_queue GROUP BY job_id) S
+                         ON S.job_id = Q.job_id"""
+        elif policy == "fair_share":
+            priority = "(COALESCE(R.running, 0) + P.position) / COALESCE(W.weight, 1)"
+            joins = """JOIN (SELECT id, ROW_NUMBER() OVER (PARTITION BY submitter_id ORDER BY queue_time, id) - 1
+                              AS position FROM task_queue) P ON P.id = Q.id
+                       LEFT JOIN (SELECT J.submitter_id, COUNT(*) AS running FROM tasks T
+                                    JOIN jobs J ON J.job_id = T.parent_job_id
+                                    WHERE T.state = 'RUNNING' GROUP BY J.submitter_id) R
+                         ON R.submitter_id = Q.submitter_id
+                       LEFT JOIN submitter_weights W ON W.submitter_id = Q.submitter_id"""
+        else:
+            raise Exception(f"Unknown queue policy {policy}, expected one of {JobOperations.QUEUE_POLICIES}")
+
+        if policy != "fifo" and age_boost_secs:
+            priority += " - EXTRACT(EPOCH FROM now() - Q.queue_time) / %s"
+            parameters.append(float(age_boost_secs))
+
+        if task_quota is None and job_quota is None and job_task_quota is None and submitter_task_quota is None:
+            sql = f"""SELECT Q.id, ({priority})::double precision AS priority
+                        FROM task_queue Q {joins}
+                        ORDER BY priority ASC, Q.queue_time ASC, Q.id ASC
+                        FOR UPDATE OF Q SKIP LOCKED
+                        LIMIT %s"""
+            return (sql, parameters)
+
+        # rank the whole queue, then drop the tasks that do not fit within each quota in turn.  Each filter numbers
+        # the remaining tasks in priority order (ord) using a window function and compares with the running counts
+        columns = "id, job_id, submitter_id, priority, ord, job_running, submitter_running"
+        ctes = [f"""queued AS (
+                        SELECT Q.id, Q.job_id, Q.submitter_id, Q.queue_time, ({priority})::double precision AS priority
+                          FROM task_queue Q {joins})""",
+                """running AS (
+                        SELECT T.parent_job_id AS job_id, J.submitter_id, COUNT(*) AS n FROM tasks T
+                          JOIN jobs J ON J.job_id = T.parent_job_id
+                          WHERE T.state = 'RUNNING' GROUP BY T.parent_job_id, J.submitter_id)""",
+                """ranked AS (
+                        SELECT Q.id, Q.job_id, Q.submitter_id, Q.priority,
+                               ROW_NUMBER() OVER (ORDER BY Q.priority, Q.queue_time, Q.id) AS ord,
+                               COALESCE(RJ.n, 0) AS job_running, COALESCE(RS.n, 0) AS submitter_running
+                          FROM queued Q
+                          LEFT JOIN running RJ ON RJ.job_id = Q.job_id
+                          LEFT JOIN (SELECT submitter_id, SUM(n) AS n FROM running GROUP BY submitter_id) RS
+                            ON RS.submitter_id = Q.submitter_id)"""]
+        filters = []
+        if job_task_quota is not None:
+            filters.append(("ROW_NUMBER() OVER (PARTITION BY job_id ORDER BY ord)",
+                            "job_running + w <= %s", job_task_quota))
+        if submitter_task_quota is not None:
+            filters.append(("ROW_NUMBER() OVER (PARTITION BY submitter_id ORDER BY ord)",
+                            "submitter_running + w <= %s", submitter_task_quota))
+        if job_quota is not None:
+            # jobs without running tasks are started in order of their highest priority task
+            filters.append(("DENSE_RANK() OVER (PARTITION BY job_running > 0 ORDER BY first_ord)",
+                            "job_running > 0 OR w <= %s - (SELECT COUNT(*) FROM running)", job_quota))
+        if task_quota is not None:
+            filters.append(("ROW_NUMBER() OVER (ORDER BY ord)",
+                            "w <= %s - (SELECT COALESCE(SUM(n), 0) FROM running)", task_quota))
+
+        source = "ranked"
+        for (index, (window, condition, quota)) in enumerate(filters):
+            if "first_ord" in window:
+                source = f"(SELECT {columns}, MIN(ord) OVER (PARTITION BY job_id) AS first_ord FROM {source}) F"
+            ctes.append(f"""allowed{index} AS (
+                        SELECT {columns} FROM (SELECT {columns}, {window} AS w FROM {source}) X
+                          WHERE {condition})""")
+            parameters.append(quota)
+            source = f"allowed{index}"
+
+        sql = "WITH " + ",\n".join(ctes) + f"""
+                    SELECT Q.id, A.priority FROM task_queue Q
+                      JOIN {source} A ON A.id = Q.id
+                      ORDER BY A.ord
+                      FOR UPDATE OF Q SKIP LOCKED
+                      LIMIT %s"""
+        return (sql, parameters)
+
+    def claim_next_task(self, worker_id=None):
+        """
+        remove the next task from the queue, mark it as RUNNING and return it, in a single round trip
+
+        :param worker_id: an identifier for the worker claiming the task, recorded as the task's remote task id
+        :return: the claimed task, or None if the queue is empty
+        """
+        tasks = self.claim_tasks(1, worker_id)
+        if len(tasks) == 0:
+            return None
+        else:
+            return tasks[0]
+
+    def claim_tasks(self, n, worker_id=None):
+        """
+        remove up to n tasks from the front of the queue (according to Config.QUEUE_POLICY), mark them as RUNNING and
+        return them, in a single round trip.
+
+        Each claimed task is leased to the worker for Config.TASK_LEASE_SECS.  The worker should renew the lease by
+        calling heartbeat while it runs the task, otherwise the task is requeued by requeue_expired_tasks.
+
+        Tasks are only claimed while the number of running tasks stays within Config.TASK_QUOTA, JOB_QUOTA,
+        JOB_TASK_QUOTA and SUBMITTER_TASK_QUOTA.  To make this safe when several processes claim tasks, claiming takes
+        a transaction-level lock (Store.CLAIM_LOCK_ID) that is held until the transaction ends, so the transaction
+        should be committed promptly after claiming.
+
+        :param n: the maximum number of tasks to claim
+        :param worker_id: an identifier for the worker claiming the tasks, recorded as each task's remote task id
+        :return: a list of the claimed tasks, in priority order
+        """
+        (select_sql, parameters) = JobOperations.select_queued(Config.QUEUE_POLICY, Config.QUEUE_AGE_BOOST_SECS,
+                                                               task_quota=Config.TASK_QUOTA,
+                                                               job_quota=Config.JOB_QUOTA,
+                                                               job_task_quota=Config.JOB_TASK_QUOTA,
+                                                               submitter_task_quota=Config.SUBMITTER_TASK_QUOTA)
+        curs = self.conn.cursor()
+        if Config.TASK_QUOTA is not None or Config.JOB_QUOTA is not None \
+                or Config.JOB_TASK_QUOTA is not None or Config.SUBMITTER_TASK_QUOTA is not None:
+            # serialise claims so that each sees the tasks marked RUNNING by the last.  this must be a separate
+            # statement, as (in READ COMMITTED) each statement sees the data committed before the statement started
+            curs.execute("SELECT pg_advisory_xact_lock(%s);", (Store.CLAIM_LOCK_ID,))
+        curs.execute(
+            """WITH picked AS (""" + select_sql + """),
+                next AS (
+                  DELETE FROM task_queue Q USING picked
+                    WHERE Q.id = picked.id
+                    RETURNING Q.id, Q.job_id, Q.task_name, picked.priority
+                )
+                UPDATE tasks T SET state='RUNNING', submission_date=now(), remote_task_id=%s,
+                                   lease_expiry=now() + %s * interval '1 second', lease_id=gen_random_uuid()
+                  FROM next
+                  WHERE T.parent_job_id = next.job_id AND T.task_name = next.task_name
+                  RETURNING """ + JobOperations.task_columns() + """, next.id AS queue_id, next.priority;""",
+            parameters + [n, worker_id, Config.TASK_LEASE_SECS])
+        results = sorted(self.collect_results(curs), key=lambda row: (row["priority"], row["queue_id"]))
+        return self.collect_tasks(results)
+
+    def set_submitter_weight(self, submitter_id, weight):
+        """
+        set a submitter's share of the task slots under the fair_share queue policy.  Submitters without a weight
+        have weight 1, so a submitter with weight 2 is allowed twice as many running tasks as other submitters.
+
+        :param submitter_id: the submitter
+        :param weight: a positive weight, or None to restore the default weight
+        """
+        curs = self.conn.cursor()
+        if weight is None:
+            curs.execute("DELETE FROM submitter_weights WHERE submitter_id = %s", (submitter_id,))
+        elif weight <= 0:
+            raise Exception(f"Submitter weight must be positive, not {weight}")
+        else:
+            curs.execute("""INSERT INTO submitter_weights(submitter_id, weight) VALUES (%s, %s)
+                              ON CONFLICT (submitter_id) DO UPDATE SET weight = EXCLUDED.weight;""",
+                         (submitter_id, weight))
+
+    def get_submitter_weights(self):
+        """
+        :return: a dictionary mapping submitter id to weight, for submitters whose weight has been set
+        """
+        curs = self.conn.cursor()
+        curs.execute("SELECT submitter_id, weight FROM submitter_weights;")
+        return {row["submitter_id"]: row["weight"] for row in self.collect_results(curs)}
 
     def update_task(self, task):
         """
-        updates an existing task
+        updates an existing task.
+
+        A task moving to the RUNNING state is leased for Config.TASK_LEASE_SECS (see heartbeat), and the lease is
+        cleared when the task leaves the RUNNING state.  A leased task (one returned by claim_tasks, for example) is
+        only updated while it is still leased to the same claim (identified by the task's lease id), so a worker whose
+        lease expired cannot overwrite the task once it has been requeued or claimed again.
 
         :param task: the task object
-        """
+        :raises LeaseLostException: if the task was not updated because its lease has been lost
+        """
+        parameters = [Store.encode_datetime(task.get_submission_datetime()),
+                      Store.encode_datetime(task.get_completion_datetime()),
+                      task.get_error(),
+                      task.get_state(),
+                      task.get_retry_count(),
+                      task.get_state(),
+                      Config.TASK_LEASE_SECS,
+                      task.get_state(),
+                      task.get_job_id(),
+                      task.get_task_name()]
+        lease_check = ""
+        if task.get_lease_id() is not None:
+            lease_check = " AND state = 'RUNNING' AND lease_id = %s"
+            parameters.append(task.get_lease_id())
         curs = self.conn.cursor()
         curs.execute(
-            "UPDATE tasks SET submission_date=%s,completion_date=%s,error=%s,state=%s,retry_count=%s WHERE parent_job_id=%s AND task_name=%s",
-            (Store.encode_datetime(task.get_submission_datetime()),
-             Store.encode_datetime(task.get_completion_datetime()),
-             task.get_error(),
-             task.get_state(),
-             task.get_retry_count(),
-             task.get_job_id(),
-             task.get_task_name()))
+            """UPDATE tasks SET submission_date=%s, completion_date=%s, error=%s, state=%s, retry_count=%s,
+                    lease_expiry = CASE WHEN %s <> 'RUNNING' THEN NULL
+                                        WHEN state = 'RUNNING' AND lease_expiry IS NOT NULL THEN lease_expiry
+                                        ELSE now() + %s * interval '1 second' END,
+                    lease_id = CASE WHEN %s <> 'RUNNING' THEN NULL
+                                    WHEN state = 'RUNNING' AND lease_id IS NOT NULL THEN lease_id
+                                    ELSE gen_random_uuid() END
+                WHERE parent_job_id=%s AND task_name=%s""" + lease_check + " RETURNING lease_expiry, lease_id::text;",
+            parameters)
+        row = curs.fetchone()
+        if row is None:
+            raise LeaseLostException(f"Task {task.get_task_name()} of job {task.get_job_id()} is no longer leased "
+                                     f"to this worker")
+        task.set_lease_expiry(Store.decode_datetime(row[0])).set_lease_id(row[1])
         return self
 
-    def reset_running_tasks(self):
+    def lock_job(self, job_id):
         """
-        mark all running tasks as new.
+        lock a job's row until the end of the transaction, so that concurrent updates to the job are serialised
+
+        :param job_id: the id of the job
         """
         curs = self.conn.cursor()
-        curs.execute("UPDATE tasks SET state='NEW' WHERE state='RUNNING'")
+        curs.execute("SELECT job_id FROM jobs WHERE job_id = %s FOR UPDATE", (job_id,))
+
+    def queue_ready_merge_tasks(self, job_id):
+        """
+        queue the merge tasks of a job whose tile tasks (the tasks whose spec MERGE_TASK names the merge task) have
+        all completed.  Call with the job locked (see lock_job) so that a merge task is only queued once.
+
+        :param job_id: the id of the job
+        :return: the number of merge tasks queued
+        """
+        curs = self.conn.cursor()
+        curs.execute(
+            """INSERT INTO task_queue(job_id, task_name)
+                SELECT T.parent_job_id, T.task_name FROM tasks T
+                  WHERE T.parent_job_id = %s AND T.task_type = 'merge' AND T.state = 'NEW'
+                    AND NOT EXISTS (SELECT 1 FROM task_queue Q WHERE Q.job_id = T.parent_job_id AND Q.task_name = T.task_name)
+                    AND NOT EXISTS (SELECT 1 FROM tasks S WHERE S.parent_job_id = T.parent_job_id
+                                      AND S.spec->>'MERGE_TASK' = T.task_name AND S.state <> 'COMPLETED');""",
+            (job_id,))
+        queued = curs.rowcount
+        if queued:
+            self.notify_task_queued(curs)
+        return queued
+
+    def fail_blocked_merge_tasks(self, job_id):
+        """
+        mark as FAILED the merge tasks of a job that have a failed tile task, and so can never run
+
+        :param job_id: the id of the job
+        :return: the number of merge tasks marked as FAILED
+        """
+        curs = self.conn.cursor()
+        curs.execute(
+            """UPDATE tasks T SET state = 'FAILED', completion_date = now(), error = 'tile task failed'
+                WHERE T.parent_job_id = %s AND T.task_type = 'merge' AND T.state = 'NEW'
+                  AND EXISTS (SELECT 1 FROM tasks S WHERE S.parent_job_id = T.parent_job_id
+                                AND S.spec->>'MERGE_TASK' = T.task_name AND S.state = 'FAILED');""",
+            (job_id,))
+        return curs.rowcount
+
+    def heartbeat(self, task, lease_secs=None):
+        """
+        renew the lease on a task claimed using claim_tasks, to show that the worker is still running it
+
+        :param task: the task returned by claim_tasks
+        :param lease_secs: extend the lease to this many seconds from now, defaults to Config.TASK_LEASE_SECS
+        :return: True if the lease was renewed, False if the task is no longer leased to the worker (its lease expired
+                 and it was requeued, or it has been completed or failed) and the worker should stop running it
+        """
+        curs = self.conn.cursor()
+        curs.execute(
+            """UPDATE tasks SET lease_expiry = now() + %s * interval '1 second'
+                WHERE parent_job_id = %s AND task_name = %s AND state = 'RUNNING' AND lease_id = %s
+                RETURNING lease_expiry;""",
+            (Config.TASK_LEASE_SECS if lease_secs is None else lease_secs,
+             task.get_job_id(), task.get_task_name(), task.get_lease_id()))
+        row = curs.fetchone()
+        if row is None:
+            return False
+        task.set_lease_expiry(Store.decode_datetime(row[0]))
+        return True
+
+    def requeue_expired_tasks(self):
+        """
+        return RUNNING tasks whose lease has expired (or that have no lease) to the NEW state and put them back on the
+        queue.  Tasks whose workers are still sending heartbeats are left running, so this is safe to call at any time,
+        from any process.
+
+        :return: the number of tasks requeued
+        """
+        curs = self.conn.cursor()
+        curs.execute(
+            """WITH expired AS (
+                  UPDATE tasks SET state='NEW', remote_task_id=NULL, lease_expiry=NULL, lease_id=NULL
+                    WHERE state = 'RUNNING' AND (lease_expiry IS NULL OR lease_expiry < now())
+                    RETURNING parent_job_id, task_name, submission_date
+                )
+                INSERT INTO task_queue(job_id, task_name)
+                  SELECT parent_job_id, task_name FROM expired ORDER BY submission_date, parent_job_id, task_name;""")
+        requeued = curs.rowcount
+        if requeued:
+            self.notify_task_queued(curs)
+        return requeued
+
+    def reset_running_tasks(self):
+        """
+        requeue running tasks whose lease has expired (see requeue_expired_tasks).  Tasks that are still leased to a
+        worker keep running.
+
+        :return: the number of tasks requeued
+        """
+        return self.requeue_expired_tasks()
 
     def remove_job(self, job_id):
         """
@@ -209,16 +591,56 @@ class JobOperations(Transaction):
         curs.execute("SELECT job_id FROM jobs WHERE job_id=%s", (job_id,))
         return len(curs.fetchall()) > 0
 
-    def list_jobs(self, states=None):
+    def list_jobs(self, states=None, spec_filter=None, with_spec=True):
         """
         list all stored jobs
+
+        :param states: only list jobs in one of these states, if provided
+        :param spec_filter: only list jobs whose spec contains this dictionary (for example {"BUNDLE_ID":"ocean"}), if provided
+        :param with_spec: if False, do not fetch the job specs (the returned jobs have a spec of None)
         """
 
         curs = self.conn.cursor()
+        self.execute_list_jobs(curs, states, spec_filter, with_spec)
+        return self.collect_jobs(self.collect_results(curs))
+
+    def iter_jobs(self, states=None, spec_filter=None, itersize=None, with_spec=True):
+        """
+        generate all stored jobs, fetching jobs from the database in batches
+
+        :param states: only include jobs in one of these states, if provided
+        :param spec_filter: only include jobs whose spec contains this dictionary, if provided
+        :param itersize: the number of jobs to fetch per round trip, defaults to Transaction.ITERSIZE
+        :param with_spec: if False, do not fetch the job specs (the returned jobs have a spec of None)
+        """
+        curs = self.open_server_cursor(itersize)
+        self.execute_list_jobs(curs, states, spec_filter, with_spec)
+        for row in self.iterate_results(curs):
+            yield self.make_job(row)
+
+    def execute_list_jobs(self, curs, states, spec_filter, with_spec=True):
+        conditions = []
+        parameters = []
         if states:
-            curs.execute("SELECT * FROM jobs WHERE state IN (%s)" % (Store.render_value_list(states)))
+            conditions.append("J.state IN (%s)" % (Store.render_value_list(states)))
+        if spec_filter:
+            conditions.append("J.spec @> %s")
+            parameters.append(Store.encode_spec(spec_filter))
+        query = "SELECT " + JobOperations.job_columns(with_spec) + " FROM jobs J"
+        if conditions:
+            curs.execute(query + " WHERE " + " AND ".join(conditions), parameters)
         else:
-            curs.execute("SELECT * FROM jobs")
+            curs.execute(query)
+
+    def list_jobs_completed_before(self, completion_date:datetime.datetime):
+        """
+        list all jobs that completed (or failed) before a given date/time, for example to find jobs that need cleaning up
+
+        :param completion_date: the cutoff date/time (naive datetimes are treated as UTC)
+        """
+        curs = self.conn.cursor()
+        curs.execute("SELECT " + JobOperations.job_columns() + " FROM jobs J WHERE completion_date < %s ORDER BY completion_date",
+                     (Store.encode_datetime(completion_date),))
         return self.collect_jobs(self.collect_results(curs))
 
     def get_job(self, job_id):
@@ -226,7 +648,7 @@ class JobOperations(Transaction):
         retrieve and return a job given its ID.  Return None if no matching job found
         """
         curs = self.conn.cursor()
-        curs.execute("SELECT * FROM jobs WHERE job_id = %s", (job_id,))
+        curs.execute("SELECT " + JobOperations.job_columns() + " FROM jobs J WHERE job_id = %s", (job_id,))
 
         jobs = self.collect_jobs(self.collect_results(curs))
         if len(jobs) == 0:
@@ -234,62 +656,127 @@ class JobOperations(Transaction):
         else:
             return jobs[0]
 
-    def list_jobs_by_submitter_id(self, submitter_id):
+    def list_jobs_by_submitter_id(self, submitter_id, with_spec=True):
         """
-        list all stored jobs
+        list all stored jobs submitted by a particular submitter, ordered by submission date
+
+        :param submitter_id: the id of the submitter
+        :param with_spec: if False, do not fetch the job specs (the returned jobs have a spec of None)
         """
         curs = self.conn.cursor()
-        curs.execute("SELECT * FROM jobs WHERE submitter_id = %s ORDER BY submission_date", (submitter_id,))
+        curs.execute("SELECT " + JobOperations.job_columns(with_spec) + " FROM jobs J WHERE submitter_id = %s ORDER BY submission_date",
+                     (submitter_id,))
         return self.collect_jobs(self.collect_results(curs))
 
-    def list_tasks(self, states=None):
+    def list_tasks(self, states=None, with_spec=True):
         """
         return a list of (task,submitter_id,job_state) tuples, ordered by the submission date of the parent job
+
+        :param states: only include tasks in one of these states, if provided
+        :param with_spec: if False, do not fetch the task specs (the returned tasks have a spec of None)
         """
         curs = self.conn.cursor()
+        self.execute_list_tasks(curs, states, with_spec)
+        results = self.collect_results(curs)
+        return list(zip(self.collect_tasks(results), map(lambda x: x[Store.JOB_SUBMITTER_ID], results),
+                        map(lambda x: x["job_state"], results)))
+
+    def iter_tasks(self, states=None, itersize=None, with_spec=True):
+        """
+        generate (task,submitter_id,job_state) tuples, ordered by the submission date of the parent job, fetching
+        tasks from the database in batches
+
+        :param states: only include tasks in one of these states, if provided
+        :param itersize: the number of tasks to fetch per round trip, defaults to Transaction.ITERSIZE
+        :param with_spec: if False, do not fetch the task specs (the returned tasks have a spec of None)
+        """
+        curs = self.open_server_cursor(itersize)
+        self.execute_list_tasks(curs, states, with_spec)
+        for row in self.iterate_results(curs):
+            yield (self.make_task(row), row[Store.JOB_SUBMITTER_ID], row["job_state"])
+
+    def execute_list_tasks(self, curs, states, with_spec=True):
+        query = "SELECT " + JobOperations.task_columns(with_spec) + ", J.submitter_id, J.state AS job_state FROM tasks T, jobs J "
         if states:
             curs.execute(
-                "SELECT T.*, J.submitter_id, J.state FROM tasks T, jobs J WHERE T.state IN (%s) AND T.parent_job_id = J.job_id ORDER BY J.submission_date" % (
+                query + "WHERE T.state IN (%s) AND T.parent_job_id = J.job_id ORDER BY J.submission_date" % (
                     Store.render_value_list(states)))
         else:
             curs.execute(
-                "SELECT T.*, J.submitter_id, J.state FROM tasks T, jobs J WHERE T.parent_job_id = J.job_id ORDER BY J.submission_date")
-        results = self.collect_results(curs)
-        return list(zip(self.collect_tasks(results), map(lambda x: x[Store.JOB_SUBMITTER_ID], results),
-                        map(lambda x: x[Store.JOB_STATE], results)))
+                query + "WHERE T.parent_job_id = J.job_id ORDER BY J.submission_date")
 
-    def list_job_tasks(self, job_id):
+    def list_job_tasks(self, job_id, with_spec=True):
         """
         list all tasks associated with a job
+
+        :param job_id: the id of the job
+        :param with_spec: if False, do not fetch the task specs (the returned tasks have a spec of None)
         """
         curs = self.conn.cursor()
-        curs.execute("SELECT * FROM tasks WHERE parent_job_id = %s", (job_id,))
+        curs.execute("SELECT " + JobOperations.task_columns(with_spec) + " FROM tasks T WHERE parent_job_id = %s", (job_id,))
         return self.collect_tasks(self.collect_results(curs))
 
+    def iter_job_tasks(self, job_id, itersize=None, with_spec=True):
+        """
+        generate all tasks associated with a job, fetching tasks from the database in batches
+
+        :param job_id: the id of the job
+        :param itersize: the number of tasks to fetch per round trip, defaults to Transaction.ITERSIZE
+        :param with_spec: if False, do not fetch the task specs (the returned tasks have a spec of None)
+        """
+        curs = self.open_server_cursor(itersize)
+        curs.execute("SELECT " + JobOperations.task_columns(with_spec) + " FROM tasks T WHERE parent_job_id = %s", (job_id,))
+        for row in self.iterate_results(curs):
+            yield self.make_task(row)
+
     def collect_tasks(self, results):
-        tasks = []
-        for row in results:
-            task = Task(row[Store.TASK_PARENT_JOB_ID], row[Store.TASK_TASK_TYPE], row[Store.TASK_TASK_NAME], json.loads(row[Store.TASK_SPEC]))
-            task \
-                .set_completion_datetime(Store.decode_datetime(row[Store.TASK_COMPLETION_DATE])) \
-                .set_submission_datetime(Store.decode_datetime(row[Store.TASK_SUBMISSION_DATE])) \
-                .set_error(row[Store.TASK_ERROR]) \
-                .set_state(row[Store.TASK_STATE]) \
-                .set_retry_count(row[Store.TASK_RETRY_COUNT])
-            tasks.append(task)
-        return tasks
+        return [JobOperations.make_task(row) for row in results]
+
+    @staticmethod
+    def task_columns(with_spec:bool=True) -> str:
+        """
+        :param with_spec: whether to fetch the spec, as JSON text
+        :return: the columns to select from the tasks table (aliased as T) for make_task
+        """
+        return JobOperations.TASK_COLUMNS.format(spec="T.spec::text" if with_spec else "NULL::text")
+
+    @staticmethod
+    def make_task(row):
+        """Create a Task from a row of the tasks table (selected using task_columns), represented as a dictionary"""
+        task = Task(row[Store.TASK_PARENT_JOB_ID], row[Store.TASK_TASK_TYPE], row[Store.TASK_TASK_NAME],
+                    spec_text=row[Store.TASK_SPEC])
+        task \
+            .set_completion_datetime(Store.decode_datetime(row[Store.TASK_COMPLETION_DATE])) \
+            .set_submission_datetime(Store.decode_datetime(row[Store.TASK_SUBMISSION_DATE])) \
+            .set_error(row[Store.TASK_ERROR]) \
+            .set_state(row[Store.TASK_STATE]) \
+            .set_retry_count(row[Store.TASK_RETRY_COUNT]) \
+            .set_remote_task_id(row[Store.TASK_REMOTE_TASK_ID]) \
+            .set_lease_expiry(Store.decode_datetime(row.get(Store.TASK_LEASE_EXPIRY))) \
+            .set_lease_id(row.get(Store.TASK_LEASE_ID))
+        return task
 
     def collect_jobs(self, results):
-        jobs = []
-        for row in results:
-            job = Job(row[Store.JOB_JOB_ID], row[Store.JOB_SUBMITTER_ID], json.loads(row[Store.JOB_SPEC]))
-            job \
-                .set_completion_datetime(Store.decode_datetime(row[Store.JOB_COMPLETION_DATE])) \
-                .set_submission_datetime(Store.decode_datetime(row[Store.JOB_SUBMISSION_DATE])) \
-                .set_state(row[Store.JOB_STATE]) \
-                .set_error(row[Store.JOB_ERROR])
-            jobs.append(job)
-        return jobs
+        return [JobOperations.make_job(row) for row in results]
+
+    @staticmethod
+    def job_columns(with_spec:bool=True) -> str:
+        """
+        :param with_spec: whether to fetch the spec, as JSON text
+        :return: the columns to select from the jobs table (aliased as J) for make_job
+        """
+        return JobOperations.JOB_COLUMNS.format(spec="J.spec::text" if with_spec else "NULL::text")
+
+    @staticmethod
+    def make_job(row):
+        """Create a Job from a row of the jobs table (selected using job_columns), represented as a dictionary"""
+        job = Job(row[Store.JOB_JOB_ID], row[Store.JOB_SUBMITTER_ID], None, spec_text=row[Store.JOB_SPEC])
+        job \
+            .set_completion_datetime(Store.decode_datetime(row[Store.JOB_COMPLETION_DATE])) \
+            .set_submission_datetime(Store.decode_datetime(row[Store.JOB_SUBMISSION_DATE])) \
+            .set_state(row[Store.JOB_STATE]) \
+            .set_error(row[Store.JOB_ERROR])
+        return job
 
     def count_jobs_by_state(self, states):
         """
@@ -300,7 +787,8 @@ class JobOperations(Transaction):
         """
 
         curs = self.conn.cursor()
-        curs.execute("SELECT COUNT(*) FROM jobs WHERE state IN (%s)" % (Store.render_value_list(states)))
+        curs.execute("SELECT COALESCE(SUM(count),0) FROM state_counts WHERE kind = 'JOB' AND job_id = '' AND state IN (%s)" % (
+            Store.render_value_list(states)))
         return curs.fetchone()[0]
 
     def count_tasks_by_state(self, states, job_id=None):
@@ -315,13 +803,24 @@ class JobOperations(Transaction):
         """
         curs = self.conn.cursor()
         states_string = Store.render_value_list(states)
-        if job_id:
-
-            curs.execute("select COUNT(*) FROM tasks WHERE state IN (" + states_string + ") AND parent_job_id = %s", (job_id,))
-        else:
-            curs.execute("select COUNT(*) FROM tasks WHERE state IN (" + states_string + ")")
+        curs.execute("SELECT COALESCE(SUM(count),0) FROM state_counts WHERE kind = 'TASK' AND job_id = %s AND state IN (" + states_string + ")",
+                     (job_id or "",))
         return curs.fetchone()[0]
 
+    def get_task_counts(self, job_id=None):
+        """
+        Arguments:
+        :param job_id: only count tasks associated with this job id, if provided
+
+        :return: a dictionary mapping each task state ("NEW","RUNNING","COMPLETED","FAILED") to the number of tasks in that state
+        """
+        curs = self.conn.cursor()
+        curs.execute("SELECT state, SUM(count)::bigint AS count FROM state_counts WHERE kind = 'TASK' AND job_id = %s GROUP BY state", (job_id or "",))
+        counts = {state: 0 for state in Task.getAllStates()}
+        for (state, count) in curs.fetchall():
+            counts[state] = count
+        return counts
+
     def count_task_errors(self, job_id):
         """
         Arguments:
@@ -335,6 +834,8 @@ class JobOperations(Transaction):
 
     def wipe(self):
         curs = self.conn.cursor()
+        curs.execute("DROP TABLE state_counts;")
         curs.execute("DROP TABLE tasks;")
         curs.execute("DROP TABLE jobs;")
         curs.execute("DROP TABLE task_queue;")
+        curs.execute("DROP TABLE submitter_weights;")
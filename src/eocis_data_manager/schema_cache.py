@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+The schema_cache module provides an in-process, read-through cache of Bundle and DataSet objects.
+
+Cached objects are discarded when the catalog generation recorded in the database changes (the generation is
+incremented by SchemaOperations whenever the catalog is modified).  The generation is checked at most once every
+check_interval seconds, or on demand by calling validate().  Objects returned from the cache are shared and should
+be treated as read-only.
+"""
+
+import threading
+import time
+
+from eocis_data_manager.schema_operations import SchemaOperations
+
+
+class SchemaCache:
+
+    def __init__(self, store, check_interval:float=10):
+        """
+        Create a schema cache
+
+        :param store: the persistent store
+        :param check_interval: the maximum time in seconds between checks of the catalog generation
+        """
+        self.store = store
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.generation = None
+        self.last_checked = None
+        self.bundles = {}
+        self.datasets = {}
+
+    def validate(self):
+        """Check the catalog generation now, discarding all cached objects if the catalog has been modified"""
+        with SchemaOperations(self.store) as so:
+            self.__check_generation(so)
+
+    def get_bundle(self, bundle_id):
+        """
+        :param bundle_id: the id of the bundle
+        :return: the Bundle with this id, or None if there is no such bundle
+        """
+        return self.__lookup(self.bundles, bundle_id, lambda so: so.get_bundle(bundle_id))
+
+    def get_dataset(self, dataset_id):
+        """
+        :param dataset_id: the id of the dataset
+        :return: the DataSet (including its variables) with this id, or None if there is no such dataset
+        """
+        return self.__lookup(self.datasets, dataset_id, lambda so: so.get_dataset(dataset_id))
+
+    def __lookup(self, cache, key, load_fn):
+        with self.lock:
+            expired = self.last_checked is None or time.monotonic() - self.last_checked > self.check_interval
+            if not expired and key in cache:
+                return cache[key]
+        with SchemaOperations(self.store) as so:
+            if expired:
+                self.__check_generation(so)
+            with self.lock:
+                generation = self.generation
+            obj = load_fn(so)
+        with self.lock:
+            # do not cache the object if another thread has seen a change to the catalog since it was loaded
+            if obj is not None and self.generation == generation:
+                cache[key] = obj
+        return obj
+
+    def __check_generation(self, so):
+        generation = so.get_catalog_generation()
+        with self.lock:
+            if generation != self.generation:
+                self.bundles.clear()
+                self.datasets.clear()
+                self.generation = generation
+            self.last_checked = time.monotonic()
@@ -17,7 +17,8 @@ import datetime
 #    along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import os.path
-import json
+
+from psycopg2.extras import execute_values
 
 from eocis_data_manager.store import Store
 from eocis_data_manager.transaction import Transaction
@@ -39,27 +40,170 @@ class SchemaOperations(Transaction):
 
     def wipe(self):
         curs = self.conn.cursor()
+        curs.execute("DROP TABLE inventory;")
         curs.execute("DROP TABLE dataset_bundle;")
         curs.execute("DROP TABLE variables;")
         curs.execute("DROP TABLE bundles;")
         curs.execute("DROP TABLE datasets;")
 
     def populate_schema(self, path):
-        self.clear_schema()
-
-        datasets = DataSet.load_datasets(os.path.join(path, "datasets"))
-        bundles = Bundle.load_bundles(os.path.join(path, "bundles"))
-        for dataset in datasets:
-            if dataset.enabled:
-                print(f"Adding dataset: {dataset}")
-                self.create_dataset(dataset)
-        for bundle in bundles:
-            if bundle.enabled:
-                print(f"Adding bundle: {bundle}")
-                self.create_bundle(bundle)
+        """
+        Update the bundles, datasets and variables to match the enabled definitions in a folder of YAML files.
+        Only definitions that have been added, changed or removed are written, and dataset end dates are preserved.
+        The catalog generation is only incremented if something changed.
 
+        :param path: folder containing bundles and datasets sub-directories containing YAML files
+        """
+        datasets = [dataset for dataset in DataSet.load_datasets(os.path.join(path, "datasets")) if dataset.enabled]
+        bundles = [bundle for bundle in Bundle.load_bundles(os.path.join(path, "bundles")) if bundle.enabled]
+        if self.update_catalog(datasets, bundles):
+            self.increment_catalog_generation()
         return self
 
+    def update_catalog(self, datasets, bundles) -> bool:
+        """
+        Apply the differences between the stored catalog and a new set of datasets and bundles, using batched statements
+
+        :param datasets: the complete list of datasets that should be stored
+        :param bundles: the complete list of bundles that should be stored
+        :return: True if any changes were made
+        """
+        stored_datasets = {dataset.dataset_id: dataset for dataset in self.list_datasets()}
+        stored_bundles = {bundle.bundle_id: bundle for bundle in self.list_bundles()}
+        new_datasets = {dataset.dataset_id: dataset for dataset in datasets}
+        new_bundles = {bundle.bundle_id: bundle for bundle in bundles}
+
+        removed_bundle_ids = [bundle_id for bundle_id in stored_bundles if bundle_id not in new_bundles]
+        removed_dataset_ids = [dataset_id for dataset_id in stored_datasets if dataset_id not in new_datasets]
+        added_datasets = []
+        changed_datasets = []
+        added_variables = []
+        changed_variables = []
+        removed_variables = []
+        for (dataset_id, dataset) in new_datasets.items():
+            stored_dataset = stored_datasets.get(dataset_id, None)
+            if stored_dataset is None:
+                added_datasets.append(dataset)
+                added_variables += [(dataset_id, variable) for variable in dataset.variables]
+                continue
+            if not SchemaOperations.same_definition(dataset, stored_dataset):
+                changed_datasets.append(dataset)
+            stored_variables = {variable.variable_id: variable for variable in stored_dataset.variables}
+            for variable in dataset.variables:
+                stored_variable = stored_variables.pop(variable.variable_id, None)
+                if stored_variable is None:
+                    added_variables.append((dataset_id, variable))
+                elif stored_variable != variable:
+                    changed_variables.append((dataset_id, variable))
+            removed_variables += [(dataset_id, variable_id) for variable_id in stored_variables]
+
+        added_bundles = []
+        changed_bundles = []
+        added_memberships = []
+        removed_memberships = []
+        for (bundle_id, bundle) in new_bundles.items():
+            stored_bundle = stored_bundles.get(bundle_id, None)
+            stored_dataset_ids = set(stored_bundle.dataset_ids) if stored_bundle is not None else set()
+            if stored_bundle is None:
+                added_bundles.append(bundle)
+            elif stored_bundle.bundle_name != bundle.bundle_name or stored_bundle.spec != bundle.spec:
+                changed_bundles.append(bundle)
+            added_memberships += [(bundle_id, dataset_id) for dataset_id in bundle.dataset_ids
+                                  if dataset_id not in stored_dataset_ids]
+            removed_memberships += [(bundle_id, dataset_id) for dataset_id in stored_dataset_ids
+                                    if dataset_id not in bundle.dataset_ids and dataset_id in new_datasets]
+
+        for bundle_id in removed_bundle_ids:
+            print(f"Removing bundle: {bundle_id}")
+        for dataset_id in removed_dataset_ids:
+            print(f"Removing dataset: {dataset_id}")
+        for dataset in added_datasets:
+            print(f"Adding dataset: {dataset}")
+        for dataset in changed_datasets:
+            print(f"Updating dataset: {dataset}")
+        for bundle in added_bundles:
+            print(f"Adding bundle: {bundle}")
+        for bundle in changed_bundles:
+            print(f"Updating bundle: {bundle}")
+
+        curs = self.conn.cursor()
+        # removing bundles and datasets cascades to dataset_bundle and variables
+        if removed_bundle_ids:
+            curs.execute("DELETE FROM bundles WHERE bundle_id = ANY(%s);", (removed_bundle_ids,))
+        if removed_dataset_ids:
+            curs.execute("DELETE FROM datasets WHERE dataset_id = ANY(%s);", (removed_dataset_ids,))
+        if added_datasets:
+            execute_values(curs,
+                "INSERT INTO datasets(dataset_id, dataset_name, temporal_resolution, spatial_resolution, start_date, end_date, location, spec) VALUES %s;",
+                [(dataset.dataset_id, dataset.dataset_name, dataset.temporal_resolution, dataset.spatial_resolution,
+                  Store.encode_date(dataset.start_date), Store.encode_date(dataset.end_date), dataset.location,
+                  Store.encode_spec(dataset.spec)) for dataset in added_datasets])
+        if changed_datasets:
+            # end_date is not part of the definition, and is left unchanged
+            execute_values(curs,
+                """UPDATE datasets D SET dataset_name=V.dataset_name, temporal_resolution=V.temporal_resolution, 
+                        spatial_resolution=V.spatial_resolution, start_date=V.start_date, location=V.location, spec=V.spec
+                    FROM (VALUES %s) AS V(dataset_id, dataset_name, temporal_resolution, spatial_resolution, start_date, location, spec)
+                    WHERE D.dataset_id = V.dataset_id;""",
+                [(dataset.dataset_id, dataset.dataset_name, dataset.temporal_resolution, dataset.spatial_resolution,
+                  Store.encode_date(dataset.start_date), dataset.location, Store.encode_spec(dataset.spec)) for dataset in changed_datasets],
+                template="(%s, %s, %s, %s, %s::date, %s, %s::jsonb)")
+        if removed_variables:
+            execute_values(curs, "DELETE FROM variables WHERE (dataset_id, variable_id) IN (VALUES %s);", removed_variables)
+        if added_variables:
+            execute_values(curs, "INSERT INTO variables(dataset_id, variable_id, variable_name, spec) VALUES %s;",
+                [(dataset_id, variable.variable_id, variable.variable_name, Store.encode_spec(variable.spec))
+                 for (dataset_id, variable) in added_variables])
+        if changed_variables:
+            execute_values(curs,
+                """UPDATE variables T SET variable_name=V.variable_name, spec=V.spec
+                    FROM (VALUES %s) AS V(dataset_id, variable_id, variable_name, spec)
+                    WHERE T.dataset_id = V.dataset_id AND T.variable_id = V.variable_id;""",
+                [(dataset_id, variable.variable_id, variable.variable_name, Store.encode_spec(variable.spec))
+                 for (dataset_id, variable) in changed_variables],
+                template="(%s, %s, %s, %s::jsonb)")
+        if added_bundles:
+            execute_values(curs, "INSERT INTO bundles(bundle_id, bundle_name, spec) VALUES %s;",
+                [(bundle.bundle_id, bundle.bundle_name, Store.encode_spec(bundle.spec)) for bundle in added_bundles])
+        if changed_bundles:
+            execute_values(curs,
+                """UPDATE bundles B SET bundle_name=V.bundle_name, spec=V.spec
+                    FROM (VALUES %s) AS V(bundle_id, bundle_name, spec)
+                    WHERE B.bundle_id = V.bundle_id;""",
+                [(bundle.bundle_id, bundle.bundle_name, Store.encode_spec(bundle.spec)) for bundle in changed_bundles],
+                template="(%s, %s, %s::jsonb)")
+        if removed_memberships:
+            execute_values(curs, "DELETE FROM dataset_bundle WHERE (bundle_id, dataset_id) IN (VALUES %s);", removed_memberships)
+        if added_memberships:
+            execute_values(curs, "INSERT INTO dataset_bundle(bundle_id, dataset_id) VALUES %s;", added_memberships)
+
+        return any([removed_bundle_ids, removed_dataset_ids, added_datasets, changed_datasets, added_variables,
+                    changed_variables, removed_variables, added_bundles, changed_bundles, added_memberships,
+                    removed_memberships])
+
+    @staticmethod
+    def same_definition(dataset1, dataset2) -> bool:
+        """Check whether two datasets have the same definition, ignoring their variables and end dates"""
+        return dataset1.dataset_name == dataset2.dataset_name \
+            and dataset1.temporal_resolution == dataset2.temporal_resolution \
+            and dataset1.spatial_resolution == dataset2.spatial_resolution \
+            and dataset1.start_date == dataset2.start_date \
+            and dataset1.location == dataset2.location \
+            and dataset1.spec == dataset2.spec
+
+    def get_catalog_generation(self) -> int:
+        """
+        :return: the catalog generation, which changes whenever bundles, datasets or variables are modified
+        """
+        curs = self.conn.cursor()
+        curs.execute("SELECT catalog_generation FROM metadata;")
+        return curs.fetchone()[0]
+
+    def increment_catalog_generation(self):
+        """Record that the bundles, datasets or variables have been modified, invalidating cached copies (see SchemaCache)"""
+        curs = self.conn.cursor()
+        curs.execute("UPDATE metadata SET catalog_generation = catalog_generation + 1;")
+
     def create_bundle(self, bundle):
         curs = self.conn.cursor()
         curs.execute(
@@ -67,7 +211,7 @@ class SchemaOperations(Transaction):
             (
                 bundle.bundle_id,
                 bundle.bundle_name,
-                json.dumps(bundle.spec)
+                Store.encode_spec(bundle.spec)
             ))
 
         for dataset_id in bundle.dataset_ids:
@@ -88,9 +232,9 @@ class SchemaOperations(Transaction):
                 dataset.temporal_resolution,
                 dataset.spatial_resolution,
                 Store.encode_date(dataset.start_date),
-                '',
+                Store.encode_date(dataset.end_date),
                 dataset.location,
-                json.dumps(dataset.spec),
+                Store.encode_spec(dataset.spec),
             ))
 
         for variable in dataset.variables:
@@ -99,35 +243,45 @@ class SchemaOperations(Transaction):
                              variable.variable_id,
                              dataset.dataset_id,
                              variable.variable_name,
-                             json.dumps(variable.spec)
+                             Store.encode_spec(variable.spec)
                          ))
 
 
+    # select bundles with an array of the ids of each bundle's datasets, add a WHERE clause with str.format
+    BUNDLES_QUERY = """SELECT B.*, 
+                            COALESCE(array_agg(DB.dataset_id) FILTER (WHERE DB.dataset_id IS NOT NULL), '{{}}') AS dataset_ids
+                        FROM bundles B LEFT JOIN dataset_bundle DB ON DB.bundle_id = B.bundle_id
+                        {where}
+                        GROUP BY B.bundle_id"""
+
+    # select datasets with a JSON array of each dataset's variables, add a WHERE clause with str.format
+    DATASETS_QUERY = """SELECT D.*, 
+                            COALESCE(json_agg(json_build_object('variable_id', V.variable_id, 
+                                'variable_name', V.variable_name, 'spec', V.spec)) FILTER (WHERE V.variable_id IS NOT NULL), '[]') AS variables
+                        FROM datasets D LEFT JOIN variables V ON V.dataset_id = D.dataset_id
+                        {where}
+                        GROUP BY D.dataset_id"""
+
     def list_bundles(self):
         """
         list all stored bundles
         """
 
         curs = self.conn.cursor()
-        curs.execute("SELECT * FROM bundles")
+        curs.execute(SchemaOperations.BUNDLES_QUERY.format(where=""))
         return self.collect_bundles(self.collect_results(curs))
 
     def collect_bundles(self, results):
-        bundles = []
-        for row in results:
-            bundle_id = row["bundle_id"]
-            curs = self.conn.cursor()
-            curs.execute("SELECT * FROM dataset_bundle WHERE bundle_id=%s", (bundle_id,))
-            dataset_ids = []
-            for r in self.collect_results(curs):
-                dataset_ids.append(r["dataset_id"])
-            b = Bundle(bundle_id, bundle_name=row["bundle_name"], spec=json.loads(row["spec"]), dataset_ids=dataset_ids)
-            bundles.append(b)
-        return bundles
+        return [SchemaOperations.make_bundle(row, row["dataset_ids"]) for row in results]
+
+    @staticmethod
+    def make_bundle(row, dataset_ids):
+        """Create a Bundle from a row of the bundles table (as a dictionary) and the ids of its datasets"""
+        return Bundle(row["bundle_id"], bundle_name=row["bundle_name"], spec=row["spec"], dataset_ids=dataset_ids)
 
     def get_bundle(self, bundle_id):
         curs = self.conn.cursor()
-        curs.execute("SELECT * FROM bundles WHERE bundle_id=%s", (bundle_id,))
+        curs.execute(SchemaOperations.BUNDLES_QUERY.format(where="WHERE B.bundle_id=%s"), (bundle_id,))
         bundle_list = self.collect_bundles(self.collect_results(curs))
         if len(bundle_list) != 1:
             return None
@@ -138,28 +292,28 @@ class SchemaOperations(Transaction):
         list all stored datasets/variables
         """
         curs = self.conn.cursor()
-        curs.execute("SELECT * FROM datasets")
+        curs.execute(SchemaOperations.DATASETS_QUERY.format(where=""))
         return self.collect_datasets(self.collect_results(curs))
 
     def collect_datasets(self, results):
-        datasets = []
-        for row in results:
-            dataset_id = row["dataset_id"]
-            curs = self.conn.cursor()
-            curs.execute("SELECT * FROM variables WHERE dataset_id=%s", (dataset_id,))
-            variables = []
-            for r in self.collect_results(curs):
-                v = Variable(r["variable_id"], r["variable_name"], json.loads(r["spec"]))
-                variables.append(v)
-            d = DataSet(dataset_id, dataset_name=row["dataset_name"],
-                        temporal_resolution=row["temporal_resolution"],
-                        spatial_resolution=row["spatial_resolution"],
-                        start_date=Store.decode_date(row["start_date"]),
-                        end_date=Store.decode_date(row["end_date"]),
-                        location=row["location"],
-                        spec=json.loads(row["spec"]), variables=variables)
-            datasets.append(d)
-        return datasets
+        return [SchemaOperations.make_dataset(row, [SchemaOperations.make_variable(r) for r in row["variables"]])
+                for row in results]
+
+    @staticmethod
+    def make_variable(row):
+        """Create a Variable from a row of the variables table, represented as a dictionary"""
+        return Variable(row["variable_id"], row["variable_name"], row["spec"])
+
+    @staticmethod
+    def make_dataset(row, variables):
+        """Create a DataSet from a row of the datasets table (as a dictionary) and its list of variables"""
+        return DataSet(row["dataset_id"], dataset_name=row["dataset_name"],
+                       temporal_resolution=row["temporal_resolution"],
+                       spatial_resolution=row["spatial_resolution"],
+                       start_date=Store.decode_date(row["start_date"]),
+                       end_date=Store.decode_date(row["end_date"]),
+                       location=row["location"],
+                       spec=row["spec"], variables=variables)
 
     def get_dataset_end_dates(self) -> dict[str, datetime.datetime]:
         curs = self.conn.cursor()
@@ -169,13 +323,26 @@ class SchemaOperations(Transaction):
             results[r["dataset_id"]] = Store.decode_date(r["end_date"])
         return results
 
-    def update_dataset_end_date(self, dataset_id:str, end_date:datetime.datetime):
+    def update_dataset_end_date(self, dataset_id:str, end_date:datetime.datetime) -> bool:
+        """
+        Set the end date of a dataset.  Cached copies of the catalog are only invalidated if the end date changes.
+
+        :param dataset_id: the id of the dataset
+        :param end_date: the new end date
+        :return: True if the end date was changed
+        """
         curs = self.conn.cursor()
-        curs.execute("UPDATE datasets SET end_date=%s WHERE dataset_id=%s;", (Store.encode_date(end_date), dataset_id))
+        encoded_end_date = Store.encode_date(end_date)
+        curs.execute("UPDATE datasets SET end_date=%s WHERE dataset_id=%s AND end_date IS DISTINCT FROM %s;",
+                     (encoded_end_date, dataset_id, encoded_end_date))
+        if curs.rowcount == 0:
+            return False
+        self.increment_catalog_generation()
+        return True
 
     def get_dataset(self, dataset_id):
         curs = self.conn.cursor()
-        curs.execute("SELECT * FROM datasets WHERE dataset_id=%s", (dataset_id,))
+        curs.execute(SchemaOperations.DATASETS_QUERY.format(where="WHERE D.dataset_id=%s"), (dataset_id,))
 
         ds_list = self.collect_datasets(self.collect_results(curs))
         if len(ds_list) != 1:
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+The spec_codec module encodes and decodes the JSON specifications stored with bundles, datasets, variables, jobs and
+tasks.  All spec serialisation goes through SpecCodec so that a faster JSON library is used when one is installed:
+orjson is preferred, then msgspec, falling back to python's json module.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+class SpecCodec:
+
+    @staticmethod
+    def json_encode(obj) -> str:
+        return json.dumps(obj)
+
+    @staticmethod
+    def json_decode(text:str):
+        return json.loads(text)
+
+    @staticmethod
+    def orjson_encode(obj) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+    @staticmethod
+    def orjson_decode(text:str):
+        return orjson.loads(text)
+
+    @staticmethod
+    def msgspec_encode(obj) -> str:
+        return msgspec.json.encode(obj).decode("utf-8")
+
+    @staticmethod
+    def msgspec_decode(text:str):
+        return msgspec.json.decode(text)
+
+    # map from backend name to (encode, decode) functions, for each backend that is installed
+    BACKENDS = {"json": (json_encode, json_decode)}
+    if msgspec is not None:
+        BACKENDS["msgspec"] = (msgspec_encode, msgspec_decode)
+    if orjson is not None:
+        BACKENDS["orjson"] = (orjson_encode, orjson_decode)
+
+    backend = None
+    encoder = None
+    decoder = None
+
+    @staticmethod
+    def use_backend(name:str):
+        """
+        Select the JSON library used to encode and decode specs
+
+        :param name: one of the installed backends in SpecCodec.BACKENDS ("orjson", "msgspec" or "json")
+        """
+        if name not in SpecCodec.BACKENDS:
+            raise Exception(f"JSON backend {name} is not installed")
+        (encode, decode) = SpecCodec.BACKENDS[name]
+        SpecCodec.backend = name
+        SpecCodec.encoder = encode.__func__
+        SpecCodec.decoder = decode.__func__
+
+    @staticmethod
+    def encode(obj) -> str:
+        """
+        :param obj: a JSON serialisable spec
+        :return: the spec encoded as JSON text
+        """
+        return SpecCodec.encoder(obj)
+
+    @staticmethod
+    def decode(text):
+        """
+        :param text: JSON text (str or bytes)
+        :return: the decoded spec
+        """
+        return SpecCodec.decoder(text)
+
+
+SpecCodec.use_backend("orjson" if orjson is not None else "msgspec" if msgspec is not None else "json")
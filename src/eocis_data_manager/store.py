@@ -24,11 +24,16 @@ the service crashes.  This should ensure that no jobs get "lost" once a user has
 """
 
 import logging
+import select
+import threading
 
 from psycopg2 import connect
+from psycopg2.extras import Json, register_default_json, register_default_jsonb
 import datetime
 
 from eocis_data_manager.transaction import Transaction
+from eocis_data_manager.connection_pool import ConnectionPool
+from eocis_data_manager.spec_codec import SpecCodec
 
 class Store:
     """
@@ -43,6 +48,10 @@ class Store:
     metadata:
         schema - specifies the version of the database schema currently loaded
         creation_date - the date on which the database schema was populated
+        catalog_generation - incremented whenever the data schema tables are modified, to invalidate cached copies
+
+    Dates are stored in date columns, timestamps in timestamptz columns (naive datetimes are treated as UTC),
+    specs in jsonb columns and job/task states using the activity_state enum type.
 
     Data Schema Tables
     ==================
@@ -52,7 +61,7 @@ class Store:
     bundles:
         bundle_id - a unique ID for each bundle
         bundle_name - the name of the bundle
-        spec - JSON encoded spec for bundle
+        spec - spec for bundle (jsonb)
 
     datasets:
         dataset_id - a unique ID for each dataset
@@ -62,7 +71,7 @@ class Store:
         start_date - the start date of this dataset
         end_date - the end date of this dataset
         location - the location of this bundle's files
-        spec - JSON encoded spec for dataset
+        spec - spec for dataset (jsonb)
 
     dataset_bundle:
         bundle_id - id of a bundle
@@ -72,7 +81,16 @@ class Store:
         variable_id - a unique ID for variable
         variable_name - name of the variable
         dataset_id - the dataset to which this variable belongs
-        spec - JSON encoded spec for variable
+        spec - spec for variable (jsonb)
+
+    inventory:
+        dataset_id - the dataset whose files are described
+        year - the year described
+        signature - the latest modification time (in ns) of the year's directory and its sub-directories when scanned
+        dates - a bitmap of the days of the year for which files exist (bit N of byte N//8 is set for day N+1)
+        file_count - the number of files found for the year, including files whose date could not be determined
+
+    inventory is maintained by InventoryScanner, which rescans only years whose signature has changed
 
     Activity Tables
     ===============
@@ -84,7 +102,7 @@ class Store:
         job_id - a unique UUID generated for each job
         submission_date - the timestamp at which the job was submitted
         submitter_id - a unique reference to a submitter
-        spec - the job specification as a JSON encoded string
+        spec - the job specification (jsonb)
         state - the job state (NEW, RUNNING, COMPLETED, FAILED)
         completion_date - the timestamp at which the job was completed
         error - string describing why the job failed
@@ -94,40 +112,181 @@ class Store:
         task_name - a unique name for the task within the parent job
         submission_date - the timestamp at which the task was submitted
         remote_task_id - a unique identifier for the task from the system executing the task
-        spec - the task specification as a JSON encoded string
+        spec - the task specification (jsonb)
         state - the task state (NEW, RUNNING, COMPLETED, FAILED)
         completion_date - the timestamp at which the task was completed
         error - set to a non-empty error string if the task failed
         retrycount - number of attempts made to retry a failed job
+        lease_expiry - for RUNNING tasks, the time after which the task is requeued unless the worker running it
+                       renews its lease (see JobOperations.heartbeat)
+        lease_id - for RUNNING tasks, a random UUID identifying the claim that started the task, so that a worker
+                   whose lease was lost cannot update the task after it is claimed again
 
     task_queue:
         id - auto-generated integer id
         queue_time - auto-generated time at which a task was placed in the queue
         job_id - id of the job to which the task belongs
         task_name - name of the task within the job
-
+        submitter_id - the submitter of the job, copied from the jobs table when the task is queued
+        estimated_secs - the estimated run time of the task (ESTIMATED_SECS in the task spec, or 0), copied when queued
+
+    submitter_weights:
+        submitter_id - a submitter
+        weight - the submitter's share of the task slots relative to other submitters (default 1) under the
+                 fair_share queue policy
+
+    state_counts:
+        kind - JOB or TASK
+        job_id - for TASK counts, the job to which the tasks belong, or '' for the count across all jobs
+        state - the job or task state
+        shard - 0 for per-job counts, the count across all jobs is split over Store.STATE_COUNT_SHARDS rows
+        count - the number of jobs or tasks in this state (in this shard)
+
+    state_counts is maintained by triggers on the jobs and tasks tables, in the same transaction as the change.
+    Each backend adds its changes to the counts across all jobs in the shard selected by its process id, so that
+    concurrent transactions do not all wait to update the same rows.  Readers sum the shards.
+    The submitter_id and estimated_secs columns of task_queue are filled in by a trigger when a task is queued, so
+    that the dequeue policy (Config.QUEUE_POLICY) can rank the queue without reading the jobs and tasks tables.
+
+    Secondary indexes supporting the frequent job, task and queue queries are listed in Store.INDEXES and are
+    created by Store.initialise()
     """
 
-    SCHEMA = "V1"
-
-    def __init__(self, connection_string="dbname=eocis user=eocis"):
+    SCHEMA = "V11"
+
+    # secondary indexes supporting the frequently executed queries, as (index name, table and index definition)
+    INDEXES = [
+        ("tasks_job_state_idx", "tasks (parent_job_id, state)"),           # count_tasks_by_state(..., job_id=...)
+        ("tasks_state_idx", "tasks (state)"),                               # list_tasks(states), count_tasks_by_state
+        ("jobs_state_idx", "jobs (state)"),                                 # list_jobs(states), count_jobs_by_state
+        ("jobs_submitter_idx", "jobs (submitter_id, submission_date)"),     # list_jobs_by_submitter_id
+        ("jobs_completion_date_idx", "jobs (completion_date)"),             # list_jobs_completed_before
+        ("jobs_spec_idx", "jobs USING gin (spec jsonb_path_ops)"),          # list_jobs(spec_filter=...)
+        ("task_queue_time_idx", "task_queue (queue_time)"),                 # claim_tasks (fifo policy)
+        ("task_queue_job_idx", "task_queue (job_id, task_name)"),           # queue_ready_merge_tasks
+        ("tasks_lease_idx", "tasks (lease_expiry) WHERE state = 'RUNNING'")  # requeue_expired_tasks
+    ]
+
+    # connection strings of databases whose schema has already been checked by this process
+    verified_schemas = set()
+    verified_schemas_lock = threading.Lock()
+
+    def __init__(self, connection_string="dbname=eocis user=eocis", pool_min_size=1, pool_max_size=10,
+                 pool_idle_timeout=300, pool_checkout_timeout=30):
         """
         Implement a persistent store based on a PostgreSQL database
         :param connection_string: string containing details of the database to connect to
+        :param pool_min_size: the number of idle connections to keep open in the connection pool
+        :param pool_max_size: the maximum number of connections that the store will open at any one time
+        :param pool_idle_timeout: close idle connections (above pool_min_size) after this many seconds
+        :param pool_checkout_timeout: wait at most this many seconds for a connection when the pool is exhausted
 
 
-        Initialises the store.  Will attempt to create table(s) if they do not already exist (when called for the first time)
+        Constructing a store does not connect to the database.  The first connection opened by this process checks
+        that the database schema matches the version expected by the software.  Call initialise to create the
+        database tables when setting up a new database.
         """
         self.logger = logging.getLogger("Store")
         self.connection_string = connection_string
-        conn = connect(self.connection_string)  # bump the standard timeout up from 5 secs to 10 secs
-        curs = conn.cursor()
-        # Create tables
+        self.pool = ConnectionPool(self.connect, min_size=pool_min_size,
+                                   max_size=pool_max_size, idle_timeout=pool_idle_timeout,
+                                   checkout_timeout=pool_checkout_timeout)
+        self.listen_conn = None
+        self.listen_lock = threading.Lock()
+
+    def initialise(self):
+        """
+        Bootstrap the database, creating table(s) if they do not already exist and recording the schema version.
+        A database created by an earlier version of the software is upgraded to the current schema version.
+        This only needs to be called once, when a database is first set up or after the software is upgraded.
+        """
+        conn = self.pool.checkout()
+        try:
+            curs = conn.cursor()
+            schema = self.get_schema_version(curs)
+            if schema is not None:
+                while schema != Store.SCHEMA:
+                    self.logger.info(f"Upgrading database schema from {schema}")
+                    if schema == "V1":
+                        self.upgrade_v1_to_v2(curs)
+                        schema = "V2"
+                    elif schema == "V2":
+                        # V3 adds the indexes in Store.INDEXES, created below
+                        schema = "V3"
+                    elif schema == "V3":
+                        self.upgrade_v3_to_v4(curs)
+                        schema = "V4"
+                    elif schema == "V4":
+                        curs.execute("ALTER TABLE metadata ADD COLUMN catalog_generation bigint DEFAULT 0;")
+                        schema = "V5"
+                    elif schema == "V5":
+                        # V6 adds the inventory table, created below
+                        schema = "V6"
+                    elif schema == "V6":
+                        self.upgrade_v6_to_v7(curs)
+                        schema = "V7"
+                    elif schema == "V7":
+                        # running tasks claimed before leases were introduced are treated as expired
+                        curs.execute("ALTER TABLE tasks ADD COLUMN lease_expiry timestamptz;")
+                        curs.execute("UPDATE tasks SET lease_expiry = now() WHERE state = 'RUNNING';")
+                        schema = "V8"
+                    elif schema == "V8":
+                        # clear the signatures so that every year is rescanned and its file count recorded
+                        # the inventory table already has the column if it was created by upgrade_v3_to_v4
+                        curs.execute("ALTER TABLE inventory ADD COLUMN IF NOT EXISTS file_count int;")
+                        curs.execute("UPDATE inventory SET signature = NULL;")
+                        schema = "V9"
+                    elif schema == "V9":
+                        # existing counts become shard 0 (the column already exists if upgrade_v3_to_v4 created the table)
+                        curs.execute('''ALTER TABLE state_counts ADD COLUMN IF NOT EXISTS shard int NOT NULL DEFAULT 0,
+                                            DROP CONSTRAINT state_counts_pkey,
+                                            ADD PRIMARY KEY(kind, job_id, state, shard);''')
+                        schema = "V10"
+                    elif schema == "V10":
+                        # running tasks have no lease id, so they can only be updated without a lease check
+                        curs.execute("ALTER TABLE tasks ADD COLUMN lease_id uuid;")
+                        schema = "V11"
+                    else:
+                        raise Exception("Unable to upgrade database.  Database schema %s is not recognised." % schema)
+                    curs.execute("UPDATE metadata SET schema=%s", (schema,))
+
+            # create any tables, triggers and indexes that are missing (all of them, for a new database)
+            self.create_tables(curs)
+            self.create_triggers(curs)
+            self.create_indexes(curs)
+
+            # check the metadata is consistent, raise an exception if not
+            self.check_metadata(conn)
+
+            conn.commit()
+        finally:
+            self.pool.checkin(conn)
+        Store.verified_schemas.add(self.connection_string)
+        return self
+
+    def get_schema_version(self, curs):
+        """
+        :return: the schema version recorded in the metadata table, or None if the table does not exist
+        """
+        curs.execute("SELECT to_regclass('metadata')")
+        if curs.fetchone()[0] is None:
+            return None
+        curs.execute("SELECT schema FROM metadata")
+        row = curs.fetchone()
+        return row[0] if row else None
+
+    def create_tables(self, curs):
+        """Create any tables for the current schema version that do not already exist"""
+
+        curs.execute('''DO $$ BEGIN
+                CREATE TYPE activity_state AS ENUM ('NEW', 'RUNNING', 'COMPLETED', 'FAILED');
+            EXCEPTION WHEN duplicate_object THEN NULL;
+            END $$;''')
 
         curs.execute('''CREATE TABLE IF NOT EXISTS bundles(
                         bundle_id text,
                         bundle_name text, 
-                        spec text,
+                        spec jsonb,
                         PRIMARY KEY(bundle_id));''')
 
         curs.execute('''CREATE TABLE IF NOT EXISTS datasets(
@@ -135,10 +294,10 @@ class Store:
                         dataset_name text, 
                         temporal_resolution text,
                         spatial_resolution text,
-                        start_date text,
-                        end_date text,
+                        start_date date,
+                        end_date date,
                         location text,
-                        spec text,
+                        spec jsonb,
                         PRIMARY KEY(dataset_id));''')
 
         curs.execute('''CREATE TABLE IF NOT EXISTS dataset_bundle(
@@ -152,17 +311,26 @@ class Store:
                         variable_id text,
                         dataset_id text,
                         variable_name text, 
-                        spec text,
+                        spec jsonb,
                         PRIMARY KEY(variable_id,dataset_id),
                         FOREIGN KEY(dataset_id) REFERENCES datasets(dataset_id) ON DELETE CASCADE);''')
 
+        curs.execute('''CREATE TABLE IF NOT EXISTS inventory(
+                        dataset_id text,
+                        year int,
+                        signature bigint,
+                        dates bytea,
+                        file_count int,
+                        PRIMARY KEY(dataset_id,year),
+                        FOREIGN KEY(dataset_id) REFERENCES datasets(dataset_id) ON DELETE CASCADE);''')
+
         curs.execute('''CREATE TABLE IF NOT EXISTS jobs(
                 job_id text,
-                submission_date text, 
+                submission_date timestamptz, 
                 submitter_id text, 
-                spec text, 
-                state text, 
-                completion_date text, 
+                spec jsonb, 
+                state activity_state, 
+                completion_date timestamptz, 
                 error text,
                 PRIMARY KEY(job_id));''')
 
@@ -170,13 +338,15 @@ class Store:
                 parent_job_id text, 
                 task_type text,
                 task_name text, 
-                submission_date text, 
+                submission_date timestamptz, 
                 remote_task_id text, 
-                spec text, 
-                state text, 
-                completion_date text, 
+                spec jsonb, 
+                state activity_state, 
+                completion_date timestamptz, 
                 error text, 
                 retry_count int, 
+                lease_expiry timestamptz,
+                lease_id uuid,
                 PRIMARY KEY(parent_job_id, task_name),
                 FOREIGN KEY(parent_job_id) REFERENCES jobs(job_id) ON DELETE CASCADE
                 );''')
@@ -185,29 +355,225 @@ class Store:
                 id int not null primary key generated always as identity,
                 queue_time	timestamptz default now(),
                 job_id text,
-                task_name text);''')
+                task_name text,
+                submitter_id text,
+                estimated_secs double precision);''')
+
+        curs.execute('''CREATE TABLE IF NOT EXISTS submitter_weights(
+                submitter_id text,
+                weight double precision,
+                PRIMARY KEY(submitter_id));''')
+
+        # counts of jobs and tasks in each state, maintained by the triggers created in create_triggers
+        curs.execute('''CREATE TABLE IF NOT EXISTS state_counts(
+                kind text,
+                job_id text,
+                state activity_state,
+                shard int DEFAULT 0,
+                count bigint,
+                PRIMARY KEY(kind, job_id, state, shard));''')
 
         # the metadata table holds the schema string and creation date
         # the schema is useful to guard against opening a database created by a different version of the software
+        # the catalog generation is incremented whenever the bundles, datasets or variables are modified
 
         curs.execute('''CREATE TABLE IF NOT EXISTS metadata(
                 schema text,
-                creation_date text
+                creation_date timestamptz,
+                catalog_generation bigint DEFAULT 0
                 );''')
 
         # if the metadata table is empty, populate it with a single row
 
         curs.execute('''INSERT INTO metadata(schema,creation_date) 
-                SELECT %s, %s 
-                WHERE NOT EXISTS(SELECT 1 FROM metadata);''', (Store.SCHEMA, Store.encode_date(datetime.datetime.now())))
+                SELECT %s, now() 
+                WHERE NOT EXISTS(SELECT 1 FROM metadata);''', (Store.SCHEMA,))
 
-        # check the metadata is consistent, raise an exception if not
-        self.check_metadata(conn)
+    def create_triggers(self, curs):
+        """
+        (Re)create the statement-level triggers that keep the state_counts table up to date whenever rows in the
+        jobs or tasks table are inserted, deleted or change state, and the row-level trigger that fills in the
+        submitter and estimated run time of tasks added to task_queue
+        """
 
-        conn.commit()
+        def count_changes(kind, changes):
+            # changes selects (job_id, state, n) where n is +1 for new rows and -1 for old rows
+            if kind == "TASK":
+                # per-job counts, skipping jobs that are being deleted, then global counts under job id ''
+                per_job = '''SELECT job_id, state, 0 AS shard, n FROM delta WHERE job_id IN (SELECT job_id FROM jobs)
+                             UNION ALL '''
+            else:
+                per_job = ""
+            return f'''WITH delta AS (
+                            SELECT job_id, state, SUM(n) AS n FROM ({changes}) changes
+                            GROUP BY job_id, state HAVING SUM(n) <> 0)
+                        INSERT INTO state_counts(kind, job_id, state, shard, count)
+                            SELECT '{kind}', job_id, state, shard, n FROM (
+                                {per_job}SELECT '' AS job_id, state, pg_backend_pid() % {Store.STATE_COUNT_SHARDS} AS shard,
+                                    SUM(n) AS n FROM delta GROUP BY state) D
+                            ORDER BY job_id, state
+                        ON CONFLICT (kind, job_id, state, shard) DO UPDATE SET count = state_counts.count + EXCLUDED.count;'''
+
+        for (table, kind, job_id_column) in [("tasks", "TASK", "parent_job_id"), ("jobs", "JOB", "job_id")]:
+            inserted = f"SELECT {job_id_column} AS job_id, state, 1 AS n FROM new_rows"
+            deleted = f"SELECT {job_id_column} AS job_id, state, -1 AS n FROM old_rows"
+            on_delete = ""
+            if kind == "JOB":
+                on_delete = "DELETE FROM state_counts WHERE kind='TASK' AND job_id IN (SELECT job_id FROM old_rows);"
+            curs.execute(f'''CREATE OR REPLACE FUNCTION count_{table}_states() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP = 'INSERT' THEN
+                        {count_changes(kind, inserted)}
+                    ELSIF TG_OP = 'UPDATE' THEN
+                        {count_changes(kind, inserted + " UNION ALL " + deleted)}
+                    ELSE
+                        {count_changes(kind, deleted)}
+                        {on_delete}
+                    END IF;
+                    RETURN NULL;
+                END $$ LANGUAGE plpgsql;''')
+            for (event, transition_tables) in [("INSERT", "NEW TABLE AS new_rows"),
+                                               ("UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+                                               ("DELETE", "OLD TABLE AS old_rows")]:
+                trigger_name = f"{table}_{event.lower()}_counts"
+                curs.execute(f"DROP TRIGGER IF EXISTS {trigger_name} ON {table};")
+                curs.execute(f'''CREATE TRIGGER {trigger_name} AFTER {event} ON {table}
+                                    REFERENCING {transition_tables}
+                                    FOR EACH STATEMENT EXECUTE FUNCTION count_{table}_states();''')
+
+        # copy the submitter and estimated run time of each task into the queue as it is queued
+        curs.execute('''CREATE OR REPLACE FUNCTION fill_task_queue_row() RETURNS trigger AS $$
+            BEGIN
+                NEW.submitter_id := COALESCE((SELECT submitter_id FROM jobs WHERE job_id = NEW.job_id), '');
+                NEW.estimated_secs := COALESCE((SELECT (spec->>'ESTIMATED_SECS')::double precision FROM tasks
+                                                  WHERE parent_job_id = NEW.job_id AND task_name = NEW.task_name), 0);
+                RETURN NEW;
+            END $$ LANGUAGE plpgsql;''')
+        curs.execute("DROP TRIGGER IF EXISTS task_queue_insert_fill ON task_queue;")
+        curs.execute('''CREATE TRIGGER task_queue_insert_fill BEFORE INSERT ON task_queue
+                            FOR EACH ROW EXECUTE FUNCTION fill_task_queue_row();''')
+
+    def create_indexes(self, curs):
+        """Create any of the indexes listed in Store.INDEXES that do not already exist"""
+        for (index_name, definition) in Store.INDEXES:
+            curs.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {definition};")
+
+    def upgrade_v3_to_v4(self, curs):
+        """Add the state_counts table, populated from the existing jobs and tasks"""
+        self.create_tables(curs)
+        curs.execute('''INSERT INTO state_counts(kind, job_id, state, count)
+                            SELECT 'JOB', '', state, COUNT(*) FROM jobs GROUP BY state
+                            UNION ALL
+                            SELECT 'TASK', parent_job_id, state, COUNT(*) FROM tasks GROUP BY parent_job_id, state
+                            UNION ALL
+                            SELECT 'TASK', '', state, COUNT(*) FROM tasks GROUP BY state;''')
+
+    def upgrade_v6_to_v7(self, curs):
+        """Add the submitter and estimated run time columns to task_queue, populated for tasks already queued"""
+        curs.execute("ALTER TABLE task_queue ADD COLUMN submitter_id text, ADD COLUMN estimated_secs double precision;")
+        curs.execute('''UPDATE task_queue Q SET
+                            submitter_id = COALESCE((SELECT submitter_id FROM jobs WHERE job_id = Q.job_id), ''),
+                            estimated_secs = COALESCE((SELECT (spec->>'ESTIMATED_SECS')::double precision FROM tasks
+                                                      WHERE parent_job_id = Q.job_id AND task_name = Q.task_name), 0);''')
+
+    def upgrade_v1_to_v2(self, curs):
+        """
+        Convert the text columns used by schema V1 to native types (timestamptz, date, jsonb and an enum for states).
+        V1 stored timestamps as UTC in TIMESTAMP_FORMAT and dates in DATE_FORMAT, with empty strings for missing values
+        """
+        curs.execute("CREATE TYPE activity_state AS ENUM ('NEW', 'RUNNING', 'COMPLETED', 'FAILED');")
+
+        def to_timestamp(column):
+            return f"to_timestamp(NULLIF({column},''),'YYYY/MM/DD HH24:MI:SS')::timestamp AT TIME ZONE 'UTC'"
+
+        def to_date(column):
+            return f"to_date(NULLIF({column},''),'YYYY/MM/DD')"
+
+        def to_jsonb(column):
+            return f"NULLIF({column},'')::jsonb"
+
+        curs.execute(f"ALTER TABLE bundles ALTER COLUMN spec TYPE jsonb USING {to_jsonb('spec')};")
+        curs.execute(f"""ALTER TABLE datasets 
+                            ALTER COLUMN start_date TYPE date USING {to_date('start_date')},
+                            ALTER COLUMN end_date TYPE date USING {to_date('end_date')},
+                            ALTER COLUMN spec TYPE jsonb USING {to_jsonb('spec')};""")
+        curs.execute(f"ALTER TABLE variables ALTER COLUMN spec TYPE jsonb USING {to_jsonb('spec')};")
+        for table in ["jobs", "tasks"]:
+            curs.execute(f"""ALTER TABLE {table} 
+                            ALTER COLUMN submission_date TYPE timestamptz USING {to_timestamp('submission_date')},
+                            ALTER COLUMN completion_date TYPE timestamptz USING {to_timestamp('completion_date')},
+                            ALTER COLUMN spec TYPE jsonb USING {to_jsonb('spec')},
+                            ALTER COLUMN state TYPE activity_state USING state::activity_state;""")
+        curs.execute(f"""ALTER TABLE metadata 
+                            ALTER COLUMN creation_date TYPE timestamptz USING to_timestamp(NULLIF(creation_date,''),'YYYY/MM/DD');""")
+
+    def connect(self):
+        """Open a new connection to the database, decoding json and jsonb values using SpecCodec"""
+        conn = connect(self.connection_string)
+        register_default_json(conn, loads=SpecCodec.decode)
+        register_default_jsonb(conn, loads=SpecCodec.decode)
+        return conn
 
     def open_connection(self):
-        return connect(self.connection_string)
+        """Borrow a connection from the store's connection pool.  Return it by calling release_connection."""
+        conn = self.pool.checkout()
+        if self.connection_string not in Store.verified_schemas:
+            try:
+                with Store.verified_schemas_lock:
+                    if self.connection_string not in Store.verified_schemas:
+                        self.check_metadata(conn)
+                        conn.rollback()
+                        Store.verified_schemas.add(self.connection_string)
+            except:
+                self.pool.checkin(conn)
+                raise
+        return conn
+
+    def release_connection(self, conn):
+        """Return a connection obtained from open_connection to the pool, rolling back any uncommitted work"""
+        self.pool.checkin(conn)
+
+    def get_pool_stats(self):
+        """
+        :return: a dictionary containing connection pool statistics (checkouts, waits, created, closed, failed_health_checks, in_use, idle)
+        """
+        return self.pool.get_stats()
+
+    def wait_for_task(self, timeout:float) -> bool:
+        """
+        Block until a task is queued (by JobOperations.queue_task or queue_tasks_bulk in a committed transaction)
+        or the timeout expires.  No queries are issued while waiting.
+
+        A dedicated connection LISTENs for notifications, and stays open between calls so that notifications
+        arriving while the caller is busy are not lost.  When the connection is first opened this returns True
+        immediately, so that the caller re-checks the queue for tasks queued before it started listening.
+
+        :param timeout: the maximum time to wait, in seconds
+        :return: True if a task may have been queued, False if the timeout expired
+        """
+        with self.listen_lock:
+            if self.listen_conn is None or self.listen_conn.closed:
+                self.listen_conn = connect(self.connection_string)
+                self.listen_conn.set_session(autocommit=True)
+                self.listen_conn.cursor().execute("LISTEN " + Store.TASK_QUEUE_CHANNEL + ";")
+                return True
+            conn = self.listen_conn
+            conn.poll()
+            if not conn.notifies:
+                (readable, _, _) = select.select([conn], [], [], timeout)
+                if readable:
+                    conn.poll()
+            received = len(conn.notifies) > 0
+            conn.notifies.clear()
+            return received
+
+    def close(self):
+        """Close any idle pooled connections, and the connection used by wait_for_task"""
+        self.pool.close_all()
+        with self.listen_lock:
+            if self.listen_conn is not None:
+                self.listen_conn.close()
+                self.listen_conn = None
 
     def check_metadata(self, conn):
         curs = conn.cursor()
@@ -226,6 +592,16 @@ class Store:
     def openTransaction(self):
         return Transaction(self)
 
+    # notification channel signalled when tasks are added to the task queue
+    TASK_QUEUE_CHANNEL = "eocis_task_queue"
+
+    # key of the advisory lock taken by JobOperations.claim_tasks to serialise claims that are subject to quotas
+    CLAIM_LOCK_ID = 0x454F434953
+
+    # number of rows over which each count across all jobs is split in state_counts (readers sum every row, so this
+    # can be changed without rebuilding the table)
+    STATE_COUNT_SHARDS = 16
+
     TIMESTAMP_FORMAT = "%Y/%m/%d %H:%M:%S"
     DATE_FORMAT = "%Y/%m/%d"
 
@@ -248,38 +624,60 @@ class Store:
     TASK_COMPLETION_DATE = "completion_date"
     TASK_ERROR = "error"
     TASK_RETRY_COUNT = "retry_count"
+    TASK_LEASE_EXPIRY = "lease_expiry"
+    TASK_LEASE_ID = "lease_id"
 
     @staticmethod
     def encode_date(dt):
-        """Encode a datetime object as a string, compatible with Store.decodeDate"""
-        if dt is None:
-            return ""
+        """Convert a date or datetime object to a date for storing in a date column (None if dt is None)"""
+        if dt is None or dt == "":
+            return None
+        elif isinstance(dt, datetime.datetime):
+            return dt.date()
         else:
-            return datetime.datetime.strftime(dt, Store.DATE_FORMAT)
+            return dt
 
     @staticmethod
     def decode_date(s):
-        """Decode a string to a datetime object, compatible with Store.encodeDate"""
+        """Decode a value read from a date column to a date object, compatible with Store.encode_date.
+        Strings in DATE_FORMAT (used in schema V1) are also accepted"""
         if s == "" or s is None:
             return None
-        else:
+        elif isinstance(s, str):
             return datetime.datetime.strptime(s, Store.DATE_FORMAT).replace(tzinfo=None).date()
+        elif isinstance(s, datetime.datetime):
+            return s.date()
+        else:
+            return s
+
+    @staticmethod
+    def encode_spec(spec):
+        """Wrap a spec (any JSON serialisable object) for storing in a json or jsonb column, encoded using SpecCodec"""
+        return Json(spec, dumps=SpecCodec.encode)
 
     @staticmethod
     def encode_datetime(dt):
-        """Encode a datetime object as a string, compatible with Store.decodeDateTime"""
-        if dt is None:
-            return ""
+        """Convert a datetime object for storing in a timestamptz column, compatible with Store.decode_datetime.
+        Naive datetimes are assumed to be in UTC"""
+        if dt is None or dt == "":
+            return None
+        elif dt.tzinfo is None:
+            return dt.replace(tzinfo=datetime.timezone.utc)
         else:
-            return datetime.datetime.strftime(dt, Store.TIMESTAMP_FORMAT)
+            return dt
 
     @staticmethod
     def decode_datetime(s):
-        """Decode a string to a datetime object, compatible with Store.encodeDateTime"""
+        """Decode a value read from a timestamptz column to a naive UTC datetime object, compatible with Store.encode_datetime.
+        Strings in TIMESTAMP_FORMAT (used in schema V1) are also accepted"""
         if s == "" or s is None:
             return None
-        else:
+        elif isinstance(s, str):
             return datetime.datetime.strptime(s, Store.TIMESTAMP_FORMAT).replace(tzinfo=None)
+        elif s.tzinfo is not None:
+            return s.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        else:
+            return s
 
     @staticmethod
     def render_value_list(values):
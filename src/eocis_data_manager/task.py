@@ -21,7 +21,7 @@ The task module deals with the representation of a generic task, a smaller unit
 
 A task is uniquely identified by a parent job and a unique task name within the job.  It is described by a JSON serialisable specification object, usually a dictionary.
 
-The task object records the task state (NEW, RUNNING, COMPLETED, FAILED), a remote task ID (relevant to RUNNING tasks), an error message (relevant to FAILED tasks), and its submission and completion times.
+The task object records the task state (NEW, RUNNING, COMPLETED, FAILED), a remote task ID and lease expiry time (relevant to RUNNING tasks), an error message (relevant to FAILED tasks), and its submission and completion times.
 
 Methods setRunning, setCompleted, setFailed and retry are used to move a task between states.
 
@@ -29,7 +29,7 @@ Tasks can be retried if they fail, and so also have an associated retry count.
 """
 import uuid
 
-
+from .spec_codec import SpecCodec
 from .utils import Utils
 
 class Task:
@@ -37,16 +37,24 @@ class Task:
     Represent a task - a discrete executable piece of work that contributes towards the completion of a job
     """
 
-    def __init__(self,job_id,task_type="subset",task_name=None,spec=None):
+    # large numbers of tasks may be held in memory when listing, so avoid a per-instance __dict__
+    __slots__ = ("job_id", "task_name", "task_type", "_spec", "spec_text", "state", "error", "submission_date_time",
+                 "completion_date_time", "retrycount", "remote_task_id", "lease_expiry", "lease_id")
+
+    def __init__(self,job_id,task_type="subset",task_name=None,spec=None,spec_text=None):
         self.job_id = job_id
         self.task_name = task_name or str(uuid.uuid4())
         self.task_type = task_type
-        self.spec = spec
+        self._spec = spec
+        self.spec_text = spec_text  # the spec as undecoded JSON text, decoded when the spec is first accessed
         self.state = Task.STATE_NEW
         self.error = ""
         self.submission_date_time = None
         self.completion_date_time = None
         self.retrycount = 0
+        self.remote_task_id = None
+        self.lease_expiry = None
+        self.lease_id = None
 
     def set_running(self):
         """Move this task into the RUNNING state, noting the current UTC date/time as its submission date"""
@@ -94,6 +102,39 @@ class Task:
         self.retrycount = retrycount
         return self
 
+    def get_remote_task_id(self):
+        return self.remote_task_id
+
+    def set_remote_task_id(self, remote_task_id):
+        self.remote_task_id = remote_task_id
+        return self
+
+    def get_lease_expiry(self):
+        return self.lease_expiry
+
+    def set_lease_expiry(self, lease_expiry):
+        self.lease_expiry = lease_expiry
+        return self
+
+    def get_lease_id(self):
+        return self.lease_id
+
+    def set_lease_id(self, lease_id):
+        self.lease_id = lease_id
+        return self
+
+    @property
+    def spec(self):
+        if self.spec_text is not None:
+            self._spec = SpecCodec.decode(self.spec_text)
+            self.spec_text = None
+        return self._spec
+
+    @spec.setter
+    def spec(self, spec):
+        self._spec = spec
+        self.spec_text = None
+
     def get_spec(self):
         return self.spec
 
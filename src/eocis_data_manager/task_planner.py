@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+The task_planner module decides how the work requested by a job is divided into tasks.  Each task covers a period
+of a single dataset, limited to the dates for which the dataset has data, and lists the input files it should read.
+
+The length of the period covered by each task (a month, a quarter, a year or several years) is chosen using a simple
+cost model, so that tasks are expected to take about Config.TASK_TARGET_SECS to run.  The cost of a task is estimated
+from the number of grid cells in its bounding box (at the dataset's spatial resolution), the number of time steps
+and the number of variables.
+
+If even a month of data is estimated to exceed the target, the bounding box can be split into up to
+Config.TASK_MAX_TILES spatial tiles, each processed by a separate task, and a merge task stitches the tiles together.
+"""
+
+import calendar
+import datetime
+import glob
+import math
+
+from .config import Config
+from .dataset import DataSet
+from .inventory_operations import InventoryOperations
+from .inventory_scanner import InventoryScanner
+
+
+class PlannedTask:
+    """The part of a job planned to be carried out by one task"""
+
+    __slots__ = ("start_date", "end_date", "in_files", "label", "estimated_secs", "tiles")
+
+    def __init__(self, start_date:datetime.date, end_date:datetime.date, in_files:list[str], label:str,
+                 estimated_secs:float, tiles:list[tuple[tuple[float,float,float,float],float]]=None):
+        """
+        :param start_date: the first date to process
+        :param end_date: the last date to process
+        :param in_files: the input files covering the period
+        :param label: a name for the period, for example 2020, 2020-Q3, 2020-07 or 2020-2022
+        :param estimated_secs: the estimated time to run the task, or to merge its tiles if it is split into tiles
+        :param tiles: if the area is split into tiles, a list of ((lon_min, lon_max, lat_min, lat_max), estimated
+                      time) tuples, one for each tile
+        """
+        self.start_date = start_date
+        self.end_date = end_date
+        self.in_files = in_files
+        self.label = label
+        self.estimated_secs = estimated_secs
+        self.tiles = tiles or []
+
+    def __repr__(self) -> str:
+        return f"PlannedTask({self.label},{self.start_date},{self.end_date},{len(self.in_files)} files,{self.estimated_secs:.0f}s,{len(self.tiles)} tiles)"
+
+
+class TaskPlanner:
+    def __init__(self, store):
+        """
+        Create a task planner
+
+        :param store: the persistent store, used to look up the inventory of available dates
+        """
+        self.store = store
+
+    @staticmethod
+    def get_job_dates(job_spec:dict) -> tuple[datetime.date,datetime.date]:
+        """
+        :param job_spec: the job specification
+        :return: the (first, last) dates requested by the job
+        """
+        start_year = int(job_spec["START_YEAR"])
+        end_year = int(job_spec["END_YEAR"])
+        end_month = int(job_spec.get("END_MONTH", 12))
+        start_date = datetime.date(start_year, int(job_spec.get("START_MONTH", 1)), int(job_spec.get("START_DAY", 1)))
+        end_date = datetime.date(end_year, end_month,
+                                 int(job_spec.get("END_DAY", calendar.monthrange(end_year, end_month)[1])))
+        return (start_date, end_date)
+
+    @staticmethod
+    def clamp_to_coverage(dataset:DataSet, start_date:datetime.date, end_date:datetime.date):
+        """
+        :param dataset: the dataset
+        :param start_date: the first date requested
+        :param end_date: the last date requested
+        :return: a (first, last) tuple, limited to the dataset's start and end dates, or None if there is no overlap
+        """
+        start_date = max(start_date, dataset.start_date)
+        end_date = min(end_date, dataset.end_date or datetime.date.today())
+        if start_date > end_date:
+            return None
+        return (start_date, end_date)
+
+    def find_files(self, dataset:DataSet, start_date:datetime.date, end_date:datetime.date) -> dict[int,list[str]]:
+        """
+        Find the input files of a dataset covering a range of dates
+
+        :param dataset: the dataset
+        :param start_date: the first date
+        :param end_date: the last date
+        :return: a dictionary mapping each year that has files in the range to a sorted list of the file paths.
+                 Files whose date cannot be worked out from their path are included if they are in the right year.
+        """
+        with InventoryOperations(self.store) as ops:
+            # skip years that the inventory scanner found to have no files.  other years are searched, including
+            # years that have not been scanned yet and years whose files could not be dated
+            empty_years = set(ops.get_empty_years(dataset.dataset_id))
+
+        files = {}
+        for year in range(start_date.year, end_date.year + 1):
+            if year in empty_years:
+                continue
+            year_files = []
+            for path in sorted(glob.glob(InventoryScanner.year_pattern(dataset.location, year))):
+                dt = InventoryScanner.parse_date(dataset.location, path, year)
+                if TaskPlanner.file_overlaps(dataset, dt, start_date, end_date):
+                    year_files.append(path)
+            if year_files:
+                files[year] = year_files
+        return files
+
+    @staticmethod
+    def file_overlaps(dataset:DataSet, file_date:datetime.date, start_date:datetime.date, end_date:datetime.date) -> bool:
+        """
+        :param dataset: the dataset
+        :param file_date: the date of a file, parsed from its path, or None if the date is unknown
+        :param start_date: the first date of a range
+        :param end_date: the last date of a range
+        :return: True if the time step held in the file overlaps the range, or if the file's date is unknown
+        """
+        if file_date is None:
+            return True
+        if dataset.get_temporal_resolution() == "monthly":
+            # a monthly file may be dated at the start or the middle of the month, but covers the whole month
+            file_start = datetime.date(file_date.year, file_date.month, 1)
+            file_end = datetime.date(file_date.year, file_date.month,
+                                     calendar.monthrange(file_date.year, file_date.month)[1])
+        else:
+            file_start = file_end = file_date
+        return file_end >= start_date and file_start <= end_date
+
+    @staticmethod
+    def estimate_secs_per_step(dataset:DataSet, bounds:tuple[float,float,float,float], n_variables:int) -> float:
+        """
+        :param dataset: the dataset
+        :param bounds: the (lon_min, lon_max, lat_min, lat_max) bounding box to process
+        :param n_variables: the number of variables to process
+        :return: the estimated time to process one time step
+        """
+        (lon_min, lon_max, lat_min, lat_max) = bounds
+        resolution = float(dataset.spatial_resolution)
+        cells = max(1.0, (lon_max - lon_min) / resolution) * max(1.0, (lat_max - lat_min) / resolution)
+        return cells * max(1, n_variables) * Config.TASK_SECS_PER_MCELL / 1e6
+
+    @staticmethod
+    def count_time_steps(dataset:DataSet, start_date:datetime.date, end_date:datetime.date) -> int:
+        """
+        :return: the number of time steps of the dataset between two dates (inclusive)
+        """
+        if dataset.get_temporal_resolution() == "monthly":
+            return (end_date.year - start_date.year) * 12 + end_date.month - start_date.month + 1
+        return (end_date - start_date).days + 1
+
+    @staticmethod
+    def choose_chunk_months(dataset:DataSet, secs_per_step:float, n_years:int) -> int:
+        """
+        Choose the length of the period covered by each task, the longest whose estimated cost is within the target
+
+        :param dataset: the dataset
+        :param secs_per_step: the estimated time to process one time step
+        :param n_years: the number of years requested
+        :return: the number of months per task, one of 1, 3, 12 or a multiple of 12
+        """
+        steps_per_month = 1 if dataset.get_temporal_resolution() == "monthly" else 365.25 / 12
+        chosen = 1
+        for months in [1, 3, 12] + [12 * years for years in range(2, n_years + 1)]:
+            if Config.TASK_OVERHEAD_SECS + secs_per_step * steps_per_month * months > Config.TASK_TARGET_SECS:
+                break
+            chosen = months
+        return chosen
+
+    @staticmethod
+    def split_periods(start_date:datetime.date, end_date:datetime.date, chunk_months:int) \
+            -> list[tuple[datetime.date,datetime.date,str]]:
+        """
+        Split a range of dates into periods aligned to calendar months, quarters or years
+
+        :param start_date: the first date
+        :param end_date: the last date
+        :param chunk_months: the number of months per period (1, 3, 12 or a multiple of 12)
+        :return: a list of (first date, last date, label) tuples
+        """
+        periods = []
+        if chunk_months >= 12:
+            years = chunk_months // 12
+            for year in range(start_date.year, end_date.year + 1, years):
+                last_year = min(year + years - 1, end_date.year)
+                label = str(year) if year == last_year else f"{year}-{last_year}"
+                periods.append((max(start_date, datetime.date(year, 1, 1)),
+                                min(end_date, datetime.date(last_year, 12, 31)), label))
+            return periods
+        year = start_date.year
+        month = start_date.month - (start_date.month - 1) % chunk_months
+        while datetime.date(year, month, 1) <= end_date:
+            last_month = month + chunk_months - 1
+            if chunk_months == 3:
+                label = f"{year}-Q{(month + 2) // 3}"
+            else:
+                label = f"{year}-{month:02d}"
+            periods.append((max(start_date, datetime.date(year, month, 1)),
+                            min(end_date, datetime.date(year, last_month, calendar.monthrange(year, last_month)[1])),
+                            label))
+            (year, month) = (year + 1, 1) if last_month == 12 else (year, last_month + 1)
+        return periods
+
+    @staticmethod
+    def split_bounds(bounds:tuple[float,float,float,float], n_tiles:int, resolution:float) \
+            -> list[tuple[float,float,float,float]]:
+        """
+        Split a bounding box into a grid of roughly equal tiles, with edges aligned to the dataset's grid
+
+        :param bounds: the (lon_min, lon_max, lat_min, lat_max) bounding box
+        :param n_tiles: the minimum number of tiles required
+        :param resolution: the spatial resolution in degrees
+        :return: a list of tile bounding boxes, fewer than n_tiles if the box is too small to split further
+        """
+        (lon_min, lon_max, lat_min, lat_max) = bounds
+        n_lon = math.ceil(math.sqrt(n_tiles))
+        n_lat = math.ceil(n_tiles / n_lon)
+
+        def edges(low, high, n):
+            cells = max(1, round((high - low) / resolution))
+            return sorted(set([round(low + round(cells * idx / n) * resolution, 6) for idx in range(n)] + [high]))
+
+        lon_edges = edges(lon_min, lon_max, n_lon)
+        lat_edges = edges(lat_min, lat_max, n_lat)
+        return [(lon_edges[x], lon_edges[x + 1], lat_edges[y], lat_edges[y + 1])
+                for y in range(len(lat_edges) - 1) for x in range(len(lon_edges) - 1)]
+
+    def plan(self, dataset:DataSet, start_date:datetime.date, end_date:datetime.date,
+             bounds:tuple[float,float,float,float], n_variables:int, allow_tiling:bool=False) -> list[PlannedTask]:
+        """
+        Divide the work for one dataset into tasks, skipping periods without input files
+
+        :param dataset: the dataset
+        :param start_date: the first date requested by the job
+        :param end_date: the last date requested by the job
+        :param bounds: the (lon_min, lon_max, lat_min, lat_max) bounding box requested by the job
+        :param n_variables: the number of the dataset's variables requested by the job
+        :param allow_tiling: whether tasks exceeding the target duration may be split into spatial tiles
+        :return: a list of the planned tasks
+        """
+        coverage = TaskPlanner.clamp_to_coverage(dataset, start_date, end_date)
+        if coverage is None:
+            return []
+        (start_date, end_date) = coverage
+        files = self.find_files(dataset, start_date, end_date)
+
+        secs_per_step = TaskPlanner.estimate_secs_per_step(dataset, bounds, n_variables)
+        chunk_months = TaskPlanner.choose_chunk_months(dataset, secs_per_step, end_date.year - start_date.year + 1)
+
+        planned_tasks = []
+        for (period_start, period_end, label) in TaskPlanner.split_periods(start_date, end_date, chunk_months):
+            in_files = []
+            for year in range(period_start.year, period_end.year + 1):
+                for path in files.get(year, []):
+                    # files whose date is unknown are passed to every task in their year
+                    dt = InventoryScanner.parse_date(dataset.location, path, year)
+                    if TaskPlanner.file_overlaps(dataset, dt, period_start, period_end):
+                        in_files.append(path)
+            if not in_files:
+                continue
+            n_steps = TaskPlanner.count_time_steps(dataset, period_start, period_end)
+            estimated_secs = Config.TASK_OVERHEAD_SECS + secs_per_step * n_steps
+            tiles = []
+            if allow_tiling and estimated_secs > Config.TASK_TARGET_SECS:
+                n_tiles = min(Config.TASK_MAX_TILES, math.ceil(
+                    (estimated_secs - Config.TASK_OVERHEAD_SECS) / (Config.TASK_TARGET_SECS - Config.TASK_OVERHEAD_SECS)))
+                tile_bounds = TaskPlanner.split_bounds(bounds, n_tiles, float(dataset.spatial_resolution))
+                if len(tile_bounds) > 1:
+                    tiles = [(tile, round(Config.TASK_OVERHEAD_SECS + n_steps *
+                                          TaskPlanner.estimate_secs_per_step(dataset, tile, n_variables), 1))
+                             for tile in tile_bounds]
+                    # the merge task only reads and writes the output
+                    estimated_secs = Config.TASK_OVERHEAD_SECS
+            planned_tasks.append(PlannedTask(period_start, period_end, in_files, label, round(estimated_secs, 1), tiles))
+        return planned_tasks
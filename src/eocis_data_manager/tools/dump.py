@@ -34,10 +34,10 @@ if __name__ == '__main__':
     print("Jobs/Tasks:")
     with JobOperations(store) as jo:
         print("\tJobs:")
-        for job in jo.list_jobs():
+        for job in jo.iter_jobs(with_spec=False):
             print(f"\t\t{job}")
         print("\tTasks:")
-        for task in jo.list_tasks():
+        for (task, submitter_id, job_state) in jo.iter_tasks(with_spec=False):
             print(f"\t\t{task}")
         print("\tTask Queue:")
         for task_id in jo.get_queued_taskids():
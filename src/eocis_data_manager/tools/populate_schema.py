@@ -20,24 +20,20 @@ import os
 
 from eocis_data_manager.store import Store
 from eocis_data_manager.schema_operations import SchemaOperations
+from eocis_data_manager.yaml_cache import YamlCache
 
 folder = os.path.split(__file__)[0]
 
 def populate_schema(from_path:str):
     """
-    Reload the schema tables (bundles, datasets, variables) from YAML files
+    Update the schema tables (bundles, datasets, variables) from YAML files
 
     :param from_path: folder containing bundles and datasets sub-directories containing YAML files
     """
     store = Store()
     with SchemaOperations(store) as ops:
-        # save the old end dates for each dataset
-        end_dates = ops.get_dataset_end_dates()
-        # rebuild the schema (with empty end dates)
+        # apply the differences between the YAML files and the stored schema, preserving the end date of each dataset
         ops.populate_schema(from_path)
-        # restore the original end dates for each dataset (if they exist in the new schema)
-        for (dataset_id, end_date) in end_dates.items():
-            ops.update_dataset_end_date(dataset_id, end_date)
 
 if __name__ == '__main__':
 
@@ -47,4 +43,5 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
 
+    YamlCache.enable_disk_cache()
     populate_schema(args.schema_folder)
\ No newline at end of file
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import time
+
+from eocis_data_manager.store import Store
+from eocis_data_manager.schema_operations import SchemaOperations
+from eocis_data_manager.inventory_scanner import InventoryScanner
+
+
+def scan_inventory(dataset_id=None, rescan_all=False):
+    """
+    Update the inventory of files available for each dataset
+
+    :param dataset_id: only scan this dataset, if provided
+    :param rescan_all: rescan all years, not just those whose directories have changed
+    """
+    store = Store()
+    with SchemaOperations(store) as ops:
+        datasets = [dataset for dataset in ops.list_datasets() if dataset_id is None or dataset.dataset_id == dataset_id]
+    if dataset_id is not None and len(datasets) == 0:
+        raise Exception(f"Unable to find dataset with id {dataset_id}")
+
+    scanner = InventoryScanner(store)
+    for dataset in datasets:
+        start_time = time.monotonic()
+        summary = scanner.scan(dataset, rescan_all)
+        print("%-32s %8.2fs  years scanned=%d unchanged=%d removed=%d, unparsed files=%d" % (
+            dataset.dataset_id, time.monotonic() - start_time, summary["scanned"], summary["unchanged"],
+            summary["removed"], summary["unparsed"]))
+
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset-id", default=None)
+    parser.add_argument("--rescan-all", action="store_true", help="rescan all years, even if unchanged")
+
+    args = parser.parse_args()
+
+    scan_inventory(args.dataset_id, args.rescan_all)
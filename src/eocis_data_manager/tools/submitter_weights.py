@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from eocis_data_manager.store import Store
+from eocis_data_manager.job_operations import JobOperations
+
+
+def submitter_weights(submitter_id=None, weight=None, reset=False):
+    """
+    Set or reset the weight of a submitter under the fair_share queue policy, then print all submitter weights
+
+    :param submitter_id: the submitter whose weight is to be changed, if provided
+    :param weight: the new weight
+    :param reset: restore the default weight of the submitter
+    """
+    store = Store()
+    with JobOperations(store) as jo:
+        if submitter_id is not None:
+            jo.set_submitter_weight(submitter_id, None if reset else weight)
+        for (submitter, submitter_weight) in sorted(jo.get_submitter_weights().items()):
+            print("%-32s %g" % (submitter, submitter_weight))
+
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--submitter-id", default=None)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--weight", type=float, default=None, help="the submitter's relative share of task slots")
+    group.add_argument("--reset", action="store_true", help="restore the default weight (1)")
+
+    args = parser.parse_args()
+    if args.submitter_id is not None and args.weight is None and not args.reset:
+        parser.error("--submitter-id requires --weight or --reset")
+
+    submitter_weights(args.submitter_id, args.weight, args.reset)
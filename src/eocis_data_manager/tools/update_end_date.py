@@ -17,61 +17,201 @@ import glob
 #    You should have received a copy of the GNU Affero General Public License
 #    along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import xarray as xr
-import datetime
+"""
+Find the end date of each dataset from the newest file matching its location pattern, and record it in the datasets
+table.  Datasets are examined concurrently in a pool of worker processes.  Only the time coordinate of one file
+(the last file, in path order, of the latest year for which any files exist) is read for each dataset.
+
+With --from-inventory, end dates are instead looked up from the inventory maintained by scan_inventory.py, without
+reading any files.
+"""
+
 import calendar
+import concurrent.futures
+import datetime
+import glob
+import math
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 from eocis_data_manager.store import Store
 from eocis_data_manager.schema_operations import SchemaOperations
-
-
-def update_end_date(dataset_id=None):
+from eocis_data_manager.inventory_operations import InventoryOperations
+
+
+# seconds to wait for results from worker processes, beyond the timeout allowed for each dataset
+RESULT_GRACE_SECS = 30
+
+
+def find_newest_file(location:str, start_year:int):
+    """
+    Find the newest file matching a dataset location pattern, searching backwards from the current year
+
+    :param location: the dataset location pattern, which may include {YEAR}, {MONTH} and {DAY}
+    :param start_year: the first year of the dataset
+    :return: the path of the last matching file in the latest year that has any files, or None if no files match
+    """
+    year = datetime.datetime.now().year
+    while year >= start_year:
+        paths = glob.glob(location.replace("{YEAR}",str(year)).replace("{MONTH}","*").replace("{DAY}","*"))
+        if paths:
+            # paths are organised by date, so the last in sorted order contains the latest data
+            return max(paths)
+        year -= 1
+    return None
+
+
+def read_end_date(path:str, temporal_resolution:str) -> datetime.date:
+    """
+    Read the last value of the time coordinate from a file
+
+    :param path: path to a netcdf4 file
+    :param temporal_resolution: the dataset's temporal resolution, "daily" or "monthly"
+    :return: the date of the last time step in the file
+    """
+    import xarray as xr
+
+    # open_dataset is lazy, only the time coordinate is read
+    with xr.open_dataset(path) as ds:
+        last_ts = ds["time"].values[-1]
+    if hasattr(last_ts, "year"):
+        # a cftime object, for files using a non-standard calendar
+        end_dt = datetime.date(last_ts.year, last_ts.month, last_ts.day)
+    else:
+        end_dt = last_ts.astype("datetime64[D]").astype(datetime.date)
+    return end_of_period(end_dt, temporal_resolution)
+
+
+def end_of_period(end_dt:datetime.date, temporal_resolution:str) -> datetime.date:
+    """
+    :param end_dt: the date of the last time step of a dataset
+    :param temporal_resolution: the dataset's temporal resolution, "daily" or "monthly"
+    :return: the last date covered by the time step
+    """
+    if temporal_resolution == "monthly":
+        # some datasets set the timestamp to be the start or the middle of the month, not the end
+        # round up the end date to the end of the month
+        (_,days_in_month) = calendar.monthrange(end_dt.year,end_dt.month)
+        end_dt = datetime.date(end_dt.year,end_dt.month, days_in_month)
+    return end_dt
+
+
+def on_timeout(signum, frame):
+    raise TimeoutError("timed out")
+
+
+def find_end_date(dataset_id:str, location:str, start_year:int, temporal_resolution:str, timeout:int):
+    """
+    Find the end date of a dataset, run in a worker process
+
+    :param dataset_id: the id of the dataset
+    :param location: the dataset location pattern
+    :param start_year: the first year of the dataset
+    :param temporal_resolution: the dataset's temporal resolution
+    :param timeout: give up if the end date is not found within this many seconds
+    :return: a tuple (dataset_id, end date or None, path of the file used or an error message, elapsed seconds)
+    """
+    start_time = time.monotonic()
+    signal.signal(signal.SIGALRM, on_timeout)
+    signal.alarm(timeout)
+    try:
+        path = find_newest_file(location, start_year)
+        if path is None:
+            return (dataset_id, None, "no files found", time.monotonic() - start_time)
+        return (dataset_id, read_end_date(path, temporal_resolution), path, time.monotonic() - start_time)
+    except Exception as ex:
+        return (dataset_id, None, f"{type(ex).__name__}: {ex}", time.monotonic() - start_time)
+    finally:
+        signal.alarm(0)
+
+
+def wait_for_results(dataset_ids, futures, deadline:float):
+    """
+    Collect the results of find_end_date from worker processes, giving up on any not returned by a deadline
+
+    :param dataset_ids: the id of the dataset examined by each future
+    :param futures: the futures returned when find_end_date was submitted for each dataset
+    :param deadline: the time (from time.monotonic) after which to stop waiting
+    :return: a list of (dataset_id, end date or None, path of the file used or an error message, elapsed seconds) tuples
+    """
+    start_time = time.monotonic()
+    results = []
+    for (dataset_id, future) in zip(dataset_ids, futures):
+        try:
+            results.append(future.result(timeout=max(0.0, deadline - time.monotonic())))
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            results.append((dataset_id, None, "timed out waiting for worker", time.monotonic() - start_time))
+    return results
+
+
+def find_end_dates_from_inventory(store, datasets):
+    """
+    Look up the end date of each dataset in the inventory
+
+    :param store: the Store holding the inventory
+    :param datasets: the datasets
+    :return: a list of (dataset_id, end date or None, source or error message, elapsed seconds) tuples
+    """
+    results = []
+    with InventoryOperations(store) as ops:
+        for dataset in datasets:
+            start_time = time.monotonic()
+            end_dt = ops.get_end_date(dataset.dataset_id)
+            if end_dt is None:
+                results.append((dataset.dataset_id, None, "no files in inventory", time.monotonic() - start_time))
+            else:
+                results.append((dataset.dataset_id, end_of_period(end_dt, dataset.get_temporal_resolution()),
+                                "inventory", time.monotonic() - start_time))
+    return results
+
+
+def update_end_date(dataset_id=None, workers=None, timeout=300, from_inventory=False):
+    """
+    Find and record the end date of each dataset
+
+    :param dataset_id: only update this dataset, if provided
+    :param workers: the number of worker processes, defaults to the number of CPUs
+    :param timeout: the maximum time to spend on each dataset, in seconds
+    :param from_inventory: look up end dates in the inventory instead of reading files
+    """
     store = Store()
 
-    processed = 0
     with SchemaOperations(store) as ops:
         datasets = ops.list_datasets()
-    for dataset in datasets:
-
-        current_year = datetime.datetime.now().year
-
-        if dataset_id is None or dataset.dataset_id == dataset_id:
-            print("Obtaining End Date for Dataset=%s"%dataset.dataset_id)
-            year = current_year
-            found = False
-            while year >= dataset.start_date.year and not found:
-                location = dataset.location.replace("{YEAR}",str(year)).replace("{MONTH}","*").replace("{DAY}","*")
-                print(location)
-                if len(glob.glob(location)) > 0:
-                    # this can take some time
-                    print("Obtaining End Date for Dataset=%s from %s" % (dataset.dataset_id, location))
-                    ds = xr.open_mfdataset(location,concat_dim="time",combine="nested",combine_attrs="drop_conflicts",data_vars=[dataset.variables[0].variable_id])
-
-                    last_ts = ds["time"].values.tolist()[-1]
-
-                    end_dt = datetime.datetime.fromtimestamp(last_ts / 1e9).date()
-                    if dataset.get_temporal_resolution() == "monthly":
-                        # some datasets set the timestamp to be the start or the middle of the month, not the end
-                        # round up the end date to the end of the month
-                        (_,days_in_month) = calendar.monthrange(end_dt.year,end_dt.month)
-                        end_dt = datetime.date(end_dt.year,end_dt.month, days_in_month)
-                    ds.close()
-
-                    print("Set End Date for Dataset=%s: %s" % (dataset.dataset_id, Store.encode_date(end_dt)))
-                    with SchemaOperations(store) as ops:
-                        ops.update_dataset_end_date(dataset.dataset_id, end_dt)
-                    processed += 1
-                    found = True
-                else:
-                    year -= 1
-            if not found:
-                print("Failed to obtain End Date for Dataset=%s" % dataset.dataset_id)
-
-
-    if dataset_id is not None and processed == 0:
+    datasets = [dataset for dataset in datasets if dataset_id is None or dataset.dataset_id == dataset_id]
+    if dataset_id is not None and len(datasets) == 0:
         raise Exception(f"Unable to find dataset with id {dataset_id}")
 
-
+    start_time = time.monotonic()
+    if from_inventory:
+        results = find_end_dates_from_inventory(store, datasets)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        try:
+            futures = [executor.submit(find_end_date, dataset.dataset_id, dataset.location, dataset.start_date.year,
+                                       dataset.get_temporal_resolution(), timeout) for dataset in datasets]
+            # each worker gives up on a dataset after timeout seconds, allow for datasets queued behind others and
+            # for a worker stuck where the alarm cannot interrupt it (for example, in a read from a hung file system)
+            rounds = math.ceil(len(datasets) / (workers or os.cpu_count() or 1))
+            deadline = start_time + timeout * rounds + RESULT_GRACE_SECS
+            results = wait_for_results([dataset.dataset_id for dataset in datasets], futures, deadline)
+        finally:
+            # do not wait for workers that have timed out
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    updated = 0
+    with SchemaOperations(store) as ops:
+        for (dataset_id, end_dt, detail, elapsed) in results:
+            if end_dt is not None:
+                ops.update_dataset_end_date(dataset_id, end_dt)
+                updated += 1
+                print("%-32s %8.2fs  End Date=%s (from %s)" % (dataset_id, elapsed, Store.encode_date(end_dt), detail))
+            else:
+                print("%-32s %8.2fs  Failed to obtain End Date: %s" % (dataset_id, elapsed, detail))
+    print("Updated %d of %d datasets in %.2fs" % (updated, len(results), time.monotonic() - start_time))
 
 
 if __name__ == '__main__':
@@ -79,7 +219,10 @@ if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--dataset-id",default=None)
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--timeout", type=int, default=300, help="maximum time in seconds to spend on each dataset")
+    parser.add_argument("--from-inventory", action="store_true", help="look up end dates in the inventory (see scan_inventory.py)")
 
     args = parser.parse_args()
 
-    update_end_date(args.dataset_id)
\ No newline at end of file
+    update_end_date(args.dataset_id, args.workers, args.timeout, args.from_inventory)
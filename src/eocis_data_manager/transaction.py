@@ -16,8 +16,14 @@
 #    You should have received a copy of the GNU Affero General Public License
 #    along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import uuid
+
+
 class Transaction:
 
+    # default number of rows fetched from the server per round trip when iterating over a server-side cursor
+    ITERSIZE = 2000
+
     def __init__(self, store):
         self.store = store
         self.conn = store.open_connection()
@@ -26,12 +32,15 @@ class Transaction:
         return self
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
-        if exc_type is None:
-            self.commit()
-            return True
-        else:
-            self.rollback()
-            return False
+        try:
+            if exc_type is None:
+                self.commit()
+                return True
+            else:
+                self.rollback()
+                return False
+        finally:
+            self.close()
 
     def commit(self):
         self.conn.commit()
@@ -39,9 +48,40 @@ class Transaction:
     def rollback(self):
         self.conn.rollback()
 
+    def close(self):
+        """Return this transaction's connection to the store's pool.  Any uncommitted work is rolled back."""
+        if self.conn is not None:
+            self.store.release_connection(self.conn)
+            self.conn = None
+
     def collect_results(self, curs):
         rows = []
         column_names = [column[0] for column in curs.description]
         for row in curs.fetchall():
             rows.append({v1: v2 for (v1, v2) in zip(column_names, row)})
         return rows
+
+    def open_server_cursor(self, itersize=None):
+        """
+        Open a named (server-side) cursor, which fetches query results from the server in batches rather than all at once.
+        The cursor can only be used within this transaction.
+
+        :param itersize: number of rows to fetch per round trip, defaults to Transaction.ITERSIZE
+        """
+        curs = self.conn.cursor(name="iter_" + uuid.uuid4().hex)
+        curs.itersize = itersize or Transaction.ITERSIZE
+        return curs
+
+    def iterate_results(self, curs):
+        """
+        Generate a dictionary for each result row of an executed query, without holding all rows in memory.
+        The cursor is closed when all rows have been generated.
+        """
+        try:
+            column_names = None
+            for row in curs:
+                if column_names is None:
+                    column_names = [column[0] for column in curs.description]
+                yield {v1: v2 for (v1, v2) in zip(column_names, row)}
+        finally:
+            curs.close()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+The yaml_cache module parses the YAML files describing bundles and datasets, using the libyaml based C loader when
+it is available, and keeps a cache of parsed files so that only files that have changed (according to their
+size and modification time) are parsed again.  The cache is held in memory unless an on-disk cache is enabled, by
+setting Config.CATALOG_CACHE_PATH or (as the command line tools do) calling YamlCache.enable_disk_cache.
+"""
+
+import copy
+import logging
+import os
+import pickle
+import threading
+
+import yaml
+
+try:
+    from yaml import CLoader as Loader
+except ImportError:
+    from yaml import Loader
+
+from .config import Config
+
+
+class YamlCache:
+
+    default_cache = None
+    default_cache_lock = threading.Lock()
+
+    # location of the on-disk cache enabled by enable_disk_cache, unless Config.CATALOG_CACHE_PATH is set
+    DISK_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "eocis_data_manager", "catalog_cache.pickle")
+
+    def __init__(self, cache_path:str=None):
+        """
+        Create a cache of parsed YAML files
+
+        :param cache_path: path of the file used to persist the cache between runs, or None to cache only in memory
+        """
+        self.cache_path = cache_path
+        self.logger = logging.getLogger("YamlCache")
+        self.lock = threading.Lock()
+        self.entries = None     # maps absolute path => (size, mtime_ns, parsed object)
+        self.dirty = False
+        self.parse_count = 0
+
+    @staticmethod
+    def get_default() -> "YamlCache":
+        """
+        :return: the cache shared by this process, persisted to Config.CATALOG_CACHE_PATH (if set)
+        """
+        with YamlCache.default_cache_lock:
+            if YamlCache.default_cache is None:
+                YamlCache.default_cache = YamlCache(Config.CATALOG_CACHE_PATH)
+            return YamlCache.default_cache
+
+    @staticmethod
+    def enable_disk_cache(cache_path:str=None):
+        """
+        Persist the cache shared by this process between runs
+
+        :param cache_path: the cache file, defaults to Config.CATALOG_CACHE_PATH or YamlCache.DISK_CACHE_PATH
+        """
+        with YamlCache.default_cache_lock:
+            YamlCache.default_cache = YamlCache(cache_path or Config.CATALOG_CACHE_PATH or YamlCache.DISK_CACHE_PATH)
+
+    def load(self, path:str):
+        """
+        Load a YAML file, returning the parsed object from the cache if the file has not changed since it was cached.
+
+        :param path: the path to the YAML file
+        :return: the parsed contents of the file
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self.lock:
+            self.__read_cache()
+            entry = self.entries.get(path, None)
+            if entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+                return copy.deepcopy(entry[2])
+
+        with open(path) as f:
+            obj = yaml.load(f.read(), Loader=Loader)
+
+        with self.lock:
+            self.parse_count += 1
+            self.entries[path] = (st.st_size, st.st_mtime_ns, obj)
+            self.dirty = True
+        return copy.deepcopy(obj)
+
+    def flush(self):
+        """Write the cache to disk, if it has been modified since it was read"""
+        with self.lock:
+            if not self.dirty or self.cache_path is None:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+                tmp_path = self.cache_path + ".%d.tmp" % os.getpid()
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(self.entries, f)
+                os.replace(tmp_path, self.cache_path)
+                self.dirty = False
+            except OSError as ex:
+                self.logger.warning(f"Unable to write YAML cache {self.cache_path}: {ex}")
+
+    def __read_cache(self):
+        # called with the lock held
+        if self.entries is not None:
+            return
+        self.entries = {}
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return
+        if hasattr(os, "getuid") and os.stat(self.cache_path).st_uid != os.getuid():
+            # only unpickle a file written by this user
+            self.logger.warning(f"Ignoring YAML cache {self.cache_path} which is owned by another user")
+            return
+        try:
+            with open(self.cache_path, "rb") as f:
+                entries = pickle.load(f)
+            if not isinstance(entries, dict):
+                raise Exception("unexpected contents")
+        except Exception as ex:
+            self.logger.warning(f"Ignoring unreadable YAML cache {self.cache_path}: {ex}")
+            return
+        # drop the entries of files that have been deleted, so that the cache does not keep growing
+        self.entries = {path: entry for (path, entry) in entries.items() if os.path.exists(path)}
+        self.dirty = len(self.entries) != len(entries)
@@ -9,10 +9,11 @@ class StoreTest:
 
     def __init__(self):
         self.path = tempfile.NamedTemporaryFile(suffix=".db").name
+        self.connection_string = "dbname=eocistest user=eocistest"
         print(self.path)
 
     def get_store(self):
-        return Store("dbname=eocistest user=eocistest")
+        return Store(self.connection_string).initialise()
 
     def __enter__(self):
         os.system(f'initdb -D "{self.path}"')
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import unittest
+import datetime
+
+from eocis_data_manager.async_store import AsyncStore
+from eocis_data_manager.async_job_operations import AsyncJobOperations
+from eocis_data_manager.async_schema_operations import AsyncSchemaOperations
+from eocis_data_manager.job_operations import JobOperations
+from eocis_data_manager.schema_operations import SchemaOperations
+from eocis_data_manager.job import Job
+from eocis_data_manager.task import Task
+from store_test import StoreTest
+
+schema_folder = os.path.join(os.path.split(__file__)[0], "schema")
+
+
+class TestAsyncStore(unittest.IsolatedAsyncioTestCase):
+
+    async def test_jobs(self):
+        """Check that jobs are created, retrieved, updated and removed through the asyncio interface"""
+        with StoreTest() as st:
+            st.get_store()
+            store = AsyncStore(st.connection_string)
+            try:
+                submission_date = datetime.datetime(2023, 1, 2, 3, 4, 5)
+                async with AsyncJobOperations(store) as jo:
+                    for idx in range(3):
+                        job = Job.create({"SUBMITTER_ID": f"submitter{idx % 2}", "BUNDLE_ID": "ocean"}, job_id=f"job{idx}")
+                        await jo.create_job(job.set_submission_datetime(submission_date + datetime.timedelta(hours=idx)))
+
+                async with AsyncJobOperations(store) as jo:
+                    job = await jo.get_job("job0")
+                    self.assertEqual(job.get_submitter_id(), "submitter0")
+                    self.assertEqual(job.get_spec(), {"SUBMITTER_ID": "submitter0", "BUNDLE_ID": "ocean"})
+                    self.assertEqual(job.get_submission_datetime(), submission_date)
+                    self.assertEqual(job.get_state(), Job.STATE_NEW)
+                    self.assertIsNone(job.get_completion_datetime())
+                    self.assertIsNone(await jo.get_job("job9"))
+                    self.assertTrue(await jo.job_exists("job1"))
+                    self.assertFalse(await jo.job_exists("job9"))
+
+                    completion_date = datetime.datetime(2023, 1, 3)
+                    await jo.update_job(job.set_state(Job.STATE_COMPLETED).set_completion_datetime(completion_date))
+
+                async with AsyncJobOperations(store) as jo:
+                    job = await jo.get_job("job0")
+                    self.assertEqual(job.get_state(), Job.STATE_COMPLETED)
+                    self.assertEqual(job.get_completion_datetime(), datetime.datetime(2023, 1, 3))
+
+                    jobs = await jo.list_jobs(states=[Job.STATE_NEW], with_spec=False)
+                    self.assertEqual(sorted(job.get_job_id() for job in jobs), ["job1", "job2"])
+                    self.assertIsNone(jobs[0].get_spec())
+                    jobs = await jo.list_jobs_by_submitter_id("submitter0")
+                    self.assertEqual([job.get_job_id() for job in jobs], ["job0", "job2"])
+
+                    self.assertEqual(await jo.count_jobs_by_state([Job.STATE_NEW]), 2)
+                    self.assertEqual(await jo.count_jobs_by_state([Job.STATE_NEW, Job.STATE_COMPLETED]), 3)
+
+                    await jo.remove_job("job2")
+                    self.assertFalse(await jo.job_exists("job2"))
+            finally:
+                await store.close()
+
+    async def test_tasks(self):
+        """Check that tasks are retrieved, queued and counted through the asyncio interface"""
+        with StoreTest() as st:
+            s = st.get_store()
+            with JobOperations(s) as t:
+                t.create_job(Job.create({"SUBMITTER_ID": "submitter0"}, job_id="job0"))
+                t.create_tasks_bulk([Task.create({"YEAR": 2000 + idx}, "job0", task_name=f"task{idx}") for idx in range(3)])
+                task = t.get_task("job0", "task0")
+                t.update_task(task.set_failed("error"))
+
+            store = AsyncStore(st.connection_string)
+            try:
+                async with AsyncJobOperations(store) as jo:
+                    task = await jo.get_task("job0", "task0")
+                    self.assertEqual(task.get_spec(), {"YEAR": 2000})
+                    self.assertEqual(task.get_state(), Task.STATE_FAILED)
+                    self.assertEqual(task.get_error(), "error")
+                    self.assertIsNone(await jo.get_task("job0", "task9"))
+
+                    tasks = await jo.list_job_tasks("job0", with_spec=False)
+                    self.assertEqual(sorted(task.get_task_name() for task in tasks), ["task0", "task1", "task2"])
+                    self.assertIsNone(tasks[0].get_spec())
+
+                    self.assertEqual(await jo.get_task_counts("job0"), {"NEW": 2, "RUNNING": 0, "COMPLETED": 0, "FAILED": 1})
+                    self.assertEqual(await jo.count_tasks_by_state([Task.STATE_NEW, Task.STATE_FAILED]), 3)
+                    await jo.queue_task("job0", "task1")
+
+                with JobOperations(s) as t:
+                    self.assertEqual(t.get_queued_taskids(), [("job0", "task1")])
+
+                # tasks are removed with their job
+                async with AsyncJobOperations(store) as jo:
+                    await jo.remove_job("job0")
+                    self.assertEqual(await jo.list_job_tasks("job0"), [])
+                    self.assertEqual(await jo.get_task_counts(), {"NEW": 0, "RUNNING": 0, "COMPLETED": 0, "FAILED": 0})
+            finally:
+                await store.close()
+
+    async def test_rollback(self):
+        """Check that an exception raised within a transaction rolls back its changes and returns the connection"""
+        with StoreTest() as st:
+            st.get_store()
+            store = AsyncStore(st.connection_string, pool_max_size=1)
+            try:
+                with self.assertRaises(ValueError):
+                    async with AsyncJobOperations(store) as jo:
+                        await jo.create_job(Job.create({"SUBMITTER_ID": "submitter0"}, job_id="job0"))
+                        self.assertTrue(await jo.job_exists("job0"))
+                        raise ValueError("abandon the transaction")
+
+                # the only connection in the pool has been returned, and the job was not created
+                async with AsyncJobOperations(store) as jo:
+                    self.assertFalse(await jo.job_exists("job0"))
+                    self.assertEqual(await jo.count_jobs_by_state(Job.get_all_states()), 0)
+
+                # an explicit rollback discards the changes made so far
+                async with AsyncJobOperations(store) as jo:
+                    await jo.create_job(Job.create({"SUBMITTER_ID": "submitter0"}, job_id="job1"))
+                    await jo.rollback()
+                    self.assertFalse(await jo.job_exists("job1"))
+            finally:
+                await store.close()
+
+    async def test_schema(self):
+        """Check that bundles and datasets are read through the asyncio interface"""
+        with StoreTest() as st:
+            s = st.get_store()
+            with SchemaOperations(s) as so:
+                so.populate_schema(schema_folder)
+                bundles = so.list_bundles()
+                datasets = so.list_datasets()
+
+            store = AsyncStore(st.connection_string)
+            try:
+                async with AsyncSchemaOperations(store) as aso:
+                    self.assertEqual(await aso.list_bundles(), bundles)
+                    self.assertEqual(sorted(await aso.list_datasets(), key=lambda d: d.dataset_id),
+                                     sorted(datasets, key=lambda d: d.dataset_id))
+                    self.assertEqual((await aso.get_bundle("ocean")).dataset_ids, ["sst", "oc"])
+                    self.assertIsNone(await aso.get_bundle("missing"))
+                    dataset = await aso.get_dataset("sst")
+                    self.assertEqual(dataset.dataset_name, "Sea Surface Temperatures")
+                    self.assertEqual(dataset.get_variable("sst").variable_name, "Sea Surface Temperature")
+                    self.assertIsNone(await aso.get_dataset("missing"))
+            finally:
+                await store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import threading
+import unittest
+
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+
+from eocis_data_manager.connection_pool import ConnectionPool
+
+
+class FakeCursor:
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql):
+        if self.conn.on_execute is not None:
+            self.conn.on_execute()
+        if self.conn.broken:
+            raise Exception("connection lost")
+
+    def fetchall(self):
+        return [(1,)]
+
+
+class FakeConnection:
+    """Stand in for a psycopg2 connection, implementing only what the pool uses"""
+
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.status = TRANSACTION_STATUS_IDLE
+        self.rollbacks = 0
+        self.on_execute = None
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def test_reuse(self):
+        """Check that a returned connection is handed out again rather than opening a new one"""
+        pool = ConnectionPool(FakeConnection, min_size=1, max_size=2)
+        conn1 = pool.checkout()
+        pool.checkin(conn1)
+        conn2 = pool.checkout()
+        self.assertIs(conn1, conn2)
+        stats = pool.get_stats()
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertEqual(stats["created"], 1)
+        self.assertEqual(stats["in_use"], 1)
+
+    def test_rollback_on_checkin(self):
+        """Check that uncommitted work is rolled back when a connection is returned"""
+        pool = ConnectionPool(FakeConnection)
+        conn = pool.checkout()
+        conn.status = TRANSACTION_STATUS_INTRANS
+        pool.checkin(conn)
+        self.assertEqual(conn.rollbacks, 1)
+
+    def test_discard_closed(self):
+        """Check that closed connections are not returned to the pool"""
+        pool = ConnectionPool(FakeConnection)
+        conn = pool.checkout()
+        conn.close()
+        pool.checkin(conn)
+        self.assertIsNot(pool.checkout(), conn)
+        self.assertEqual(pool.get_stats()["created"], 2)
+
+    def test_health_check(self):
+        """Check that a connection failing its health check is replaced"""
+        pool = ConnectionPool(FakeConnection, health_check_after=0)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        conn.broken = True
+        self.assertIsNot(pool.checkout(), conn)
+        self.assertEqual(pool.get_stats()["failed_health_checks"], 1)
+
+    def test_health_check_unlocked(self):
+        """Check that the health check query runs without blocking other users of the pool"""
+        pool = ConnectionPool(FakeConnection, health_check_after=0)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        lock_free = []
+
+        def try_lock():
+            # the lock is reentrant, so try to take it from another thread
+            if pool.lock.acquire(blocking=False):
+                pool.lock.release()
+                lock_free.append(True)
+            else:
+                lock_free.append(False)
+
+        def on_execute():
+            thread = threading.Thread(target=try_lock)
+            thread.start()
+            thread.join()
+
+        conn.on_execute = on_execute
+        self.assertIs(pool.checkout(), conn)
+        self.assertEqual(lock_free, [True])
+
+    def test_close_all(self):
+        """Check that close_all closes idle connections at once and checked out connections when they are returned"""
+        pool = ConnectionPool(FakeConnection, max_size=2)
+        (conn1, conn2) = (pool.checkout(), pool.checkout())
+        pool.checkin(conn1)
+        pool.close_all()
+        self.assertEqual(conn1.closed, 1)
+        self.assertEqual(conn2.closed, 0)
+        pool.checkin(conn2)
+        self.assertEqual(conn2.closed, 1)
+        self.assertEqual(pool.get_stats()["idle"], 0)
+
+    def test_idle_timeout(self):
+        """Check that idle connections above the minimum size are closed"""
+        pool = ConnectionPool(FakeConnection, min_size=1, max_size=3, idle_timeout=0)
+        conns = [pool.checkout() for _ in range(3)]
+        for conn in conns:
+            pool.checkin(conn)
+        pool.checkout()
+        stats = pool.get_stats()
+        self.assertEqual(stats["closed"], 2)
+        self.assertEqual(stats["in_use"] + stats["idle"], 1)
+
+    def test_bounded(self):
+        """Check that checkout waits for a connection when the pool is full, and times out"""
+        pool = ConnectionPool(FakeConnection, min_size=0, max_size=1, checkout_timeout=0.1)
+        conn = pool.checkout()
+        with self.assertRaises(Exception):
+            pool.checkout()
+
+        timer = threading.Timer(0.05, lambda: pool.checkin(conn))
+        pool.checkout_timeout = 5
+        timer.start()
+        self.assertIs(pool.checkout(), conn)
+        timer.join()
+        self.assertEqual(pool.get_stats()["waits"], 2)
+        self.assertEqual(pool.get_stats()["created"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+import datetime
+import os
+import tempfile
+import unittest
+
+from eocis_data_manager.dataset import DataSet, Variable
+from eocis_data_manager.schema_operations import SchemaOperations
+from eocis_data_manager.inventory_operations import InventoryOperations
+from eocis_data_manager.inventory_scanner import InventoryScanner
+
+from store_test import StoreTest
+
+
+class TestInventory(unittest.TestCase):
+
+    def test_bitmap(self):
+        """Check that dates are encoded and decoded from the per-year availability bitmap"""
+        dates = [datetime.date(2020,1,1), datetime.date(2020,2,29), datetime.date(2020,12,31)]
+        bitmap = InventoryOperations.encode_bitmap(2020, dates + [datetime.date(2021,1,1)])
+        self.assertEqual(len(bitmap), 46)
+        self.assertEqual(InventoryOperations.decode_bitmap(2020, bitmap), dates)
+
+    def test_parse_date(self):
+        """Check that file dates are determined from the location pattern or the file name"""
+        location = "/data/sst/{YEAR}/{MONTH}/{DAY}/*.nc"
+        self.assertEqual(InventoryScanner.year_directory_pattern(location, 2020), "/data/sst/2020")
+        self.assertEqual(InventoryScanner.parse_date(location, "/data/sst/2020/02/29/sst.nc", 2020),
+                         datetime.date(2020,2,29))
+        location = "/data/oc/{YEAR}/*.nc"
+        self.assertEqual(InventoryScanner.parse_date(location, "/data/oc/2020/OC-20200317-fv6.0.nc", 2020),
+                         datetime.date(2020,3,17))
+        self.assertEqual(InventoryScanner.parse_date(location, "/data/oc/2020/OC-202003-fv6.0.nc", 2020),
+                         datetime.date(2020,3,1))
+        self.assertIsNone(InventoryScanner.parse_date(location, "/data/oc/2020/OC.nc", 2020))
+
+    def test_scan(self):
+        """Check that the scanner records available dates and only rescans changed years"""
+        with tempfile.TemporaryDirectory() as tmpdir, StoreTest() as st:
+            s = st.get_store()
+            dataset = DataSet("sst", "SST", "daily", "0.05", datetime.date(2020,1,1), None,
+                              os.path.join(tmpdir, "{YEAR}", "{MONTH}", "{DAY}", "*.nc"), {},
+                              [Variable("analysed_sst", "SST", {})])
+            with SchemaOperations(s) as so:
+                so.create_dataset(dataset)
+
+            def add_file(dt):
+                folder = os.path.join(tmpdir, "%04d" % dt.year, "%02d" % dt.month, "%02d" % dt.day)
+                os.makedirs(folder, exist_ok=True)
+                open(os.path.join(folder, "sst.nc"), "w").close()
+
+            add_file(datetime.date(2020,6,1))
+            add_file(datetime.date(2021,3,5))
+            scanner = InventoryScanner(s)
+            self.assertEqual(scanner.scan(dataset)["scanned"], 2)
+            self.assertEqual(scanner.scan(dataset)["unchanged"], 2)
+
+            add_file(datetime.date(2021,3,6))
+            summary = scanner.scan(dataset)
+            self.assertEqual((summary["scanned"], summary["unchanged"]), (1, 1))
+
+            with InventoryOperations(s) as ops:
+                self.assertEqual(ops.get_end_date("sst"), datetime.date(2021,3,6))
+                self.assertEqual(ops.get_available_dates("sst", datetime.date(2020,1,1), datetime.date(2021,3,5)),
+                                 [datetime.date(2020,6,1), datetime.date(2021,3,5)])
+                self.assertEqual(ops.get_available_years("sst"), [2020, 2021])
+
+
+if __name__ == '__main__':
+    unittest.main()
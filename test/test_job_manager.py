@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import datetime
+import os
+import tempfile
+import unittest
+
+from eocis_data_manager.bundle import Bundle
+from eocis_data_manager.config import Config
+from eocis_data_manager.dataset import DataSet, Variable
+from eocis_data_manager.job import Job
+from eocis_data_manager.job_manager import JobManager
+from eocis_data_manager.job_operations import JobOperations
+from eocis_data_manager.schema_operations import SchemaOperations
+
+from store_test import StoreTest
+
+
+class TestJobManager(unittest.TestCase):
+
+    def setUp(self):
+        self.output_path = Config.OUTPUT_PATH
+
+    def tearDown(self):
+        Config.OUTPUT_PATH = self.output_path
+
+    def test_tiled_paths(self):
+        """Check that the tile and merge folders of datasets in the same job do not overlap"""
+        with tempfile.TemporaryDirectory() as tmpdir, StoreTest() as st:
+            s = st.get_store()
+            Config.OUTPUT_PATH = os.path.join(tmpdir, "joboutput")
+            with SchemaOperations(s) as so:
+                for (dataset_id, variable_id) in [("sst", "analysed_sst"), ("oc", "chlor_a")]:
+                    folder = os.path.join(tmpdir, dataset_id, "2020")
+                    os.makedirs(folder)
+                    open(os.path.join(folder, f"{dataset_id}-20200101.nc"), "w").close()
+                    # a high resolution global dataset, so that a month of data is split into tiles
+                    so.create_dataset(DataSet(dataset_id, dataset_id, "daily", "0.01", datetime.date(2020,1,1),
+                                              datetime.date(2020,12,31),
+                                              os.path.join(tmpdir, dataset_id, "{YEAR}", "*.nc"), {},
+                                              [Variable(variable_id, variable_id, {})]))
+                so.create_bundle(Bundle("ocean", "Ocean", {}, ["sst", "oc"]))
+
+            job_spec = {"SUBMITTER_ID": "submitter0", "BUNDLE_ID": "ocean", "VARIABLES": ["sst:analysed_sst", "oc:chlor_a"],
+                        "START_YEAR": "2020", "START_MONTH": "1", "END_YEAR": "2020", "END_MONTH": "1",
+                        "OUTPUT_FORMAT": "netcdf4"}
+            with JobOperations(s) as jo:
+                jo.create_job(Job.create(job_spec, job_id="job0"))
+            JobManager(s).create_tasks("job0")
+
+            with JobOperations(s) as jo:
+                tasks = jo.list_job_tasks("job0")
+            merge_tasks = [task for task in tasks if task.get_task_type() == "merge"]
+            tile_tasks = [task for task in tasks if "MERGE_TASK" in task.get_spec()]
+            self.assertEqual(len(merge_tasks), 2)
+            self.assertEqual(set(task.get_spec()["CHUNK"] for task in merge_tasks), {"2020-01"})
+            self.assertGreater(len(tile_tasks), 2)
+
+            # each merge task collects only the output of its own tiles
+            for merge_task in merge_tasks:
+                tile_paths = [task.get_spec()["OUT_PATH"] for task in tile_tasks
+                              if task.get_spec()["MERGE_TASK"] == merge_task.get_task_name()]
+                self.assertEqual(sorted(tile_paths), sorted(merge_task.get_spec()["TILE_PATHS"]))
+
+            # no output folder is the same as, or inside, another
+            out_paths = [task.get_spec()["OUT_PATH"] for task in merge_tasks + tile_tasks]
+            for (idx, path) in enumerate(out_paths):
+                for other in out_paths[idx+1:]:
+                    self.assertNotIn(os.path.commonpath([path, other]), (path, other))
+
+    def test_input_paths(self):
+        """Check that IN_PATH is only given to tasks covering a single year, and IN_FILES lists every input file"""
+        with tempfile.TemporaryDirectory() as tmpdir, StoreTest() as st:
+            s = st.get_store()
+            Config.OUTPUT_PATH = os.path.join(tmpdir, "joboutput")
+            location = os.path.join(tmpdir, "sst", "{YEAR}", "*.nc")
+            paths = []
+            for year in [2020, 2021]:
+                os.makedirs(os.path.join(tmpdir, "sst", str(year)))
+                paths.append(os.path.join(tmpdir, "sst", str(year), f"sst-{year}0101.nc"))
+                open(paths[-1], "w").close()
+            with SchemaOperations(s) as so:
+                so.create_dataset(DataSet("sst", "sst", "daily", "0.05", datetime.date(2020,1,1),
+                                          datetime.date(2021,12,31), location, {},
+                                          [Variable("analysed_sst", "analysed_sst", {})]))
+                so.create_bundle(Bundle("ocean", "Ocean", {}, ["sst"]))
+
+            # a small area, so that the whole period is processed by one task
+            job_spec = {"SUBMITTER_ID": "submitter0", "BUNDLE_ID": "ocean", "VARIABLES": ["sst:analysed_sst"],
+                        "START_YEAR": "2020", "END_YEAR": "2021", "LON_MIN": "0", "LON_MAX": "1", "LAT_MIN": "0",
+                        "LAT_MAX": "1", "OUTPUT_FORMAT": "netcdf4"}
+            with JobOperations(s) as jo:
+                jo.create_job(Job.create(job_spec, job_id="job0"))
+                jo.create_job(Job.create(dict(job_spec, END_YEAR="2020"), job_id="job1"))
+            JobManager(s).create_tasks("job0")
+            JobManager(s).create_tasks("job1")
+
+            with JobOperations(s) as jo:
+                tasks = jo.list_job_tasks("job0")
+                self.assertEqual(len(tasks), 1)
+                self.assertEqual(tasks[0].get_spec()["CHUNK"], "2020-2021")
+                self.assertEqual(tasks[0].get_spec()["IN_FILES"], paths)
+                self.assertNotIn("IN_PATH", tasks[0].get_spec())
+
+                tasks = jo.list_job_tasks("job1")
+                self.assertEqual(len(tasks), 1)
+                self.assertEqual(tasks[0].get_spec()["IN_FILES"], paths[:1])
+                self.assertEqual(tasks[0].get_spec()["IN_PATH"], os.path.join(tmpdir, "sst", "2020", "*.nc"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -25,6 +25,7 @@ from eocis_data_manager.store import Store
 from eocis_data_manager.schema_operations import SchemaOperations
 from eocis_data_manager.dataset import DataSet, Variable
 from eocis_data_manager.bundle import Bundle
+from eocis_data_manager.schema_cache import SchemaCache
 
 from store_test import StoreTest
 
@@ -56,6 +57,61 @@ class TestSchema(unittest.TestCase):
             self.assert_equal_with_sort(bundles,bundles_from_file,lambda b: b.bundle_id)
             self.assert_equal_with_sort(datasets, datasets_from_file, lambda d: d.dataset_id)
 
+    def test_repopulate(self):
+        """Check that reloading an unchanged schema makes no changes and preserves end dates"""
+        with StoreTest() as st:
+            s = st.get_store()
+            with SchemaOperations(s) as so:
+                so.populate_schema(schema_folder)
+                so.update_dataset_end_date("sst", datetime.date(2022, 12, 31))
+                generation = so.get_catalog_generation()
+
+            with SchemaOperations(s) as so:
+                so.populate_schema(schema_folder)
+                self.assertEqual(so.get_catalog_generation(), generation)
+                self.assertEqual(so.get_dataset("sst").end_date, datetime.date(2022, 12, 31))
+
+                # remove a dataset from the bundle and change a variable
+                datasets = DataSet.load_datasets(os.path.join(schema_folder, "datasets"))
+                bundles = Bundle.load_bundles(os.path.join(schema_folder, "bundles"))
+                bundles[0].dataset_ids = ["sst"]
+                sst = [dataset for dataset in datasets if dataset.dataset_id == "sst"][0]
+                sst.variables[0].variable_name = "SST"
+                self.assertTrue(so.update_catalog(datasets, bundles))
+                self.assertEqual(so.get_bundle("ocean").dataset_ids, ["sst"])
+                self.assertEqual(so.get_dataset("sst").get_variable(sst.variables[0].variable_id).variable_name, "SST")
+                self.assertEqual(so.get_dataset("sst").end_date, datetime.date(2022, 12, 31))
+                self.assertFalse(so.update_catalog(datasets, bundles))
+
+    def test_schema_cache(self):
+        """Check that cached datasets are reloaded after the catalog is modified"""
+        with StoreTest() as st:
+            s = st.get_store()
+            with SchemaOperations(s) as so:
+                so.populate_schema(schema_folder)
+
+            cache = SchemaCache(s, check_interval=3600)
+            dataset = cache.get_dataset("sst")
+            self.assertEqual(dataset.end_date, None)
+            self.assertIs(cache.get_dataset("sst"), dataset)
+            self.assertEqual(cache.get_bundle("ocean").dataset_ids, ["sst", "oc"])
+
+            with SchemaOperations(s) as so:
+                so.update_dataset_end_date("sst", datetime.date(2022, 12, 31))
+
+            # the change is not seen until the generation is checked
+            self.assertIs(cache.get_dataset("sst"), dataset)
+            cache.validate()
+            self.assertEqual(cache.get_dataset("sst").end_date, datetime.date(2022, 12, 31))
+
+            # setting the same end date again does not invalidate the cache
+            with SchemaOperations(s) as so:
+                generation = so.get_catalog_generation()
+                self.assertFalse(so.update_dataset_end_date("sst", datetime.date(2022, 12, 31)))
+                self.assertEqual(so.get_catalog_generation(), generation)
+                self.assertTrue(so.update_dataset_end_date("sst", datetime.date(2023, 1, 31)))
+                self.assertEqual(so.get_catalog_generation(), generation + 1)
+
     def assert_equal_with_sort(self,list1,list2,key_fn):
         """Check that two lists contain the identical elements, when sorted according to the specified key"""
         self.assertEqual(len(list1), len(list2))
@@ -80,6 +136,15 @@ class TestSchema(unittest.TestCase):
         self.assertEqual(dataset.variables[2],Variable("sea_ice_fraction", "Sea Ice Fraction",{}))
         self.assertEqual(dataset.variables[3],Variable("sea_fraction", "Sea Fraction",{}))
 
+    def test_get_variable(self):
+        """Check that variables are looked up by id, including after the variable list is replaced"""
+        dataset = DataSet.load_dataset_from_file(os.path.join(schema_folder,"datasets","sst.yaml"))
+        self.assertEqual(dataset.get_variable("sea_fraction").variable_name, "Sea Fraction")
+        self.assertIsNone(dataset.get_variable("missing"))
+        dataset.variables = [Variable("missing", "Missing", {})]
+        self.assertEqual(dataset.get_variable("missing").variable_name, "Missing")
+        self.assertIsNone(dataset.get_variable("sea_fraction"))
+
     def test_load_bundle(self):
         """Check that information is correctly loaded from a bundle YAML specification"""
         bundle_path = os.path.join(schema_folder,"bundles","ocean.yaml")
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+import unittest
+
+from eocis_data_manager.spec_codec import SpecCodec
+
+
+class TestSpecCodec(unittest.TestCase):
+
+    def test_backends(self):
+        """Check that each installed JSON backend encodes and decodes specs compatibly with the others"""
+        spec = {"BUNDLE_ID": "ocean", "VARIABLES": ["sst:analysed_sst"], "LAT_MIN": -90.0, "LON_MAX": 180,
+                "NAME": "café", "NESTED": {"A": [1, None, True]}}
+        default_backend = SpecCodec.backend
+        try:
+            encoded = {}
+            for backend in SpecCodec.BACKENDS:
+                SpecCodec.use_backend(backend)
+                encoded[backend] = SpecCodec.encode(spec)
+                self.assertIsInstance(encoded[backend], str)
+                self.assertEqual(SpecCodec.decode(encoded[backend]), spec)
+                self.assertEqual(SpecCodec.decode(encoded[backend].encode("utf-8")), spec)
+            for backend in SpecCodec.BACKENDS:
+                SpecCodec.use_backend(backend)
+                for text in encoded.values():
+                    self.assertEqual(SpecCodec.decode(text), spec)
+        finally:
+            SpecCodec.use_backend(default_backend)
+
+        with self.assertRaises(Exception):
+            SpecCodec.use_backend("missing")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+import datetime
+import os
+import tempfile
+import unittest
+
+from eocis_data_manager.config import Config
+from eocis_data_manager.dataset import DataSet, Variable
+from eocis_data_manager.task_planner import TaskPlanner
+from eocis_data_manager.inventory_scanner import InventoryScanner
+from eocis_data_manager.inventory_operations import InventoryOperations
+from eocis_data_manager.schema_operations import SchemaOperations
+
+from store_test import StoreTest
+
+
+def make_dataset(location, start_date=datetime.date(2020,1,1), end_date=datetime.date(2021,6,30)):
+    return DataSet("sst", "SST", "daily", "0.05", start_date, end_date, location, {},
+                   [Variable("analysed_sst", "SST", {})])
+
+
+class TestTaskPlanner(unittest.TestCase):
+
+    def test_job_dates(self):
+        """Check that the job's requested dates are clamped to the dataset's coverage"""
+        spec = {"START_YEAR": "2019", "START_MONTH": "3", "START_DAY": "1", "END_YEAR": "2022", "END_MONTH": "2"}
+        (start_date, end_date) = TaskPlanner.get_job_dates(spec)
+        self.assertEqual((start_date, end_date), (datetime.date(2019,3,1), datetime.date(2022,2,28)))
+        dataset = make_dataset("/data/{YEAR}/*.nc")
+        self.assertEqual(TaskPlanner.clamp_to_coverage(dataset, start_date, end_date),
+                         (datetime.date(2020,1,1), datetime.date(2021,6,30)))
+        self.assertIsNone(TaskPlanner.clamp_to_coverage(dataset, datetime.date(2022,1,1), datetime.date(2022,12,31)))
+
+    def test_plan(self):
+        """Check that tasks are only planned for years with files, and list the files in their period"""
+        with tempfile.TemporaryDirectory() as tmpdir, StoreTest() as st:
+            for dt in [datetime.date(2020,1,1), datetime.date(2020,3,1), datetime.date(2021,7,1)]:
+                folder = os.path.join(tmpdir, str(dt.year))
+                os.makedirs(folder, exist_ok=True)
+                open(os.path.join(folder, dt.strftime("SST-%Y%m%d.nc")), "w").close()
+            os.makedirs(os.path.join(tmpdir, "2019"))
+
+            planner = TaskPlanner(st.get_store())
+            dataset = make_dataset(os.path.join(tmpdir, "{YEAR}", "*.nc"), start_date=datetime.date(2019,1,1))
+            planned_tasks = planner.plan(dataset, datetime.date(2019,1,1), datetime.date(2021,12,31), (0,1,0,1), 1)
+            # a small area is cheap to process, so all years are merged into one task.  2019 has no files and the
+            # 2021 file is after the dataset's end date
+            self.assertEqual(len(planned_tasks), 1)
+            self.assertEqual(planned_tasks[0].label, "2019-2021")
+            self.assertEqual((planned_tasks[0].start_date, planned_tasks[0].end_date),
+                             (datetime.date(2019,1,1), datetime.date(2021,6,30)))
+            self.assertEqual(planned_tasks[0].in_files, [os.path.join(tmpdir, "2020", "SST-20200101.nc"),
+                                                         os.path.join(tmpdir, "2020", "SST-20200301.nc")])
+
+            # a global area is split into shorter periods, periods without files are skipped
+            planned_tasks = planner.plan(dataset, datetime.date(2019,1,1), datetime.date(2021,12,31), (-180,180,-90,90), 1)
+            self.assertEqual([planned_task.label for planned_task in planned_tasks], ["2020-Q1"])
+            self.assertEqual(planned_tasks[0].tiles, [])
+
+            # with tiling, a global area at high resolution is split into tiles
+            planned_tasks = planner.plan(dataset, datetime.date(2020,1,1), datetime.date(2020,1,31),
+                                         (-180,180,-90,90), 20, allow_tiling=True)
+            self.assertEqual(len(planned_tasks), 1)
+            self.assertGreater(len(planned_tasks[0].tiles), 1)
+            self.assertLessEqual(len(planned_tasks[0].tiles), Config.TASK_MAX_TILES)
+
+    def test_plan_undated_files(self):
+        """Check that years whose files cannot be dated are planned, and only empty scanned years are skipped"""
+        with tempfile.TemporaryDirectory() as tmpdir, StoreTest() as st:
+            s = st.get_store()
+            os.makedirs(os.path.join(tmpdir, "2019"))
+            os.makedirs(os.path.join(tmpdir, "2020"))
+            undated_path = os.path.join(tmpdir, "2020", "SST.nc")
+            open(undated_path, "w").close()
+
+            dataset = make_dataset(os.path.join(tmpdir, "{YEAR}", "*.nc"), start_date=datetime.date(2019,1,1),
+                                   end_date=datetime.date(2020,12,31))
+            with SchemaOperations(s) as so:
+                so.create_dataset(dataset)
+            InventoryScanner(s).scan(dataset)
+            with InventoryOperations(s) as ops:
+                self.assertEqual(ops.get_available_years("sst"), [])
+                self.assertEqual(ops.get_empty_years("sst"), [2019])
+
+            planner = TaskPlanner(s)
+            self.assertEqual(planner.find_files(dataset, datetime.date(2019,1,1), datetime.date(2020,12,31)),
+                             {2020: [undated_path]})
+            planned_tasks = planner.plan(dataset, datetime.date(2019,1,1), datetime.date(2020,12,31), (0,1,0,1), 1)
+            self.assertEqual([planned_task.in_files for planned_task in planned_tasks], [[undated_path]])
+
+    def test_find_monthly_files(self):
+        """Check that monthly files are found for a range of dates starting or ending part way through a month"""
+        with tempfile.TemporaryDirectory() as tmpdir, StoreTest() as st:
+            os.makedirs(os.path.join(tmpdir, "2020"))
+            paths = {}
+            for month in range(1, 13):
+                # some datasets date monthly files at the start of the month and some in the middle
+                dt = datetime.date(2020, month, 1 if month % 2 else 15)
+                paths[month] = os.path.join(tmpdir, "2020", dt.strftime("OC-%Y%m%d-fv6.0.nc"))
+                open(paths[month], "w").close()
+
+            dataset = DataSet("oc", "OC", "monthly", "0.05", datetime.date(2020,1,1), datetime.date(2020,12,31),
+                              os.path.join(tmpdir, "{YEAR}", "*.nc"), {}, [Variable("chlor_a", "Chlorophyll-a", {})])
+            planner = TaskPlanner(st.get_store())
+            self.assertEqual(planner.find_files(dataset, datetime.date(2020,3,15), datetime.date(2020,6,10)),
+                             {2020: [paths[month] for month in [3, 4, 5, 6]]})
+            self.assertEqual(planner.find_files(dataset, datetime.date(2020,12,31), datetime.date(2020,12,31)),
+                             {2020: [paths[12]]})
+
+            # a monthly file covers its whole month, a daily file only covers its own date
+            self.assertTrue(TaskPlanner.file_overlaps(dataset, datetime.date(2020,3,1), datetime.date(2020,3,15),
+                                                      datetime.date(2020,3,20)))
+            daily_dataset = make_dataset(dataset.location)
+            self.assertFalse(TaskPlanner.file_overlaps(daily_dataset, datetime.date(2020,3,1),
+                                                       datetime.date(2020,3,15), datetime.date(2020,3,20)))
+            self.assertTrue(TaskPlanner.file_overlaps(daily_dataset, None, datetime.date(2020,3,15),
+                                                      datetime.date(2020,3,20)))
+
+    def test_plan_monthly(self):
+        """Check that each task of a job starting or ending part way through a month lists the files for its months"""
+        with tempfile.TemporaryDirectory() as tmpdir, StoreTest() as st:
+            os.makedirs(os.path.join(tmpdir, "2020"))
+            paths = {}
+            for month in range(1, 13):
+                paths[month] = os.path.join(tmpdir, "2020", "OC-2020%02d01-fv6.0.nc" % month)
+                open(paths[month], "w").close()
+
+            dataset = DataSet("oc", "OC", "monthly", "0.05", datetime.date(2020,1,1), datetime.date(2020,12,31),
+                              os.path.join(tmpdir, "{YEAR}", "*.nc"), {}, [Variable("chlor_a", "Chlorophyll-a", {})])
+            planner = TaskPlanner(st.get_store())
+
+            # a small area is planned as a single task
+            planned_tasks = planner.plan(dataset, datetime.date(2020,3,15), datetime.date(2020,5,10), (0,1,0,1), 1)
+            self.assertEqual([planned_task.in_files for planned_task in planned_tasks], [[paths[3], paths[4], paths[5]]])
+
+            # many variables over a global area are planned as a task for each month
+            planned_tasks = planner.plan(dataset, datetime.date(2020,3,15), datetime.date(2020,5,10),
+                                         (-180,180,-90,90), 50)
+            self.assertEqual([(planned_task.label, planned_task.start_date, planned_task.end_date, planned_task.in_files)
+                              for planned_task in planned_tasks],
+                             [("2020-03", datetime.date(2020,3,15), datetime.date(2020,3,31), [paths[3]]),
+                              ("2020-04", datetime.date(2020,4,1), datetime.date(2020,4,30), [paths[4]]),
+                              ("2020-05", datetime.date(2020,5,1), datetime.date(2020,5,10), [paths[5]])])
+
+    def test_tiles(self):
+        """Check that bounding boxes are split into tiles aligned to the dataset's grid"""
+        tiles = TaskPlanner.split_bounds((-180,180,-90,90), 5, 0.05)
+        self.assertEqual(len(tiles), 6)
+        self.assertEqual(tiles[0], (-180, -60, -90, 0))
+        self.assertEqual(tiles[-1], (60, 180, 0, 90))
+        # a box only one cell wide and high cannot be split
+        self.assertEqual(TaskPlanner.split_bounds((0,0.05,0,0.05), 4, 0.05), [(0,0.05,0,0.05)])
+
+    def test_chunks(self):
+        """Check that the period covered by each task is chosen to meet the target task duration"""
+        dataset = make_dataset("/data/{YEAR}/*.nc")
+        secs_per_step = TaskPlanner.estimate_secs_per_step(dataset, (-180,180,-90,90), 1)
+        self.assertAlmostEqual(secs_per_step, 7200 * 3600 * Config.TASK_SECS_PER_MCELL / 1e6)
+        # the time per step at which one year of daily data just meets the target
+        target_steps = 0.99 * (Config.TASK_TARGET_SECS - Config.TASK_OVERHEAD_SECS) / 365.25
+        self.assertEqual(TaskPlanner.choose_chunk_months(dataset, target_steps, 10), 12)
+        self.assertEqual(TaskPlanner.choose_chunk_months(dataset, target_steps / 3, 10), 36)
+        self.assertEqual(TaskPlanner.choose_chunk_months(dataset, target_steps / 3, 2), 24)
+        self.assertEqual(TaskPlanner.choose_chunk_months(dataset, target_steps * 2, 10), 3)
+        self.assertEqual(TaskPlanner.choose_chunk_months(dataset, target_steps * 100, 10), 1)
+
+        periods = TaskPlanner.split_periods(datetime.date(2020,2,15), datetime.date(2021,1,10), 3)
+        self.assertEqual([label for (_, _, label) in periods], ["2020-Q1", "2020-Q2", "2020-Q3", "2020-Q4", "2021-Q1"])
+        self.assertEqual(periods[0][:2], (datetime.date(2020,2,15), datetime.date(2020,3,31)))
+        self.assertEqual(periods[-1][:2], (datetime.date(2021,1,1), datetime.date(2021,1,10)))
+        periods = TaskPlanner.split_periods(datetime.date(2020,2,15), datetime.date(2021,1,10), 24)
+        self.assertEqual(periods, [(datetime.date(2020,2,15), datetime.date(2021,1,10), "2020-2021")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -19,12 +19,28 @@
 
 import unittest
 
-from eocis_data_manager.job_operations import JobOperations
+from eocis_data_manager.store import Store
+from eocis_data_manager.job_operations import JobOperations, LeaseLostException
+from eocis_data_manager.config import Config
+from eocis_data_manager.job import Job
+from eocis_data_manager.task import Task
 from store_test import StoreTest
 
 
 class TestTaskQueue(unittest.TestCase):
 
+    QUEUE_SETTINGS = ["QUEUE_POLICY", "QUEUE_AGE_BOOST_SECS", "TASK_QUOTA", "JOB_QUOTA", "JOB_TASK_QUOTA",
+                      "SUBMITTER_TASK_QUOTA"]
+
+    def setUp(self):
+        # claim tasks without quotas unless a test sets them, restoring the configuration afterwards
+        self.settings = {name: getattr(Config, name) for name in TestTaskQueue.QUEUE_SETTINGS}
+        Config.TASK_QUOTA = Config.JOB_QUOTA = Config.JOB_TASK_QUOTA = Config.SUBMITTER_TASK_QUOTA = None
+
+    def tearDown(self):
+        for (name, value) in self.settings.items():
+            setattr(Config, name, value)
+
     def test_taskqueue(self):
         """Check that the task queue system works, at least from a single execution thread"""
 
@@ -67,5 +83,349 @@ class TestTaskQueue(unittest.TestCase):
                 next_task = t.get_next_task()
                 self.assertEqual(next_task,None)
 
+    def test_lazy_spec(self):
+        """Check that specs fetched as JSON text are only decoded when accessed"""
+        row = {"parent_job_id": "job0", "task_type": "subset", "task_name": "task0", "submission_date": None,
+               "remote_task_id": None, "spec": '{"YEAR": 2020}', "state": "NEW", "completion_date": None,
+               "error": "", "retry_count": 0}
+        task = JobOperations.make_task(row)
+        self.assertEqual(task.spec_text, '{"YEAR": 2020}')
+        self.assertEqual(task.get_spec(), {"YEAR": 2020})
+        self.assertIsNone(task.spec_text)
+        task.spec = {"YEAR": 2021}
+        self.assertEqual(task.get_spec(), {"YEAR": 2021})
+
+        # listings called with with_spec=False return a NULL spec
+        row["spec"] = None
+        self.assertIsNone(JobOperations.make_task(row).get_spec())
+
+    def test_claim_tasks(self):
+        """Check that claiming tasks dequeues them in order and marks them as running"""
+
+        with StoreTest() as st:
+            s = st.get_store()
+            with JobOperations(s) as t:
+                job = Job.create({"SUBMITTER_ID": "submitter0"}, job_id="job0")
+                t.create_job(job)
+                tasks = [Task.create({"YEAR": year}, "job0", task_name=f"task{year}") for year in range(2000, 2004)]
+                t.create_tasks_bulk(tasks)
+                t.queue_tasks_bulk([("job0", task.get_task_name()) for task in tasks])
+
+            with JobOperations(s) as t:
+                task = t.claim_next_task("worker0")
+                self.assertEqual(task.get_task_name(), "task2000")
+                self.assertEqual(task.get_state(), Task.STATE_RUNNING)
+                self.assertEqual(task.get_remote_task_id(), "worker0")
+                self.assertIsNotNone(task.get_submission_datetime())
+
+            with JobOperations(s) as t:
+                claimed = t.claim_tasks(5, "worker1")
+                self.assertEqual([task.get_task_name() for task in claimed], ["task2001", "task2002", "task2003"])
+                self.assertEqual(t.claim_next_task("worker1"), None)
+                self.assertEqual(t.count_tasks_by_state([Task.STATE_RUNNING], job_id="job0"), 4)
+
+    def test_wait_for_task(self):
+        """Check that a consumer waiting for a task is woken when one is queued"""
+
+        with StoreTest() as st:
+            s = st.get_store()
+            # the first call starts listening and returns immediately
+            self.assertTrue(s.wait_for_task(0.1))
+            self.assertFalse(s.wait_for_task(0.1))
+            with JobOperations(s) as t:
+                t.queue_task("job0", "task0")
+            self.assertTrue(s.wait_for_task(5))
+            self.assertFalse(s.wait_for_task(0.1))
+            s.close()
+
+    def test_state_counts(self):
+        """Check that the job and task state counts track inserts, updates and deletes"""
+
+        with StoreTest() as st:
+            s = st.get_store()
+            with JobOperations(s) as t:
+                t.create_job(Job.create({"SUBMITTER_ID": "submitter0"}, job_id="job0"))
+                t.create_tasks_bulk([Task.create({}, "job0", task_name=f"task{idx}") for idx in range(3)])
+                self.assertEqual(t.get_task_counts("job0"), {"NEW": 3, "RUNNING": 0, "COMPLETED": 0, "FAILED": 0})
+
+            with JobOperations(s) as t:
+                task = t.get_task("job0", "task0")
+                t.update_task(task.set_failed("error"))
+                self.assertEqual(t.count_tasks_by_state([Task.STATE_NEW, Task.STATE_FAILED], job_id="job0"), 3)
+                self.assertEqual(t.count_tasks_by_state([Task.STATE_FAILED]), 1)
+                self.assertEqual(t.count_jobs_by_state([Job.STATE_NEW]), 1)
+
+            with JobOperations(s) as t:
+                # move the counts across all jobs to another shard, as if they had been made by another backend
+                t.conn.cursor().execute("UPDATE state_counts SET shard = (shard + 1) %% %s WHERE job_id = ''",
+                                        (Store.STATE_COUNT_SHARDS,))
+                t.create_job(Job.create({"SUBMITTER_ID": "submitter0"}, job_id="job1"))
+                t.create_tasks_bulk([Task.create({}, "job1", task_name=f"task{idx}") for idx in range(2)])
+                self.assertEqual(t.get_task_counts(), {"NEW": 4, "RUNNING": 0, "COMPLETED": 0, "FAILED": 1})
+                self.assertEqual(t.count_tasks_by_state([Task.STATE_NEW]), 4)
+                self.assertEqual(t.count_jobs_by_state([Job.STATE_NEW]), 2)
+                self.assertEqual(t.compute_summary(), [{"TYPE": "JOB", "STATE": "NEW", "COUNT": 2},
+                                                       {"TYPE": "TASK", "STATE": "NEW", "COUNT": 4},
+                                                       {"TYPE": "TASK", "STATE": "FAILED", "COUNT": 1}])
+                t.remove_job("job1")
+
+            with JobOperations(s) as t:
+                t.remove_job("job0")
+                self.assertEqual(t.get_task_counts("job0"), {"NEW": 0, "RUNNING": 0, "COMPLETED": 0, "FAILED": 0})
+                self.assertEqual(t.count_tasks_by_state(Task.getAllStates()), 0)
+                self.assertEqual(t.compute_summary(), [])
+
+    def test_iterate(self):
+        """Check that iterating over jobs and tasks fetches every row across batches and applies the filters"""
+
+        with StoreTest() as st:
+            s = st.get_store()
+            with JobOperations(s) as t:
+                for idx in range(7):
+                    job = Job.create({"SUBMITTER_ID": f"submitter{idx % 2}", "BUNDLE_ID": f"bundle{idx % 3}"},
+                                     job_id=f"job{idx}")
+                    t.create_job(job.set_state(Job.STATE_RUNNING if idx < 4 else Job.STATE_NEW))
+                tasks = [Task.create({"N": idx}, "job0", task_name=f"task{idx}") for idx in range(11)]
+                for task in tasks[:5]:
+                    task.set_failed("error")
+                t.create_tasks_bulk(tasks)
+                t.create_tasks_bulk([Task.create({"N": idx}, "job1", task_name=f"task{idx}") for idx in range(3)])
+
+            with JobOperations(s) as t:
+                for with_spec in [True, False]:
+                    jobs = list(t.iter_jobs(itersize=2, with_spec=with_spec))
+                    self.assertEqual(sorted(job.get_job_id() for job in jobs), [f"job{idx}" for idx in range(7)])
+                    for job in jobs:
+                        if with_spec:
+                            self.assertEqual(job.get_spec()["BUNDLE_ID"], f"bundle{int(job.get_job_id()[3:]) % 3}")
+                        else:
+                            self.assertIsNone(job.get_spec())
+
+                    jobs = list(t.iter_jobs(states=[Job.STATE_RUNNING], itersize=2, with_spec=with_spec))
+                    self.assertEqual(sorted(job.get_job_id() for job in jobs), ["job0", "job1", "job2", "job3"])
+
+                    jobs = list(t.iter_jobs(states=[Job.STATE_RUNNING], spec_filter={"BUNDLE_ID": "bundle0"},
+                                            itersize=2, with_spec=with_spec))
+                    self.assertEqual(sorted(job.get_job_id() for job in jobs), ["job0", "job3"])
+
+                    tasks = list(t.iter_tasks(itersize=3, with_spec=with_spec))
+                    self.assertEqual(len(tasks), 14)
+                    self.assertEqual(sorted((task.get_job_id(), task.get_task_name()) for (task, _, _) in tasks),
+                                     sorted((task.get_job_id(), task.get_task_name())
+                                            for (task, _, _) in t.list_tasks(with_spec=with_spec)))
+                    for (task, submitter_id, job_state) in tasks:
+                        self.assertEqual(submitter_id, "submitter0" if task.get_job_id() == "job0" else "submitter1")
+                        self.assertEqual(job_state, Job.STATE_RUNNING)
+                        self.assertEqual(task.get_spec() is None, not with_spec)
+
+                    tasks = list(t.iter_tasks(states=[Task.STATE_FAILED], itersize=3, with_spec=with_spec))
+                    self.assertEqual(sorted(task.get_task_name() for (task, _, _) in tasks),
+                                     sorted(f"task{idx}" for idx in range(5)))
+
+                    tasks = list(t.iter_job_tasks("job0", itersize=4, with_spec=with_spec))
+                    self.assertEqual(sorted(task.get_task_name() for task in tasks),
+                                     sorted(f"task{idx}" for idx in range(11)))
+                    for task in tasks:
+                        if with_spec:
+                            self.assertEqual(task.get_spec(), {"N": int(task.get_task_name()[4:])})
+                        else:
+                            self.assertIsNone(task.get_spec())
+                    self.assertEqual(list(t.iter_job_tasks("job9", itersize=4, with_spec=with_spec)), [])
+
+    def test_merge_tasks(self):
+        """Check that a merge task is queued only once all of its tile tasks have completed"""
+
+        with StoreTest() as st:
+            s = st.get_store()
+            with JobOperations(s) as t:
+                t.create_job(Job.create({"SUBMITTER_ID": "submitter0"}, job_id="job0"))
+                merge_task = Task.create({}, "job0", task_type="merge", task_name="merge")
+                tiles = [Task.create({"MERGE_TASK": "merge"}, "job0", task_name=f"tile{idx}") for idx in range(2)]
+                t.create_tasks_bulk(tiles + [merge_task])
+                t.queue_tasks_bulk([("job0", tile.get_task_name()) for tile in tiles])
+
+            with JobOperations(s) as t:
+                t.update_task(t.claim_next_task("worker0").set_completed())
+                t.lock_job("job0")
+                self.assertEqual(t.queue_ready_merge_tasks("job0"), 0)
+
+            with JobOperations(s) as t:
+                t.update_task(t.claim_next_task("worker0").set_completed())
+                t.lock_job("job0")
+                self.assertEqual(t.queue_ready_merge_tasks("job0"), 1)
+                self.assertEqual(t.queue_ready_merge_tasks("job0"), 0)
+                self.assertEqual(t.fail_blocked_merge_tasks("job0"), 0)
+                self.assertEqual(t.claim_next_task("worker0").get_task_name(), "merge")
+
+    def test_queue_policies(self):
+        """Check the order in which tasks are claimed under each queue policy"""
+
+        with StoreTest() as st:
+            s = st.get_store()
+            with JobOperations(s) as t:
+                # submitter A queues a large job before submitter B queues a small one
+                for (submitter, n_tasks, secs) in [("A", 3, 1000), ("B", 2, 100)]:
+                    job_id = "job" + submitter
+                    t.create_job(Job.create({"SUBMITTER_ID": submitter}, job_id=job_id))
+                    tasks = [Task.create({"ESTIMATED_SECS": secs}, job_id, task_name=f"{submitter}{idx}")
+                             for idx in range(n_tasks)]
+                    t.create_tasks_bulk(tasks)
+                    t.queue_tasks_bulk([(job_id, task.get_task_name()) for task in tasks])
+
+            def claim_order():
+                t = JobOperations(s)
+                try:
+                    return [task.get_task_name() for task in t.claim_tasks(10, "worker0")]
+                finally:
+                    t.rollback()
+
+            Config.QUEUE_AGE_BOOST_SECS = None
+            Config.QUEUE_POLICY = "fifo"
+            self.assertEqual(claim_order(), ["A0", "A1", "A2", "B0", "B1"])
+            Config.QUEUE_POLICY = "sjf"
+            self.assertEqual(claim_order(), ["B0", "B1", "A0", "A1", "A2"])
+            Config.QUEUE_POLICY = "fair_share"
+            self.assertEqual(claim_order(), ["A0", "B0", "A1", "B1", "A2"])
+
+            with JobOperations(s) as t:
+                t.set_submitter_weight("A", 2)
+                self.assertEqual(t.get_submitter_weights(), {"A": 2})
+            self.assertEqual(claim_order(), ["A0", "B0", "A1", "A2", "B1"])
+
+            # tasks already running count against their submitter's share
+            with JobOperations(s) as t:
+                t.set_submitter_weight("A", None)
+                self.assertEqual(t.claim_next_task("worker0").get_task_name(), "A0")
+            with JobOperations(s) as t:
+                self.assertEqual(t.claim_next_task("worker0").get_task_name(), "B0")
+
+    def test_claim_quotas(self):
+        """Check that claiming tasks keeps the number of running tasks within the quotas"""
+
+        with StoreTest() as st:
+            s = st.get_store()
+            with JobOperations(s) as t:
+                for (submitter, job_id) in [("A", "job0"), ("A", "job1"), ("B", "job2")]:
+                    t.create_job(Job.create({"SUBMITTER_ID": submitter}, job_id=job_id))
+                    tasks = [Task.create({}, job_id, task_name=f"task{idx}") for idx in range(3)]
+                    t.create_tasks_bulk(tasks)
+                    t.queue_tasks_bulk([(job_id, task.get_task_name()) for task in tasks])
+
+            def claim(n):
+                with JobOperations(s) as t:
+                    return [(task.get_job_id(), task.get_task_name()) for task in t.claim_tasks(n, "worker0")]
+
+            Config.QUEUE_POLICY = "fifo"
+            Config.TASK_QUOTA = 4
+            Config.JOB_QUOTA = 2
+            Config.JOB_TASK_QUOTA = 2
+            Config.SUBMITTER_TASK_QUOTA = 3
+
+            # submitter A is limited to three tasks and job2 is held back by the job quota
+            self.assertEqual(claim(10), [("job0", "task0"), ("job0", "task1"), ("job1", "task0")])
+            # submitter A has reached its quota and job2 cannot start while two jobs are running
+            self.assertEqual(claim(10), [])
+            with JobOperations(s) as t:
+                t.update_task(t.get_task("job0", "task0").set_completed())
+                t.update_task(t.get_task("job0", "task1").set_completed())
+            self.assertEqual(claim(10), [("job0", "task2"), ("job1", "task1")])
+            with JobOperations(s) as t:
+                t.update_task(t.get_task("job0", "task2").set_completed())
+            self.assertEqual(claim(10), [("job2", "task0"), ("job2", "task1")])
+            with JobOperations(s) as t:
+                self.assertEqual(t.count_tasks_by_state([Task.STATE_RUNNING]), 4)
+
+    def test_leases(self):
+        """Check that only tasks whose lease has expired are requeued"""
+
+        with StoreTest() as st:
+            s = st.get_store()
+            with JobOperations(s) as t:
+                t.create_job(Job.create({"SUBMITTER_ID": "submitter0"}, job_id="job0"))
+                tasks = [Task.create({}, "job0", task_name=f"task{idx}") for idx in range(2)]
+                t.create_tasks_bulk(tasks)
+                t.queue_tasks_bulk([("job0", task.get_task_name()) for task in tasks])
+
+            with JobOperations(s) as t:
+                (task0, task1) = t.claim_tasks(2, "worker0")
+                self.assertIsNotNone(task0.get_lease_expiry())
+                self.assertIsNotNone(task0.get_lease_id())
+                self.assertNotEqual(task0.get_lease_id(), task1.get_lease_id())
+
+            with JobOperations(s) as t:
+                # the worker may record its own start time without losing the lease
+                lease_id = task0.get_lease_id()
+                t.update_task(task0.set_running())
+                self.assertEqual(task0.get_lease_id(), lease_id)
+                self.assertEqual(t.get_task("job0", "task0").get_lease_id(), lease_id)
+                self.assertTrue(t.heartbeat(task0))
+                # let the lease on task1 expire
+                self.assertTrue(t.heartbeat(task1, lease_secs=-1))
+
+            with JobOperations(s) as t:
+                self.assertEqual(t.reset_running_tasks(), 1)
+                self.assertEqual(t.get_task("job0", "task0").get_state(), Task.STATE_RUNNING)
+                self.assertEqual(t.get_task("job0", "task1").get_state(), Task.STATE_NEW)
+                self.assertEqual(t.get_queued_taskids(), [("job0", "task1")])
+
+            # the lease on task1 is lost, even once it is claimed again by the same worker
+            with JobOperations(s) as t:
+                self.assertFalse(t.heartbeat(task1))
+                reclaimed = t.claim_next_task("worker0")
+                self.assertEqual(reclaimed.get_task_name(), "task1")
+            with JobOperations(s) as t:
+                self.assertFalse(t.heartbeat(task1))
+                self.assertTrue(t.heartbeat(reclaimed))
+                # the worker that lost the lease cannot overwrite the task
+                with self.assertRaises(LeaseLostException):
+                    t.update_task(task1.set_completed())
+                self.assertEqual(t.get_task("job0", "task1").get_state(), Task.STATE_RUNNING)
+                t.update_task(task0.set_completed())
+                self.assertIsNone(task0.get_lease_expiry())
+                self.assertIsNone(task0.get_lease_id())
+                self.assertFalse(t.heartbeat(task0))
+                self.assertEqual(t.requeue_expired_tasks(), 0)
+
+    def test_unclaimed_lease(self):
+        """Check that a task moved to RUNNING with update_task is leased, and requeued once the lease expires"""
+
+        with StoreTest() as st:
+            s = st.get_store()
+            with JobOperations(s) as t:
+                t.create_job(Job.create({"SUBMITTER_ID": "submitter0"}, job_id="job0"))
+                t.create_task(Task.create({}, "job0", task_name="task0"))
+                t.queue_task("job0", "task0")
+
+            with JobOperations(s) as t:
+                task = t.get_next_task()
+                self.assertIsNone(task.get_lease_id())
+                t.update_task(task.set_running())
+                self.assertIsNotNone(task.get_lease_expiry())
+                self.assertIsNotNone(task.get_lease_id())
+
+            with JobOperations(s) as t:
+                self.assertEqual(t.reset_running_tasks(), 0)
+                self.assertTrue(t.heartbeat(task, lease_secs=-1))
+
+            with JobOperations(s) as t:
+                self.assertEqual(t.reset_running_tasks(), 1)
+                self.assertEqual(t.get_task("job0", "task0").get_state(), Task.STATE_NEW)
+                self.assertEqual(t.get_queued_taskids(), [("job0", "task0")])
+
+    def test_select_queued(self):
+        """Check the parameters of the queue policy queries"""
+        (sql, parameters) = JobOperations.select_queued("fifo", 3600)
+        self.assertEqual(parameters, [])
+        self.assertTrue(sql.rstrip().endswith("LIMIT %s"))
+        (sql, parameters) = JobOperations.select_queued("sjf", 3600)
+        self.assertEqual(parameters, [float(Config.TASK_TARGET_SECS), 3600.0])
+        (sql, parameters) = JobOperations.select_queued("fair_share", None)
+        self.assertEqual(parameters, [])
+        (sql, parameters) = JobOperations.select_queued("fifo", None, task_quota=4, job_quota=2, job_task_quota=1)
+        self.assertEqual(parameters, [1, 2, 4])
+        self.assertTrue(sql.rstrip().endswith("LIMIT %s"))
+        with self.assertRaises(Exception):
+            JobOperations.select_queued("lifo")
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import datetime
+import os
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from eocis_data_manager.dataset import DataSet, Variable
+from eocis_data_manager.schema_operations import SchemaOperations
+from eocis_data_manager.inventory_operations import InventoryOperations
+from eocis_data_manager.tools.update_end_date import find_newest_file, end_of_period, \
+    find_end_dates_from_inventory, wait_for_results
+
+from store_test import StoreTest
+
+
+class TestUpdateEndDate(unittest.TestCase):
+
+    def test_find_newest_file(self):
+        """Check that the last file of the latest year with any files is found"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            location = os.path.join(tmpdir, "{YEAR}", "{MONTH}", "sst-{YEAR}{MONTH}{DAY}.nc")
+            self.assertIsNone(find_newest_file(location, 2000))
+
+            for dt in [datetime.date(2000, 5, 1), datetime.date(2001, 2, 3), datetime.date(2001, 11, 30),
+                       datetime.date(2001, 2, 28)]:
+                folder = os.path.join(tmpdir, "%04d" % dt.year, "%02d" % dt.month)
+                os.makedirs(folder, exist_ok=True)
+                open(os.path.join(folder, dt.strftime("sst-%Y%m%d.nc")), "w").close()
+            os.makedirs(os.path.join(tmpdir, "2003", "01"))
+
+            self.assertEqual(find_newest_file(location, 2000), os.path.join(tmpdir, "2001", "11", "sst-20011130.nc"))
+            # years before the start year are not searched
+            self.assertIsNone(find_newest_file(location, 2002))
+
+    def test_end_of_period(self):
+        """Check that monthly end dates are rounded up to the end of the month"""
+        self.assertEqual(end_of_period(datetime.date(2020, 2, 1), "monthly"), datetime.date(2020, 2, 29))
+        self.assertEqual(end_of_period(datetime.date(2021, 2, 15), "monthly"), datetime.date(2021, 2, 28))
+        self.assertEqual(end_of_period(datetime.date(2021, 12, 31), "monthly"), datetime.date(2021, 12, 31))
+        self.assertEqual(end_of_period(datetime.date(2021, 2, 15), "daily"), datetime.date(2021, 2, 15))
+
+    def test_wait_for_results(self):
+        """Check that results not returned by the deadline are reported as timed out"""
+        release = threading.Event()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(lambda: ("ds0", datetime.date(2020, 1, 1), "path", 0.0)),
+                       executor.submit(lambda: release.wait() and ("ds1", datetime.date(2020, 1, 1), "path", 0.0))]
+            results = wait_for_results(["ds0", "ds1"], futures, time.monotonic() + 0.5)
+            release.set()
+        self.assertEqual(results[0], ("ds0", datetime.date(2020, 1, 1), "path", 0.0))
+        self.assertEqual(results[1][:3], ("ds1", None, "timed out waiting for worker"))
+
+    def test_find_end_dates_from_inventory(self):
+        """Check that end dates are looked up in the inventory and rounded up to the end of each time step"""
+        with StoreTest() as st:
+            s = st.get_store()
+            datasets = [DataSet(dataset_id, dataset_id, temporal_resolution, "0.05", datetime.date(2020, 1, 1), None,
+                                f"/data/{dataset_id}/{{YEAR}}/*.nc", {}, [Variable("v", "V", {})])
+                        for (dataset_id, temporal_resolution) in [("daily", "daily"), ("monthly", "monthly"),
+                                                                  ("empty", "daily")]]
+            with SchemaOperations(s) as so:
+                for dataset in datasets:
+                    so.create_dataset(dataset)
+            with InventoryOperations(s) as ops:
+                ops.update_years("daily", [(2020, 1, [datetime.date(2020, 1, 1)], 1),
+                                           (2021, 2, [datetime.date(2021, 3, 4), datetime.date(2021, 3, 5)], 2)])
+                ops.update_years("monthly", [(2021, 3, [datetime.date(2021, 1, 1), datetime.date(2021, 2, 1)], 2)])
+                ops.update_years("empty", [(2021, 4, [], 0)])
+
+            results = find_end_dates_from_inventory(s, datasets)
+            self.assertEqual([result[:3] for result in results],
+                             [("daily", datetime.date(2021, 3, 5), "inventory"),
+                              ("monthly", datetime.date(2021, 2, 28), "inventory"),
+                              ("empty", None, "no files in inventory")])
+
+
+if __name__ == '__main__':
+    unittest.main()
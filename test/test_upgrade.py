@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import unittest
+import datetime
+
+from psycopg2 import connect
+
+from eocis_data_manager.store import Store
+from eocis_data_manager.job_operations import JobOperations
+from eocis_data_manager.schema_operations import SchemaOperations
+
+from store_test import StoreTest
+
+# the tables created by schema V1, which stored dates, timestamps, specs and states as text
+V1_TABLES = [
+    '''CREATE TABLE bundles(
+            bundle_id text,
+            bundle_name text,
+            spec text,
+            PRIMARY KEY(bundle_id));''',
+    '''CREATE TABLE datasets(
+            dataset_id text,
+            dataset_name text,
+            temporal_resolution text,
+            spatial_resolution text,
+            start_date text,
+            end_date text,
+            location text,
+            spec text,
+            PRIMARY KEY(dataset_id));''',
+    '''CREATE TABLE dataset_bundle(
+            bundle_id text,
+            dataset_id text,
+            PRIMARY KEY(bundle_id,dataset_id),
+            FOREIGN KEY(bundle_id) REFERENCES bundles(bundle_id) ON DELETE CASCADE,
+            FOREIGN KEY(dataset_id) REFERENCES datasets(dataset_id) ON DELETE CASCADE);''',
+    '''CREATE TABLE variables(
+            variable_id text,
+            dataset_id text,
+            variable_name text,
+            spec text,
+            PRIMARY KEY(variable_id,dataset_id),
+            FOREIGN KEY(dataset_id) REFERENCES datasets(dataset_id) ON DELETE CASCADE);''',
+    '''CREATE TABLE jobs(
+            job_id text,
+            submission_date text,
+            submitter_id text,
+            spec text,
+            state text,
+            completion_date text,
+            error text,
+            PRIMARY KEY(job_id));''',
+    '''CREATE TABLE tasks(
+            parent_job_id text,
+            task_type text,
+            task_name text,
+            submission_date text,
+            remote_task_id text,
+            spec text,
+            state text,
+            completion_date text,
+            error text,
+            retry_count int,
+            PRIMARY KEY(parent_job_id, task_name),
+            FOREIGN KEY(parent_job_id) REFERENCES jobs(job_id) ON DELETE CASCADE);''',
+    '''CREATE TABLE task_queue(
+            id int not null primary key generated always as identity,
+            queue_time timestamptz default now(),
+            job_id text,
+            task_name text);''',
+    '''CREATE TABLE metadata(
+            schema text,
+            creation_date text);'''
+]
+
+V1_ROWS = [
+    ("INSERT INTO metadata VALUES(%s,%s)", ("V1", "2023/01/02")),
+    ("INSERT INTO bundles VALUES(%s,%s,%s)", ("ocean", "Ocean Data Bundle", '{"key1": "value"}')),
+    ("INSERT INTO datasets VALUES(%s,%s,%s,%s,%s,%s,%s,%s)",
+        ("sst", "Sea Surface Temperatures", "daily", "0.05", "1981/09/01", "", "/path/to/data", "{}")),
+    ("INSERT INTO dataset_bundle VALUES(%s,%s)", ("ocean", "sst")),
+    ("INSERT INTO variables VALUES(%s,%s,%s,%s)", ("sst", "sst", "Sea Surface Temperature", "")),
+    ("INSERT INTO jobs VALUES(%s,%s,%s,%s,%s,%s,%s)",
+        ("job1", "2023/01/02 03:04:05", "user1", '{"BUNDLE_ID": "ocean"}', "COMPLETED", "2023/01/02 06:07:08", "")),
+    ("INSERT INTO jobs VALUES(%s,%s,%s,%s,%s,%s,%s)",
+        ("job2", "2023/01/03 00:00:00", "user2", '{"BUNDLE_ID": "ocean"}', "RUNNING", "", "")),
+    ("INSERT INTO tasks VALUES(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)",
+        ("job1", "regrid", "task1", "2023/01/02 03:04:05", "", '{"N": 1}', "COMPLETED", "2023/01/02 06:07:08", "", 0)),
+    ("INSERT INTO tasks VALUES(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)",
+        ("job1", "regrid", "task2", "2023/01/02 03:04:05", "", '{"N": 2}', "FAILED", "2023/01/02 05:00:00", "error", 2)),
+    ("INSERT INTO tasks VALUES(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)",
+        ("job2", "regrid", "task1", "2023/01/03 00:00:00", "worker1", '{"N": 3}', "RUNNING", "", "", 0)),
+    ("INSERT INTO tasks VALUES(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)",
+        ("job2", "regrid", "task2", "2023/01/03 00:00:00", "", '{"N": 4}', "NEW", "", "", 0)),
+    ("INSERT INTO task_queue(job_id, task_name) VALUES(%s,%s)", ("job2", "task2"))
+]
+
+
+class TestUpgrade(unittest.TestCase):
+
+    def test_upgrade_v1(self):
+        """Check that a database created with schema V1 is upgraded to the current schema, converting its values"""
+        with StoreTest() as st:
+            conn = connect(st.connection_string)
+            curs = conn.cursor()
+            for statement in V1_TABLES:
+                curs.execute(statement)
+            for (statement, values) in V1_ROWS:
+                curs.execute(statement, values)
+            conn.commit()
+            conn.close()
+
+            s = Store(st.connection_string).initialise()
+
+            with SchemaOperations(s) as so:
+                dataset = so.get_dataset("sst")
+                self.assertEqual(dataset.start_date, datetime.date(1981, 9, 1))
+                self.assertIsNone(dataset.end_date)
+                self.assertIsNone(dataset.get_variable("sst").spec)
+                self.assertEqual(so.get_bundle("ocean").spec, {"key1": "value"})
+                self.assertEqual(so.get_bundle("ocean").dataset_ids, ["sst"])
+
+            with JobOperations(s) as jo:
+                job1 = jo.get_job("job1")
+                self.assertEqual(job1.get_submission_datetime(), datetime.datetime(2023, 1, 2, 3, 4, 5))
+                self.assertEqual(job1.get_completion_datetime(), datetime.datetime(2023, 1, 2, 6, 7, 8))
+                self.assertEqual(job1.get_spec(), {"BUNDLE_ID": "ocean"})
+                self.assertEqual(job1.get_state(), "COMPLETED")
+                self.assertIsNone(jo.get_job("job2").get_completion_datetime())
+
+                task = jo.get_task("job1", "task2")
+                self.assertEqual(task.get_state(), "FAILED")
+                self.assertEqual(task.get_error(), "error")
+                self.assertEqual(task.get_spec(), {"N": 2})
+                self.assertEqual(task.get_completion_datetime(), datetime.datetime(2023, 1, 2, 5, 0, 0))
+                self.assertIsNone(jo.get_task("job2", "task2").get_completion_datetime())
+
+                # the running task was claimed without a lease, so it is treated as expired
+                self.assertIsNotNone(jo.get_task("job2", "task1").get_lease_expiry())
+                self.assertEqual(jo.get_queued_taskids(), [("job2", "task2")])
+
+                # the state counts are rebuilt from the existing jobs and tasks
+                self.assertEqual(jo.count_jobs_by_state(["COMPLETED"]), 1)
+                self.assertEqual(jo.count_jobs_by_state(["RUNNING"]), 1)
+                self.assertEqual(jo.get_task_counts(), {"NEW": 1, "RUNNING": 1, "COMPLETED": 1, "FAILED": 1})
+                self.assertEqual(jo.get_task_counts("job1"), {"NEW": 0, "RUNNING": 0, "COMPLETED": 1, "FAILED": 1})
+                self.assertEqual(jo.get_task_counts("job2"), {"NEW": 1, "RUNNING": 1, "COMPLETED": 0, "FAILED": 0})
+
+                # the triggers maintain the rebuilt counts
+                task = jo.get_task("job2", "task2")
+                task.set_state("COMPLETED")
+                jo.update_task(task)
+                self.assertEqual(jo.get_task_counts("job2"), {"NEW": 0, "RUNNING": 1, "COMPLETED": 1, "FAILED": 0})
+
+            conn = connect(st.connection_string)
+            curs = conn.cursor()
+            curs.execute("SELECT schema, creation_date FROM metadata")
+            (schema, creation_date) = curs.fetchone()
+            self.assertEqual(schema, Store.SCHEMA)
+            self.assertEqual(creation_date.date(), datetime.date(2023, 1, 2))
+            conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+#    EOCIS data-manager
+#    Copyright (C) 2020-2023  National Centre for Earth Observation (NCEO)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+import os
+import tempfile
+import unittest
+
+from eocis_data_manager.yaml_cache import YamlCache
+from eocis_data_manager.config import Config
+
+
+class TestYamlCache(unittest.TestCase):
+
+    def test_cache(self):
+        """Check that unchanged files are served from the cache, and changed files are parsed again"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "test.yaml")
+            cache_path = os.path.join(tmpdir, "cache", "catalog_cache.pickle")
+            with open(path, "w") as f:
+                f.write("name: first\nstart_date: 01-01-2020\n")
+
+            cache = YamlCache(cache_path)
+            self.assertEqual(cache.load(path)["name"], "first")
+            self.assertEqual(cache.load(path)["name"], "first")
+            self.assertEqual(cache.parse_count, 1)
+            cache.flush()
+
+            # a new cache reads the parsed file from disk
+            cache = YamlCache(cache_path)
+            obj = cache.load(path)
+            self.assertEqual(obj["name"], "first")
+            self.assertEqual(cache.parse_count, 0)
+
+            # modifying the returned object does not modify the cache
+            obj["name"] = "modified"
+            self.assertEqual(cache.load(path)["name"], "first")
+
+            with open(path, "w") as f:
+                f.write("name: second version\nstart_date: 01-01-2020\n")
+            self.assertEqual(cache.load(path)["name"], "second version")
+            self.assertEqual(cache.parse_count, 1)
+
+    def test_evict_deleted(self):
+        """Check that entries for deleted files are dropped when the cache is read from disk"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            paths = [os.path.join(tmpdir, f"test{idx}.yaml") for idx in range(2)]
+            cache_path = os.path.join(tmpdir, "catalog_cache.pickle")
+            for path in paths:
+                with open(path, "w") as f:
+                    f.write("name: test\n")
+
+            cache = YamlCache(cache_path)
+            for path in paths:
+                cache.load(path)
+            cache.flush()
+
+            os.remove(paths[0])
+            cache = YamlCache(cache_path)
+            cache.load(paths[1])
+            self.assertEqual(cache.parse_count, 0)
+            self.assertEqual(list(cache.entries.keys()), [os.path.abspath(paths[1])])
+
+    def test_default_in_memory(self):
+        """Check that the default cache is only persisted to disk when enabled"""
+        self.assertIsNone(Config.CATALOG_CACHE_PATH)
+        self.assertIsNone(YamlCache.get_default().cache_path)
+
+
+if __name__ == '__main__':
+    unittest.main()